@@ -8,9 +8,16 @@ Usage examples:
   # User login (will require SMS/Telegram code, and optionally 2FA password)
   python -m mcp_servers.telegram_mcp_server_py.cli_login --api-id <ID> --api-hash <HASH> --phone <PHONE> [--session-file path]
 
+  # Login straight into a persistent SQLite session (entity cache survives restarts)
+  python -m mcp_servers.telegram_mcp_server_py.cli_login --session-backend sqlite [--sqlite-session-file path] ...
+
+  # Migrate an existing session.txt into the SQLite session without logging in again
+  python -m mcp_servers.telegram_mcp_server_py.cli_login --migrate-to-sqlite [--session-file path] [--sqlite-session-file path]
+
 If arguments are omitted, the tool will try to read from .env placed next to this module
 (mcp_servers/telegram_mcp_server_py/.env): TELEGRAM_API_ID, TELEGRAM_API_HASH,
-TELEGRAM_PHONE_NUMBER, TELEGRAM_BOT_TOKEN, TELEGRAM_SESSION_FILE.
+TELEGRAM_PHONE_NUMBER, TELEGRAM_BOT_TOKEN, TELEGRAM_SESSION_FILE, TELEGRAM_SESSION_BACKEND,
+TELEGRAM_SQLITE_SESSION_FILE.
 """
 
 import sys
@@ -22,6 +29,8 @@ import os
 from telethon import TelegramClient
 from telethon.sessions import StringSession
 
+from .session_store import CachedSQLiteSession, default_sqlite_session_path, migrate_string_session
+
 
 def main() -> int:
     # Load .env if present
@@ -35,6 +44,12 @@ def main() -> int:
     parser.add_argument("--api-hash", dest="api_hash", default=os.getenv("TELEGRAM_API_HASH"))
     parser.add_argument("--phone", dest="phone", default=os.getenv("TELEGRAM_PHONE_NUMBER"))
     parser.add_argument("--session-file", dest="session_file", default=os.getenv("TELEGRAM_SESSION_FILE"))
+    parser.add_argument("--session-backend", dest="session_backend", choices=["string", "sqlite"],
+                        default=os.getenv("TELEGRAM_SESSION_BACKEND", "string"))
+    parser.add_argument("--sqlite-session-file", dest="sqlite_session_file",
+                        default=os.getenv("TELEGRAM_SQLITE_SESSION_FILE"))
+    parser.add_argument("--migrate-to-sqlite", dest="migrate_to_sqlite", action="store_true",
+                        help="Copy the existing string session into the SQLite session file and exit")
 
     args = parser.parse_args()
 
@@ -50,18 +65,33 @@ def main() -> int:
     except Exception as e:
         print(f"Warning: failed to read existing session: {e}")
 
+    sqlite_file = args.sqlite_session_file or default_sqlite_session_path()
+    if args.migrate_to_sqlite:
+        if not session_str:
+            print("No string session found to migrate:", session_file)
+            return 2
+        try:
+            migrate_string_session(session_str, sqlite_file).close()
+            print("Session migrated to SQLite:", sqlite_file)
+            return 0
+        except Exception as e:
+            print("Migration failed:", e)
+            return 1
+
+    use_sqlite = args.session_backend == "sqlite"
+
     if args.bot_token:
         # Bot auth path
         api_id = int(args.api_id or 0)
         api_hash = args.api_hash or ""
-        client = TelegramClient(StringSession(session_str), api_id, api_hash,
+        client = TelegramClient(_make_session(session_str, use_sqlite, sqlite_file), api_id, api_hash,
                                 device_model="Telegram MCP Server", system_version="1.0", app_version="0.1.0")
         print("Logging in as bot...")
         try:
             client.start(bot_token=args.bot_token)
             # Persist session
-            _persist_session(client, session_file)
-            print("Bot login successful. Session saved to:", session_file)
+            _persist_session(client, sqlite_file if use_sqlite else session_file)
+            print("Bot login successful. Session saved to:", sqlite_file if use_sqlite else session_file)
             return 0
         except Exception as e:
             print("Bot login failed:", e)
@@ -76,7 +106,7 @@ def main() -> int:
     api_hash = args.api_hash
     phone = args.phone
 
-    client = TelegramClient(StringSession(session_str), api_id, api_hash,
+    client = TelegramClient(_make_session(session_str, use_sqlite, sqlite_file), api_id, api_hash,
                             device_model="Telegram MCP Server", system_version="1.0", app_version="0.1.0")
     print("Logging in as user (you may need to enter a code and possibly 2FA password)...")
 
@@ -88,17 +118,29 @@ def main() -> int:
 
     try:
         client.start(phone=phone, code_callback=_code_callback, password=_password_callback)
-        _persist_session(client, session_file)
-        print("User login successful. Session saved to:", session_file)
+        _persist_session(client, sqlite_file if use_sqlite else session_file)
+        print("User login successful. Session saved to:", sqlite_file if use_sqlite else session_file)
         return 0
     except Exception as e:
         print("User login failed:", e)
         return 1
 
 
+def _make_session(session_str: str, use_sqlite: bool, sqlite_file: str):
+    if not use_sqlite:
+        return StringSession(session_str)
+    file_path = sqlite_file if sqlite_file.endswith(".session") else sqlite_file + ".session"
+    if session_str and not Path(file_path).exists():
+        return migrate_string_session(session_str, sqlite_file)
+    return CachedSQLiteSession(sqlite_file)
+
+
 def _persist_session(client: TelegramClient, session_file: str) -> None:
     try:
         s = client.session.save()
+        if s is None:
+            # SQLite sessions persist themselves on save()
+            return
         Path(session_file).write_text(s, encoding="utf-8")
     except Exception as e:
         print(f"Failed to save session: {e}")
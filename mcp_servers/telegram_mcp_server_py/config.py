@@ -23,6 +23,27 @@ class Config:
         "phone_number": os.getenv("TELEGRAM_PHONE_NUMBER"),
         "bot_token": os.getenv("TELEGRAM_BOT_TOKEN"),
         "session_file": os.getenv("TELEGRAM_SESSION_FILE"),
+        # "string" (session.txt) or "sqlite" (persistent entity cache, see session_store.py)
+        "session_backend": os.getenv("TELEGRAM_SESSION_BACKEND", "string"),
+        "sqlite_session_file": os.getenv("TELEGRAM_SQLITE_SESSION_FILE"),
+    }
+
+    # Directory for tg.export_history files (default: exports/ next to this package)
+    export_dir = os.getenv("TELEGRAM_EXPORT_DIR")
+
+    # Per-method Telethon rate limits: "method=rate_per_sec:burst,..." overrides the defaults below
+    rate_limits = {
+        "spec": os.getenv("TELEGRAM_RATE_LIMITS"),
+        "defaults": {
+            "get_messages": (3.0, 5.0),
+            "get_dialogs": (0.2, 1.0),
+            "send_message": (1.0, 3.0),
+            "edit_message": (1.0, 3.0),
+            "get_entity": (1.0, 3.0),
+        },
+        # FloodWait up to this many seconds is slept through and retried; longer waits go to the caller
+        "max_flood_wait": float(os.getenv("TELEGRAM_MAX_FLOOD_WAIT", "60")),
+        "flood_retries": int(os.getenv("TELEGRAM_FLOOD_RETRIES", "2")),
     }
 
 
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import gzip
+import time
+import uuid
+import sqlite3
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError, TakeoutInitDelayError
+
+
+class _JsonlGzSink:
+    """Appends messages to a gzip JSONL file. Each flush adds a gzip member, which gzip readers concatenate."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def last_id(self) -> int:
+        return 0
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        pass
+
+
+class _SqliteSink:
+    def __init__(self, path: Path):
+        self.path = path
+        # Writes run in the default executor, one batch at a time
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY, date TEXT, from_id INTEGER, sender TEXT, text TEXT)"
+        )
+        self._conn.commit()
+
+    def last_id(self) -> int:
+        row = self._conn.execute("SELECT MAX(id) FROM messages").fetchone()
+        return int(row[0] or 0) if row else 0
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO messages (id, date, from_id, sender, text) VALUES (?,?,?,?,?)",
+            [(r["id"], r.get("date"), r["from"].get("id"), r["from"].get("display"), r.get("text")) for r in rows],
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class HistoryExporter:
+    """Background export of long channel histories straight to the server's disk.
+
+    Uses a Telethon takeout session (lower flood limits for bulk reads) when possible and
+    writes messages oldest-first into a compressed JSONL (``.jsonl.gz``) or SQLite file.
+    Progress is kept in ``<file>.cursor.json``; starting an export for the same file again
+    resumes after the last written message id. Files are only written inside ``export_dir``.
+    """
+
+    def __init__(self, client: TelegramClient, serialize, export_dir: Optional[str] = None,
+                 max_flood_wait: float = 300.0):
+        self.client = client
+        self._serialize = serialize
+        self.export_dir = (Path(export_dir) if export_dir else Path(__file__).parent / "exports").resolve()
+        self.max_flood_wait = float(max_flood_wait)
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _default_path(self, chat: Any, fmt: str) -> Path:
+        safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in str(chat).lstrip("@")) or "chat"
+        return self.export_dir / (f"{safe}.sqlite" if fmt == "sqlite" else f"{safe}.jsonl.gz")
+
+    def _resolve_path(self, path: str) -> Optional[Path]:
+        """Client-supplied path, taken relative to ``export_dir``; None if it points outside of it."""
+        candidate = Path(path)
+        target = (candidate if candidate.is_absolute() else self.export_dir / candidate).resolve()
+        return target if self.export_dir in target.parents else None
+
+    @staticmethod
+    def _cursor_path(path: Path) -> Path:
+        return path.with_name(path.name + ".cursor.json")
+
+    def _load_cursor(self, path: Path) -> int:
+        try:
+            data = json.loads(self._cursor_path(path).read_text(encoding="utf-8"))
+            return int(data.get("last_id") or 0)
+        except Exception:
+            return 0
+
+    def _save_cursor(self, path: Path, job: Dict[str, Any]) -> None:
+        data = {"chat": job["chat"], "last_id": job["cursor"], "exported": job["exported"], "updated": time.time()}
+        # Replace atomically: a torn cursor would restart the export from the beginning
+        cursor_path = self._cursor_path(path)
+        tmp = cursor_path.with_name(cursor_path.name + ".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, cursor_path)
+
+    def start(self, chat: Any, fmt: str = "jsonl", path: Optional[str] = None, min_id: Optional[int] = None,
+              max_messages: Optional[int] = None, wait_time: Optional[float] = None, takeout: bool = True,
+              batch_size: int = 500) -> Dict[str, Any]:
+        fmt = "sqlite" if str(fmt).lower() == "sqlite" else "jsonl"
+        out_path = self._resolve_path(path) if path else self._default_path(chat, fmt)
+        if out_path is None:
+            return {"error": f"Export path must be inside the export directory {self.export_dir}"}
+        for job in self.jobs.values():
+            if job["path"] == str(out_path) and job["status"] == "running":
+                return dict(job)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        cursor = int(min_id) if isinstance(min_id, int) else self._load_cursor(out_path)
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "job_id": job_id, "chat": chat, "format": fmt, "path": str(out_path), "status": "running",
+            "cursor": cursor, "exported": 0, "started": time.time(), "finished": None, "error": None,
+            "retry_after": None, "takeout": bool(takeout),
+        }
+        self.jobs[job_id] = job
+        self._tasks[job_id] = asyncio.create_task(
+            self._run(job, out_path, max_messages, wait_time, bool(takeout), max(1, int(batch_size)))
+        )
+        return dict(job)
+
+    def status(self, job_id: Optional[str] = None) -> Any:
+        if job_id:
+            job = self.jobs.get(job_id)
+            if not job:
+                return {"error": f"Unknown export job: {job_id}"}
+            return self._with_rate(job)
+        return {"jobs": [self._with_rate(j) for j in self.jobs.values()]}
+
+    @staticmethod
+    def _with_rate(job: Dict[str, Any]) -> Dict[str, Any]:
+        out = dict(job)
+        elapsed = (job["finished"] or time.time()) - job["started"]
+        out["messages_per_sec"] = round(job["exported"] / elapsed, 2) if elapsed > 0 else 0.0
+        return out
+
+    async def _run(self, job: Dict[str, Any], path: Path, max_messages: Optional[int],
+                   wait_time: Optional[float], use_takeout: bool, batch_size: int) -> None:
+        sink = _SqliteSink(path) if job["format"] == "sqlite" else _JsonlGzSink(path)
+        job["cursor"] = max(job["cursor"], sink.last_id())
+        try:
+            while True:
+                try:
+                    if use_takeout:
+                        async with self.client.takeout(finalize=True, channels=True, megagroups=True, chats=True) as tk:
+                            await self._copy(tk, job, sink, path, max_messages, wait_time, batch_size)
+                    else:
+                        await self._copy(self.client, job, sink, path, max_messages, wait_time, batch_size)
+                    break
+                except TakeoutInitDelayError as e:
+                    # Telegram requires a delay before the first takeout; export without it instead of stalling
+                    print(f"Takeout unavailable for {e.seconds}s, exporting {job['chat']} without takeout",
+                          file=sys.stderr)
+                    use_takeout = False
+                    job["takeout"] = False
+                except FloodWaitError as e:
+                    if e.seconds > self.max_flood_wait:
+                        job["retry_after"] = int(e.seconds)
+                        raise
+                    print(f"Export {job['job_id']}: FloodWait {e.seconds}s, resuming from id {job['cursor']}",
+                          file=sys.stderr)
+                    await asyncio.sleep(e.seconds)
+            job["status"] = "done"
+        except asyncio.CancelledError:
+            job["status"] = "cancelled"
+            raise
+        except Exception as e:
+            job["status"] = "error"
+            job["error"] = str(e)
+            print(f"Export {job['job_id']} failed: {e}", file=sys.stderr)
+        finally:
+            job["finished"] = time.time()
+            sink.close()
+            try:
+                self._save_cursor(path, job)
+            except Exception:
+                pass
+
+    async def _copy(self, client: Any, job: Dict[str, Any], sink: Any, path: Path, max_messages: Optional[int],
+                    wait_time: Optional[float], batch_size: int) -> None:
+        remaining = None
+        if max_messages:
+            remaining = max(0, int(max_messages) - job["exported"])
+            if remaining == 0:
+                return
+        kwargs: Dict[str, Any] = {"reverse": True, "min_id": job["cursor"], "limit": remaining}
+        if wait_time is not None:
+            kwargs["wait_time"] = float(wait_time)
+        buf: List[Dict[str, Any]] = []
+        async for m in client.iter_messages(job["chat"], **kwargs):
+            buf.append(self._serialize(m))
+            if len(buf) >= batch_size:
+                await self._flush(job, sink, path, buf)
+                buf = []
+        if buf:
+            await self._flush(job, sink, path, buf)
+
+    async def _flush(self, job: Dict[str, Any], sink: Any, path: Path, rows: List[Dict[str, Any]]) -> None:
+        # Disk I/O stays off the event loop so MCP requests keep being served during long exports
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, sink.write, rows)
+        job["exported"] += len(rows)
+        job["cursor"] = max(job["cursor"], max(int(r.get("id") or 0) for r in rows))
+        await loop.run_in_executor(None, self._save_cursor, path, dict(job))
@@ -38,8 +38,10 @@ class MCPServer:
             phone_number = t.get("phone_number")
             bot_token = t.get("bot_token")
             session_file = t.get("session_file")
-            self.client = await setup_telegram_client(api_id, api_hash, phone_number, bot_token, session_file)
-            self.tools = ToolsHandler(self.client)
+            self.client = await setup_telegram_client(api_id, api_hash, phone_number, bot_token, session_file,
+                                                      session_backend=t.get("session_backend"),
+                                                      sqlite_session_file=t.get("sqlite_session_file"))
+            self.tools = ToolsHandler(self.client, rate_limits=Config.rate_limits, export_dir=Config.export_dir)
             print("Telegram client ready, tools registered.", file=sys.stderr)
             try:
                 self._ready_event.set()
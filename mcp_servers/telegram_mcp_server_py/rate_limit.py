@@ -0,0 +1,151 @@
+import sys
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telethon.errors import FloodWaitError
+
+
+class RetryAfterError(Exception):
+    """Raised when Telegram asks to wait longer than the scheduler is allowed to sleep."""
+
+    def __init__(self, method: str, seconds: float):
+        super().__init__(f"Flood wait for {method}: retry after {int(seconds)}s")
+        self.method = method
+        self.seconds = seconds
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second with up to ``burst`` stored tokens.
+
+    Waiters are served in FIFO order. ``block_for`` empties the bucket and holds every caller
+    until the given deadline (used to honour FloodWait for all pending requests of a method).
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(0.001, float(rate))
+        self.capacity = max(1.0, float(burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    async def acquire(self) -> float:
+        """Take one token, sleeping as needed. Returns the time spent waiting in seconds."""
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    break
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+        return time.monotonic() - start
+
+    def block_for(self, seconds: float) -> None:
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + float(seconds))
+        self._tokens = 0.0
+        self._updated = max(self._updated, self.blocked_until)
+
+
+class RequestScheduler:
+    """Per-method rate limiting and FloodWait-aware retries for Telethon calls.
+
+    ``limits`` maps a method name (e.g. ``get_messages``) to ``(rate_per_sec, burst)``.
+    Methods without a configured limit are not throttled but still get FloodWait handling.
+    A FloodWait of up to ``max_flood_wait`` seconds blocks the method's bucket and the call
+    is retried after the indicated delay (at most ``max_retries`` times); longer waits are
+    surfaced to the caller as RetryAfterError.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], max_flood_wait: float = 60.0,
+                 max_retries: int = 2):
+        self.buckets: Dict[str, TokenBucket] = {m: TokenBucket(r, b) for m, (r, b) in (limits or {}).items()}
+        self.max_flood_wait = float(max_flood_wait)
+        self.max_retries = int(max_retries)
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _stat(self, method: str) -> Dict[str, float]:
+        st = self._stats.get(method)
+        if st is None:
+            st = {"calls": 0, "queued": 0, "wait_total_sec": 0.0, "wait_max_sec": 0.0,
+                  "flood_waits": 0, "retry_after_errors": 0}
+            self._stats[method] = st
+        return st
+
+    async def run(self, method: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run ``factory()`` under the limiter of ``method``; ``factory`` is called once per attempt."""
+        st = self._stat(method)
+        bucket = self.buckets.get(method)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                st["queued"] += 1
+                try:
+                    waited = await bucket.acquire()
+                finally:
+                    st["queued"] -= 1
+                st["wait_total_sec"] += waited
+                st["wait_max_sec"] = max(st["wait_max_sec"], waited)
+            st["calls"] += 1
+            try:
+                return await factory()
+            except FloodWaitError as e:
+                seconds = float(getattr(e, "seconds", 0) or 0)
+                st["flood_waits"] += 1
+                if bucket is not None:
+                    bucket.block_for(seconds)
+                if seconds > self.max_flood_wait or attempt >= self.max_retries:
+                    st["retry_after_errors"] += 1
+                    raise RetryAfterError(method, seconds)
+                attempt += 1
+                print(f"FloodWait on {method}: retrying in {int(seconds)}s (attempt {attempt})", file=sys.stderr)
+                if bucket is None:
+                    await asyncio.sleep(seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        out: Dict[str, Any] = {}
+        for method in sorted(set(self._stats) | set(self.buckets)):
+            st = dict(self._stat(method))
+            calls = st["calls"] or 0
+            st["wait_avg_sec"] = round(st["wait_total_sec"] / calls, 4) if calls else 0.0
+            st["wait_total_sec"] = round(st["wait_total_sec"], 4)
+            st["wait_max_sec"] = round(st["wait_max_sec"], 4)
+            bucket = self.buckets.get(method)
+            if bucket is not None:
+                st["rate_per_sec"] = bucket.rate
+                st["burst"] = bucket.capacity
+                st["blocked_for_sec"] = round(max(0.0, bucket.blocked_until - now), 3)
+            out[method] = st
+        return out
+
+
+def parse_rate_limits(spec: Optional[str], defaults: Dict[str, Tuple[float, float]]) -> Dict[str, Tuple[float, float]]:
+    """Parse ``"get_messages=3:5,send_message=1:3"`` (rate per second and optional burst) over defaults."""
+    limits = dict(defaults)
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part or "=" not in part:
+            continue
+        method, value = part.split("=", 1)
+        try:
+            if ":" in value:
+                rate_s, burst_s = value.split(":", 1)
+                limits[method.strip()] = (float(rate_s), float(burst_s))
+            else:
+                limits[method.strip()] = (float(value), max(1.0, float(value)))
+        except ValueError:
+            print(f"Invalid rate limit entry ignored: {part}", file=sys.stderr)
+    return limits
@@ -0,0 +1,80 @@
+import time
+import sys
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from telethon.sessions import SQLiteSession, StringSession
+
+
+class CachedSQLiteSession(SQLiteSession):
+    """Telethon SQLite session that also persists resolved chat metadata.
+
+    On top of what SQLiteSession already stores (auth key, entities with access hashes,
+    update state), a ``chat_cache`` table keeps the ``tg.resolve_chat`` result per input,
+    so a warm restart can answer resolve calls without any network request.
+    """
+
+    def __init__(self, session_id: Optional[str] = None, chat_cache_ttl: float = 7 * 24 * 3600):
+        super().__init__(session_id)
+        self.chat_cache_ttl = float(chat_cache_ttl)
+        c = self._cursor()
+        try:
+            c.execute(
+                "create table if not exists chat_cache ("
+                "key text primary key, id integer, username text, title text, type text, updated integer)"
+            )
+        finally:
+            c.close()
+        self.save()
+
+    @staticmethod
+    def _cache_key(chat: Any) -> str:
+        s = str(chat).strip()
+        if s.startswith("@"):
+            s = s[1:]
+        return s.lower()
+
+    def get_cached_chat(self, chat: Any) -> Optional[Dict[str, Any]]:
+        row = self._execute(
+            "select id, username, title, type, updated from chat_cache where key = ?", self._cache_key(chat)
+        )
+        if not row:
+            return None
+        _id, username, title, type_name, updated = row
+        if self.chat_cache_ttl > 0 and (time.time() - (updated or 0)) > self.chat_cache_ttl:
+            return None
+        return {"id": _id, "username": username, "title": title, "type": type_name}
+
+    def cache_chat(self, chat: Any, info: Dict[str, Any]) -> None:
+        keys = {self._cache_key(chat)}
+        if info.get("username"):
+            keys.add(self._cache_key(info["username"]))
+        if info.get("id") is not None:
+            keys.add(self._cache_key(info["id"]))
+        now = int(time.time())
+        c = self._cursor()
+        try:
+            c.executemany(
+                "insert or replace into chat_cache values (?,?,?,?,?,?)",
+                [(k, info.get("id"), info.get("username"), info.get("title"), info.get("type"), now) for k in keys],
+            )
+        finally:
+            c.close()
+        self.save()
+
+
+def default_sqlite_session_path() -> str:
+    return str(Path(__file__).parent / "telegram_mcp.session")
+
+
+def migrate_string_session(session_str: str, sqlite_path: str) -> CachedSQLiteSession:
+    """Copy DC and auth key from a StringSession into a (new or existing) SQLite session file."""
+    src = StringSession(session_str)
+    if src.auth_key is None:
+        raise ValueError("String session is empty or invalid; nothing to migrate")
+    dst = CachedSQLiteSession(sqlite_path)
+    dst.set_dc(src.dc_id, src.server_address, src.port)
+    dst.auth_key = src.auth_key
+    dst.save()
+    print(f"Migrated string session into SQLite session {dst.filename}", file=sys.stderr)
+    return dst
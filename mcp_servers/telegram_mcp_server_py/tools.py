@@ -1,12 +1,69 @@
+import sys
 import json
+import asyncio
+from collections import OrderedDict
 from typing import Any, Dict, List, Optional
 from telethon import TelegramClient
-from datetime import datetime
+from datetime import datetime, timezone
+
+from .rate_limit import RequestScheduler, RetryAfterError, parse_rate_limits
+from .export import HistoryExporter
+
+
+def _parse_date(v: Any) -> Optional[datetime]:
+    """Accept ISO 8601 strings or unix timestamps; naive values are treated as UTC."""
+    if v is None or v == "":
+        return None
+    if isinstance(v, (int, float)):
+        return datetime.fromtimestamp(float(v), tz=timezone.utc)
+    dt = datetime.fromisoformat(str(v).strip().replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _to_iso(v: Any) -> Any:
+    if isinstance(v, datetime):
+        try:
+            return v.isoformat()
+        except Exception:
+            return v.strftime("%Y-%m-%dT%H:%M:%S")
+    return v
+
+
+class _SenderCache:
+    """Small LRU of sender id -> display name shared across history pages."""
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._items: "OrderedDict[Any, str]" = OrderedDict()
+
+    def get(self, key: Any) -> Optional[str]:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Any, value: str) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
 
 
 class ToolsHandler:
-    def __init__(self, client: TelegramClient):
+    # Upper bound for concurrent per-chat fetches inside tg.fetch_history_multi
+    MULTI_FETCH_CONCURRENCY = 4
+
+    def __init__(self, client: TelegramClient, rate_limits: Optional[Dict[str, Any]] = None,
+                 export_dir: Optional[str] = None):
         self.client = client
+        self._senders = _SenderCache()
+        rl = rate_limits or {}
+        self.scheduler = RequestScheduler(
+            parse_rate_limits(rl.get("spec"), rl.get("defaults") or {}),
+            max_flood_wait=rl.get("max_flood_wait", 60.0),
+            max_retries=rl.get("flood_retries", 2),
+        )
+        self.exporter = HistoryExporter(client, self._serialize_message, export_dir=export_dir)
         self._tools_list = [
             {
                 "name": "tg.resolve_chat",
@@ -30,11 +87,71 @@ class ToolsHandler:
                         "chat": {"type": ["string", "number"], "description": "Chat identifier"},
                         "page_size": {"type": "number", "description": "Page size", "default": 50},
                         "min_id": {"type": "number", "description": "Fetch messages with id > min_id"},
-                        "max_id": {"type": "number", "description": "Fetch messages with id <= max_id"}
+                        "max_id": {"type": "number", "description": "Fetch messages with id <= max_id"},
+                        "offset_date": {"type": ["string", "number"], "description": "Only messages sent before this date (ISO 8601 or unix time)"},
+                        "compact": {"type": "boolean", "description": "Return a senders table and reference it by from_id", "default": False}
+                    },
+                    "required": ["chat"]
+                }
+            },
+            {
+                "name": "tg.fetch_history_multi",
+                "description": "Resolve and fetch history for several chats concurrently in one call.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "entries": {
+                            "type": "array",
+                            "description": "Chats to fetch",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "chat": {"type": ["string", "number"], "description": "Chat identifier"},
+                                    "min_id": {"type": "number", "description": "Fetch messages with id > min_id"},
+                                    "cap": {"type": "number", "description": "Max messages for this chat", "default": 50}
+                                },
+                                "required": ["chat"]
+                            }
+                        },
+                        "concurrency": {"type": "number", "description": "Max chats fetched in parallel", "default": 4},
+                        "compact": {"type": "boolean", "description": "Return a senders table per chat and reference it by from_id", "default": False}
+                    },
+                    "required": ["entries"]
+                }
+            },
+            {
+                "name": "tg.get_metrics",
+                "description": "Rate limiter metrics per Telegram method (queue depth, wait time, flood waits).",
+                "inputSchema": {"type": "object", "properties": {}, "required": []}
+            },
+            {
+                "name": "tg.export_history",
+                "description": "Export long chat history to a compressed JSONL or SQLite file on the server (takeout session, resumable).",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "chat": {"type": ["string", "number"], "description": "Chat identifier"},
+                        "format": {"type": "string", "enum": ["jsonl", "sqlite"], "default": "jsonl"},
+                        "path": {"type": "string", "description": "Output file, relative to the server's export directory (default <chat>.jsonl.gz)"},
+                        "min_id": {"type": "number", "description": "Export messages with id > min_id (default: resume from the file cursor)"},
+                        "max_messages": {"type": "number", "description": "Stop after this many messages"},
+                        "wait_time": {"type": "number", "description": "Seconds between history requests (Telethon wait_time)"},
+                        "takeout": {"type": "boolean", "description": "Use a takeout session", "default": True}
                     },
                     "required": ["chat"]
                 }
             },
+            {
+                "name": "tg.export_status",
+                "description": "Progress and resumable cursor of export jobs.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "job_id": {"type": "string", "description": "Job id returned by tg.export_history (omit to list all)"}
+                    },
+                    "required": []
+                }
+            },
             {
                 "name": "tg.send_message",
                 "description": "Alias of send_message (compatibility)",
@@ -47,6 +164,19 @@ class ToolsHandler:
                     "required": ["chat", "message"]
                 }
             },
+            {
+                "name": "tg.edit_message",
+                "description": "Replace the text of a message sent earlier (e.g. a summary that is still being generated).",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "chat": {"type": ["string", "number"], "description": "Chat identifier"},
+                        "message_id": {"type": "number", "description": "ID of the message to edit"},
+                        "message": {"type": "string", "description": "New message text"}
+                    },
+                    "required": ["chat", "message_id", "message"]
+                }
+            },
             {
                 "name": "tg.forward_message",
                 "description": "Alias of forward_message (compatibility)",
@@ -86,7 +216,7 @@ class ToolsHandler:
             },
             {
                 "name": "tg.get_chats",
-                "description": "List available chats and basic metadata.",
+                "description": "List available chats and basic metadata, including unread count and top message id.",
                 "inputSchema": {"type": "object", "properties": {}, "required": []}
             },
             {
@@ -98,7 +228,9 @@ class ToolsHandler:
                         "chat": {"type": ["string", "number"], "description": "Chat identifier"},
                         "page_size": {"type": "number", "description": "Page size", "default": 50},
                         "min_id": {"type": "number", "description": "Fetch messages with id > min_id"},
-                        "max_id": {"type": "number", "description": "Fetch messages with id <= max_id"}
+                        "max_id": {"type": "number", "description": "Fetch messages with id <= max_id"},
+                        "offset_date": {"type": ["string", "number"], "description": "Only messages sent before this date (ISO 8601 or unix time)"},
+                        "compact": {"type": "boolean", "description": "Return a senders table and reference it by from_id", "default": False}
                     },
                     "required": ["chat"]
                 }
@@ -108,6 +240,156 @@ class ToolsHandler:
     async def list(self) -> List[Dict[str, Any]]:
         return self._tools_list
 
+    async def _resolve_chat(self, chat_arg: Any) -> Dict[str, Any]:
+        # A persistent session (CachedSQLiteSession) answers repeated resolves without network calls
+        session = getattr(self.client, "session", None)
+        get_cached = getattr(session, "get_cached_chat", None)
+        if get_cached is not None:
+            cached = get_cached(chat_arg)
+            if cached:
+                return cached
+        info = await self._resolve_chat_remote(chat_arg)
+        cache_chat = getattr(session, "cache_chat", None)
+        if cache_chat is not None:
+            try:
+                cache_chat(chat_arg, info)
+            except Exception as e:
+                print(f"Failed to cache resolved chat {chat_arg}: {e}", file=sys.stderr)
+        return info
+
+    async def _resolve_chat_remote(self, chat_arg: Any) -> Dict[str, Any]:
+        target = chat_arg
+        if isinstance(chat_arg, str):
+            # Known usernames map to a cached InputPeer: fetch by id instead of ResolveUsernameRequest
+            try:
+                target = self.client.session.get_input_entity(chat_arg.lstrip("@"))
+            except Exception:
+                target = chat_arg
+        entity = await self.scheduler.run("get_entity", lambda: self.client.get_entity(target))
+        _id = getattr(entity, "id", None)
+        peer = getattr(entity, "peer_id", None)
+        if _id is None and peer is not None:
+            _id = getattr(peer, "channel_id", None) or getattr(peer, "chat_id", None) or getattr(peer, "user_id", None)
+        username = getattr(entity, "username", None) or getattr(getattr(entity, "user", None), "username", None)
+        title = getattr(entity, "title", None)
+        if not title:
+            first = getattr(entity, "first_name", None) or getattr(entity, "firstName", None)
+            last = getattr(entity, "last_name", None) or getattr(entity, "lastName", None)
+            parts = [p for p in [first, last] if p]
+            title = (" ".join(parts)) or username or (str(_id) if _id is not None else None)
+        type_name = getattr(entity, "__class__", type(entity)).__name__
+        return {"id": _id, "username": username, "title": title, "type": type_name}
+
+    def _sender_display(self, m: Any) -> str:
+        sender_id = getattr(m, "sender_id", None)
+        if sender_id is not None:
+            cached = self._senders.get(sender_id)
+            if cached is not None:
+                return cached
+        sender = getattr(m, "sender", None)
+        display = None
+        if sender is not None:
+            username = getattr(sender, "username", None)
+            if username:
+                display = username
+            else:
+                first = getattr(sender, "first_name", None)
+                last = getattr(sender, "last_name", None)
+                parts = [p for p in [first, last] if p]
+                display = " ".join(parts) if parts else None
+        if display and sender_id is not None:
+            self._senders.put(sender_id, display)
+        return display or (str(getattr(m, "sender_id", "Unknown")))
+
+    def _serialize_message(self, m: Any) -> Dict[str, Any]:
+        return {
+            "id": getattr(m, "id", None),
+            "text": getattr(m, "message", None) or getattr(m, "text", None) or "",
+            "date": _to_iso(getattr(m, "date", None)),
+            "from": {
+                "id": getattr(m, "sender_id", None),
+                "display": self._sender_display(m)
+            }
+        }
+
+    def _serialize_page(self, raw: Any, compact: bool = False) -> Dict[str, Any]:
+        """Build a history page. ``compact`` returns each sender once in ``senders`` and refers to it by ``from_id``."""
+        if not compact:
+            return {"messages": [self._serialize_message(m) for m in raw or []]}
+        senders: Dict[str, Dict[str, Any]] = {}
+        messages = []
+        for m in raw or []:
+            sender_id = getattr(m, "sender_id", None)
+            key = str(sender_id)
+            if key not in senders:
+                senders[key] = {"display": self._sender_display(m)}
+            messages.append({
+                "id": getattr(m, "id", None),
+                "text": getattr(m, "message", None) or getattr(m, "text", None) or "",
+                "date": _to_iso(getattr(m, "date", None)),
+                "from_id": sender_id,
+            })
+        return {"senders": senders, "messages": messages}
+
+    async def _fetch_messages(self, chat_arg: Any, limit: Any, min_id: Any = None, max_id: Any = None,
+                              offset: Any = None, compact: bool = False, offset_date: Any = None) -> Dict[str, Any]:
+        opts: Dict[str, Any] = {"limit": int(limit or 50)}
+        if isinstance(min_id, int):
+            opts["min_id"] = min_id
+        if isinstance(max_id, int):
+            opts["max_id"] = max_id
+        if isinstance(offset, int):
+            opts["add_offset"] = offset
+        date = _parse_date(offset_date)
+        if date is not None:
+            # Newest messages strictly before the date: limit=1 gives the last id before a cutoff
+            opts["offset_date"] = date
+        raw = await self.scheduler.run("get_messages", lambda: self.client.get_messages(chat_arg, **opts))
+        return self._serialize_page(raw, compact=compact)
+
+    async def _fetch_history_multi(self, entries: List[Dict[str, Any]], concurrency: Any,
+                                   compact: bool = False) -> Dict[str, Any]:
+        """Resolve and fetch every entry concurrently with a bounded gather.
+
+        Returns ``{"results": {chat: {"chat": info, "messages": [...]}}, "errors": {chat: str}}``
+        keyed by the chat identifier exactly as it was passed in; with ``compact`` each result also
+        carries its own ``senders`` table. Chats hit by a long FloodWait are additionally listed
+        in ``"retry_after": {chat: seconds}``.
+        """
+        try:
+            limit = max(1, int(concurrency or self.MULTI_FETCH_CONCURRENCY))
+        except Exception:
+            limit = self.MULTI_FETCH_CONCURRENCY
+        sem = asyncio.Semaphore(limit)
+        results: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        retry_after: Dict[str, int] = {}
+
+        async def _one(entry: Dict[str, Any]) -> None:
+            chat = entry.get("chat") if entry.get("chat") is not None else entry.get("chatId")
+            key = str(chat)
+            if chat is None or chat == "":
+                errors[key] = "chat is required"
+                return
+            min_id = entry.get("min_id", entry.get("minId"))
+            cap = entry.get("cap", entry.get("page_size", entry.get("limit"))) or 50
+            async with sem:
+                try:
+                    info = await self._resolve_chat(chat)
+                    page = await self._fetch_messages(chat, cap, min_id=min_id, compact=compact)
+                    results[key] = {"chat": info, **page}
+                except RetryAfterError as e:
+                    errors[key] = str(e)
+                    retry_after[key] = int(e.seconds)
+                except Exception as e:
+                    errors[key] = str(e)
+
+        await asyncio.gather(*[_one(e) for e in entries if isinstance(e, dict)])
+        out: Dict[str, Any] = {"results": results, "errors": errors}
+        if retry_after:
+            out["retry_after"] = retry_after
+        return out
+
     async def call(self, name: str, params: Optional[Dict[str, Any]]) -> Any:
         params = params or {}
         try:
@@ -115,85 +397,58 @@ class ToolsHandler:
             page_size = params.get("page_size", params.get("limit"))
             min_id = params.get("min_id", params.get("minId"))
             max_id = params.get("max_id", params.get("maxId"))
-            
-            def _to_iso(v: Any) -> Any:
-                if isinstance(v, datetime):
-                    try:
-                        return v.isoformat()
-                    except Exception:
-                        return v.strftime("%Y-%m-%dT%H:%M:%S")
-                return v
 
             if name == "tg.resolve_chat":
-                entity = await self.client.get_entity(chat_arg)
-                _id = getattr(entity, "id", None)
-                peer = getattr(entity, "peer_id", None)
-                if _id is None and peer is not None:
-                    _id = getattr(peer, "channel_id", None) or getattr(peer, "chat_id", None) or getattr(peer, "user_id", None)
-                username = getattr(entity, "username", None) or getattr(getattr(entity, "user", None), "username", None)
-                title = getattr(entity, "title", None)
-                if not title:
-                    first = getattr(entity, "first_name", None) or getattr(entity, "firstName", None)
-                    last = getattr(entity, "last_name", None) or getattr(entity, "lastName", None)
-                    parts = [p for p in [first, last] if p]
-                    title = (" ".join(parts)) or username or (str(_id) if _id is not None else None)
-                type_name = getattr(entity, "__class__", type(entity)).__name__
-                return {"id": _id, "username": username, "title": title, "type": type_name}
+                return await self._resolve_chat(chat_arg)
 
             elif name in ("tg.read_messages", "tg.fetch_history"):
-                limit = page_size or 50
-                opts: Dict[str, Any] = {"limit": int(limit)}
-                if isinstance(min_id, int):
-                    opts["min_id"] = min_id
-                if isinstance(max_id, int):
-                    opts["max_id"] = max_id
-                if isinstance(params.get("offset"), int):
-                    opts["add_offset"] = params.get("offset")
-                raw = await self.client.get_messages(chat_arg, **opts)
-                out = []
-                for m in raw or []:
-                    sender = getattr(m, "sender", None)
-                    display = None
-                    if sender is not None:
-                        username = getattr(sender, "username", None)
-                        if username:
-                            display = username
-                        else:
-                            first = getattr(sender, "first_name", None)
-                            last = getattr(sender, "last_name", None)
-                            parts = [p for p in [first, last] if p]
-                            display = " ".join(parts) if parts else None
-                    out.append({
-                        "id": getattr(m, "id", None),
-                        "text": getattr(m, "message", None) or getattr(m, "text", None) or "",
-                        "date": _to_iso(getattr(m, "date", None)),
-                        "from": {
-                            "id": getattr(m, "sender_id", None),
-                            "display": display or (str(getattr(m, "sender_id", "Unknown")))
-                        }
-                    })
-                return {"messages": out}
+                return await self._fetch_messages(chat_arg, page_size, min_id=min_id, max_id=max_id,
+                                                  offset=params.get("offset"), compact=bool(params.get("compact")),
+                                                  offset_date=params.get("offset_date", params.get("offsetDate")))
+
+            elif name == "tg.fetch_history_multi":
+                entries = params.get("entries") or []
+                if not isinstance(entries, list):
+                    return {"error": "entries must be an array"}
+                return await self._fetch_history_multi(entries, params.get("concurrency"),
+                                                       compact=bool(params.get("compact")))
 
             elif name == "tg.send_message":
                 text = params.get("text") or params.get("message")
-                res = await self.client.send_message(chat_arg, message=text)
+                res = await self.scheduler.run("send_message", lambda: self.client.send_message(chat_arg, message=text))
                 return {"message_id": getattr(res, "id", None)}
 
+            elif name == "tg.edit_message":
+                text = params.get("text") or params.get("message")
+                message_id = params.get("message_id") or params.get("messageId")
+                if not message_id:
+                    return {"error": "message_id is required"}
+                res = await self.scheduler.run(
+                    "edit_message", lambda: self.client.edit_message(chat_arg, int(message_id), text)
+                )
+                return {"message_id": getattr(res, "id", None) or int(message_id)}
+
             elif name == "tg.forward_message":
                 from_chat = params.get("from_chat") or params.get("fromChatId")
                 to_chat = params.get("to_chat") or params.get("toChatId")
                 message_id = params.get("message_id") or params.get("messageId")
-                res = await self.client.forward_messages(to_chat, [int(message_id)], from_peer=from_chat)
+                res = await self.scheduler.run(
+                    "forward_messages",
+                    lambda: self.client.forward_messages(to_chat, [int(message_id)], from_peer=from_chat)
+                )
                 first = res[0] if isinstance(res, list) and res else res
                 return {"forwarded_id": getattr(first, "id", None)}
 
             elif name == "tg.mark_read":
                 ids = params.get("message_ids") or params.get("messageIds") or []
-                await self.client.send_read_acknowledge(chat_arg, max_id=max(ids) if ids else None, message_ids=ids or None)
+                await self.scheduler.run(
+                    "send_read_acknowledge",
+                    lambda: self.client.send_read_acknowledge(chat_arg, max_id=max(ids) if ids else None, message_ids=ids or None)
+                )
                 return {"success": True}
 
             elif name == "tg.get_unread_count":
-                dialogs = await self.client.get_dialogs()
+                dialogs = await self.scheduler.run("get_dialogs", lambda: self.client.get_dialogs())
                 unread = 0
                 if chat_arg:
                     for d in dialogs:
@@ -207,18 +462,42 @@ class ToolsHandler:
                 return {"unread": unread}
 
             elif name == "tg.get_chats":
-                dialogs = await self.client.get_dialogs()
+                dialogs = await self.scheduler.run("get_dialogs", lambda: self.client.get_dialogs())
                 mapped = []
                 for d in dialogs:
                     mapped.append({
                         "id": getattr(d, "id", None),
                         "title": getattr(d, "title", None),
                         "username": getattr(getattr(d, "entity", None), "username", None),
-                        "unread": getattr(d, "unread_count", 0)
+                        "unread": getattr(d, "unread_count", 0),
+                        # Id of the newest message in the dialog: lets clients skip chats with nothing new
+                        "top_message_id": getattr(getattr(d, "message", None), "id", None)
                     })
                 return mapped
 
+            elif name == "tg.export_history":
+                if chat_arg is None or chat_arg == "":
+                    return {"error": "chat is required"}
+                wait_time = params.get("wait_time")
+                return self.exporter.start(
+                    chat_arg,
+                    fmt=params.get("format") or "jsonl",
+                    path=params.get("path"),
+                    min_id=min_id if isinstance(min_id, int) else None,
+                    max_messages=params.get("max_messages"),
+                    wait_time=float(wait_time) if wait_time is not None else None,
+                    takeout=params.get("takeout", True) is not False,
+                )
+
+            elif name == "tg.export_status":
+                return self.exporter.status(params.get("job_id") or params.get("jobId"))
+
+            elif name == "tg.get_metrics":
+                return {"rate_limits": self.scheduler.metrics()}
+
             else:
                 return {"error": "Unknown tool"}
+        except RetryAfterError as e:
+            return {"error": str(e), "retry_after": int(e.seconds), "method": e.method}
         except Exception as e:
             return {"error": str(e)}
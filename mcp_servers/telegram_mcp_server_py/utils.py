@@ -6,13 +6,19 @@ from telethon import TelegramClient
 from telethon.sessions import StringSession
 from telethon.errors import RPCError
 
+from .session_store import CachedSQLiteSession, default_sqlite_session_path, migrate_string_session
+
 
 async def setup_telegram_client(api_id: Optional[str], api_hash: Optional[str],
                                 phone_number: Optional[str], bot_token: Optional[str],
-                                session_file: Optional[str]) -> TelegramClient:
+                                session_file: Optional[str], session_backend: Optional[str] = None,
+                                sqlite_session_file: Optional[str] = None) -> TelegramClient:
     """
     Initialize and authenticate Telegram client (bot or user). Save session to file.
     Logs are printed to stderr. Stdout must remain clean (reserved for MCP frames).
+
+    session_backend="sqlite" keeps entities, access hashes, update state and resolved chats in
+    a SQLite session file across restarts; an existing string session is migrated on first use.
     """
     # Resolve session file path near this module by default
     if not session_file:
@@ -27,18 +33,23 @@ async def setup_telegram_client(api_id: Optional[str], api_hash: Optional[str],
     except Exception as e:
         print(f"Failed to read session file: {e}", file=sys.stderr)
 
-    client = TelegramClient(StringSession(session_str), int(api_id or 0), api_hash or "",
-                            device_model="Telegram MCP Server", system_version="1.0", app_version="0.1.0")
+    session = _open_session(session_str, session_backend, sqlite_session_file)
+    is_sqlite = isinstance(session, CachedSQLiteSession)
+    # flood_sleep_threshold=0: FloodWait is handled by the RequestScheduler in tools.py, not slept through silently
+    client = TelegramClient(session, int(api_id or 0), api_hash or "",
+                            device_model="Telegram MCP Server", system_version="1.0", app_version="0.1.0",
+                            flood_sleep_threshold=0)
     try:
         if bot_token:
             print("Using bot authentication", file=sys.stderr)
             await client.start(bot_token=bot_token)
-            await _persist_session(client, session_file)
+            if not is_sqlite:
+                await _persist_session(client, session_file)
             print("Bot client initialized successfully.", file=sys.stderr)
             return client
         else:
             # User flow: try non-interactive connect first
-            if session_str:
+            if session_str or (is_sqlite and session.auth_key is not None):
                 print("Using saved session (non-interactive connect)", file=sys.stderr)
                 await client.connect()
                 if await client.is_user_authorized():
@@ -56,6 +67,21 @@ async def setup_telegram_client(api_id: Optional[str], api_hash: Optional[str],
         raise
 
 
+def _open_session(session_str: str, session_backend: Optional[str], sqlite_session_file: Optional[str]):
+    """Return a StringSession (default) or a CachedSQLiteSession, migrating the string session if needed."""
+    if (session_backend or "string").lower() != "sqlite":
+        return StringSession(session_str)
+    path = sqlite_session_file or default_sqlite_session_path()
+    file_path = path if path.endswith(".session") else path + ".session"
+    if not Path(file_path).exists() and session_str:
+        try:
+            return migrate_string_session(session_str, path)
+        except Exception as e:
+            print(f"Failed to migrate string session into SQLite: {e}", file=sys.stderr)
+    print(f"Using SQLite session: {file_path}", file=sys.stderr)
+    return CachedSQLiteSession(path)
+
+
 async def _persist_session(client: TelegramClient, session_file: str) -> None:
     try:
         s = client.session.save()
@@ -6,12 +6,16 @@ Telegram Monitoring Agent - Main Entry Point
 import asyncio
 import argparse
 from src.agent import TelegramAgent
+from src.llm_resolver import get_llm_registry
 
 
 def main():
     parser = argparse.ArgumentParser(description="Telegram Monitoring Agent")
     parser.add_argument("--test-mcp", action="store_true", help="Test MCP stdio connection and resolve a test chat (no messages will be sent)")
     parser.add_argument("--list-tools", action="store_true", help="List tools exposed by MCP server (stdio)")
+    parser.add_argument("--summarize-export", metavar="PATH", help="Summarize a history file exported by tg.export_history (.jsonl.gz or .sqlite)")
+    parser.add_argument("--export-username", metavar="USERNAME", help="Channel username for t.me source links in --summarize-export")
+    parser.add_argument("--export-target", metavar="CHAT", help="Also send --summarize-export summaries to this chat")
     args = parser.parse_args()
 
     agent = TelegramAgent()
@@ -34,6 +38,20 @@ def main():
         asyncio.run(_list())
         return
 
+    if args.summarize_export:
+        async def _summarize():
+            try:
+                return await agent.summarize_export(args.summarize_export, source_username=args.export_username,
+                                                    target_chat=args.export_target)
+            finally:
+                # --export-target starts the MCP server on first send; stop it before the loop closes
+                await agent.mcp_client.stop()
+                await get_llm_registry().aclose()
+        summaries = asyncio.run(_summarize())
+        for idx, summary in enumerate(summaries, start=1):
+            print(f"--- Сводка #{idx}/{len(summaries)} ---\n{summary or '(не удалось получить сводку)'}\n")
+        return
+
     # Default behavior: start the agent main loop (as previously)
     agent.run()
 
@@ -4,14 +4,29 @@ Telegram Monitoring Agent Core
 """
 
 import asyncio
+import copy
 import json
 import logging
 import os
-from typing import Optional, Dict, Any
+import weakref
+from typing import Optional, Dict, Any, List
 from .mcp_client import MCPClient
 from .ui import TelegramUI
-from .yandexgpt_usecase import YandexGptUseCase
-from datetime import datetime, timedelta, time as dtime
+from .llm_resolver import get_llm_registry, resolve_llm_usecase
+from .export_reader import iter_exported_messages
+from .pipeline import StagePipeline
+from .state_store import StateStore
+from .message_archive import MessageArchive, parse_search_query
+from .message_filter import MessageFilter
+from .llm_cache import LlmCache, make_cache_key
+from .llm_resilience import ResilientLlm
+from .digest import DIGEST_MODES, TELEGRAM_MESSAGE_LIMIT, fit_message, reduce_tree
+from .rolling_summary import REPORT_MARKER, STATE_MARKER, parse_rolling_reply
+from .batch_analysis import ANALYSIS_TEXT_CHARS, repair_json, results_by_id
+from .lexicon_classifier import LexiconClassifier, LexiconResult
+from .chunking import estimate_tokens, pack_messages
+from .llm_scheduler import LlmScheduler, RateWindow, estimate_request_tokens
+from datetime import datetime, timedelta, timezone, time as dtime
 
 class TelegramAgent:
     def __init__(self, config_path: str = "config/config.json"):
@@ -38,16 +53,105 @@ class TelegramAgent:
 
         self.ui = TelegramUI(self)
         self.mcp_transport = mcp_transport
-        # Track last seen message id per chat for "new messages" logging
-        self.last_seen_ids: Dict[str, int] = {}
+        # Track last seen message id per chat for "new messages" logging (loaded from the state store on first use)
+        self._last_seen_ids: Optional[Dict[str, int]] = None
         # Target chat to post summaries; fallback to source chat if not set
         self.summary_chat: Optional[str] = self.config.get('summary_chat')
         # Monitoring parameters from config
         self.monitor_interval_sec: int = int(self.config.get('monitor_interval_sec', 60))
         self.page_size: int = int(self.config.get('page_size', 10))
         self.chunk_size: int = int(self.config.get('chunk_size', 12))
-        # State file for last_seen_ids
+        # Prompt size per summarization call in estimated tokens; messages are packed greedily up to it
+        # (0 = split by chunk_size messages instead). chunk_max_messages optionally caps a chunk too.
+        self.chunk_token_budget: int = int(self.config.get('chunk_token_budget', 3000) or 0)
+        self.chunk_max_messages: int = int(self.config.get('chunk_max_messages', 0) or 0)
+        # Adaptive paging: pages grow from page_size up to max_page_size while they come back full
+        self.max_page_size: int = int(self.config.get('max_page_size', 100))
+        # Bootstrap for a chat without last_seen_id: summarize at most the newest max_messages
+        # (null = no bound, 0 = start from the latest message) sent within max_age_hours (0 = no window)
+        bootstrap = self.config.get('bootstrap') or {}
+        self.first_run_max_messages: Optional[int] = self._optional_int(
+            bootstrap.get('max_messages', self.config.get('first_run_max_messages', 200))
+        )
+        self.first_run_max_age_hours: float = float(
+            bootstrap.get('max_age_hours', self.config.get('first_run_max_age_hours', 0)) or 0
+        )
+        # Per-chat overrides of page_size / max_page_size / first_run_* keyed like "chats"
+        self.chat_settings: Dict[str, Dict[str, Any]] = self.config.get('chat_settings') or {}
+        # Starting page size for the next run of each chat, learned from its last backlog
+        self._next_page_size: Dict[str, int] = {}
+        # Server-side parallelism for the batched tg.fetch_history_multi prefetch
+        self.multi_fetch_concurrency: int = int(self.config.get('multi_fetch_concurrency', 4))
+        # Ask the server for compact history pages (senders table instead of per-message sender objects)
+        self.compact_history: bool = bool(self.config.get('compact_history', True))
+        # How many chats are monitored at once within one iteration (1 = sequential)
+        self.monitor_concurrency: int = max(1, int(self.config.get('monitor_concurrency', 4)))
+        # Upper bound for a whole monitoring iteration; chats still running are cancelled (0 = no limit)
+        self.monitor_iteration_deadline_sec: float = float(self.config.get('monitor_iteration_deadline_sec', 0) or 0)
+        # Worker counts/queue size of the fetch -> filter -> summarize -> send pipeline
+        self.pipeline_config: Dict[str, Any] = self.config.get('pipeline') or {}
+        # Skip chats whose top message id (from one tg.get_chats snapshot per iteration) is already seen
+        self.skip_idle_chats: bool = bool(self.config.get('skip_idle_chats', True))
+        self._dialog_snapshot: Dict[str, Dict[str, Any]] = {}
+        # Attempts before an outbox record (pending summary/send) is parked as failed
+        self.outbox_max_attempts: int = max(1, int(self.config.get('outbox_max_attempts', 5)))
+        # Max LLM calls in flight (admitted by the scheduler by priority, fairly across chats)
+        self.llm_concurrency: int = max(1, int(self.config.get('llm_concurrency', 4)))
+        # Per-provider requests/tokens per minute, e.g. {"deepseek": {"rpm": 60, "tpm": 200000}}
+        self._llm_windows: Dict[str, RateWindow] = {
+            str(name).lower(): RateWindow(b.get('rpm', 0), b.get('tpm', 0))
+            for name, b in (self.config.get('llm_budgets') or {}).items() if isinstance(b, dict)
+        }
+        self._llm_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LlmScheduler]" = weakref.WeakKeyDictionary()
+        # On-disk cache of LLM completions keyed by request content (low-temperature calls only)
+        llm_cache_cfg = self.config.get('llm_cache') or {}
+        self.llm_cache: Optional[LlmCache] = (
+            LlmCache.from_config(llm_cache_cfg) if llm_cache_cfg.get('enabled', True) else None
+        )
+        # Retries/backoff, circuit breakers, DeepSeek <-> Yandex failover and optional hedging of LLM calls
+        resilience_cfg = self.config.get('llm_resilience') or {}
+        self.llm_failover: bool = bool(resilience_cfg.get('failover', True))
+        self.llm_resilience: Optional[ResilientLlm] = (
+            ResilientLlm.from_config(resilience_cfg, logger=logging.getLogger('ResilientLlm'))
+            if resilience_cfg.get('enabled', True) else None
+        )
+        # Streaming LLM output: stop runaway generations after this many chars (0 = no limit), and
+        # send long summaries early, editing them at most once per stream_edit_interval_sec
+        self.stream_max_chars: int = int(self.config.get('stream_max_chars', 8000) or 0)
+        self.stream_edit_interval_sec: float = float(self.config.get('stream_edit_interval_sec', 2.0))
+        self.stream_summaries: bool = bool(self.config.get('stream_summaries', False))
+        # Map-reduce digests: "chunks" sends every chunk summary, "chat" merges them into one digest
+        # per chat and "run" into one digest per monitoring run; reduce calls merge `fanin` texts each
+        digest_cfg = self.config.get('digest') or {}
+        mode = str(digest_cfg.get('mode', 'chunks')).lower()
+        self.digest_mode: str = mode if mode in DIGEST_MODES else 'chunks'
+        self.digest_fanin: int = max(2, int(digest_cfg.get('fanin', 4)))
+        self.digest_max_chars: int = min(TELEGRAM_MESSAGE_LIMIT - 200, int(digest_cfg.get('max_chars', 3500)))
+        # Rolling summaries: each chunk is summarized against a compact per-chat memory kept in the
+        # state store, which the same call updates (bounded by max_chars)
+        rolling_cfg = self.config.get('rolling_summary') or {}
+        self.rolling_summary_enabled: bool = bool(rolling_cfg.get('enabled', False))
+        self.rolling_summary_max_chars: int = int(rolling_cfg.get('max_chars', 1500))
+        # Batched analysis: messages per analyze_messages call and its prompt size in estimated tokens
+        analysis_cfg = self.config.get('analysis_batch') or {}
+        self.analysis_batch_size: int = max(1, int(analysis_cfg.get('max_messages', 25)))
+        self.analysis_batch_tokens: int = max(100, int(analysis_cfg.get('token_budget', 2500)))
+        # Local lexicon/regex classifier answers trivial messages (reactions, links, short questions)
+        # without the LLM when its confidence reaches the threshold; path counters help tune it
+        fast_path_cfg = self.config.get('analysis_fast_path') or {}
+        self.lexicon: Optional[LexiconClassifier] = (
+            LexiconClassifier(float(fast_path_cfg.get('threshold', 0.8)))
+            if fast_path_cfg.get('enabled', True) else None
+        )
+        self.analysis_stats: Dict[str, int] = {"lexicon": 0, "llm": 0, "fallback": 0, "llm_agreed": 0}
+        # Legacy JSON state file; migrated into the SQLite state store on first use
         self.state_file: str = 'logs/last_seen.json'
+        self.state_store = StateStore(self.config.get('state_db', 'logs/state.sqlite'), legacy_json=self.state_file)
+        # Full-text archive of every fetched message (answers search queries in the UI)
+        self.archive: Optional[MessageArchive] = (
+            MessageArchive(self.config.get('archive_db', 'logs/archive.sqlite'))
+            if self.config.get('archive_enabled', True) else None
+        )
         # Optional schedule settings
         self.monitor_report_times = self.config.get('monitor_report_times') or []
         # Filtering/reporting behavior
@@ -61,9 +165,6 @@ class TelegramAgent:
         self.logger = logging.getLogger('TelegramAgent')
         self.logger.info(f"Telegram Monitoring Agent initialized with {mcp_transport} transport")
 
-        # Load persisted last_seen_ids
-        self._load_last_seen()
-
         # No direct Telegram connection: only MCP stdio transport is used
         
     def load_config(self, path: str) -> Dict[str, Any]:
@@ -210,66 +311,240 @@ class TelegramAgent:
         """Split list into chunks of given size"""
         return [items[i:i+size] for i in range(0, len(items), size)]
 
-    async def summarize_news_and_trends(self, messages: list, source_title: Optional[str] = None, source_username: Optional[str] = None) -> str:
-        """Summarize messages focusing on AI news, trends, frameworks, and tools using a system prompt."""
-        try:
-            # Build conversation with system prompt
-            system_prompt = (
-                "Ты — аналитик новостей ИИ.\n"
-                "Твоя задача: проанализировать сообщения из Telegram-чата и кратко выделить:\n"
-                "1) Новости и анонсы в сфере нейросетей (модели, релизы, исследования).\n"
-                "2) Тенденции развития и важные сдвиги на рынке/в технологиях.\n"
-                "3) Отдельным блоком: новые фреймворки, библиотеки и инструменты для работы с нейросетями (название → краткое описание).\n"
-                "4) Если присутствуют практические советы/гайды — вынеси их тезисно.\n"
-                "Обязательные требования к оформлению:\n"
-                "- В КАЖДОМ пункте указывай ссылку(и) на исходные сообщения канала, если это возможно (например, формат t.me/<username>/<messageId>).\n"
-                "- Если в тексте встречаются внешние источники (статьи, репозитории, релизы) — обязательно добавляй прямые URL на эти источники.\n"
-                "- Отвечай по-русски, структурировано по пунктам, без воды, с маркерами.\n"
-            )
+    def _make_chunks(self, messages: list) -> list:
+        """Chunks for summarization: packed by token budget, or by chunk_size when the budget is 0."""
+        if self.chunk_token_budget > 0:
+            return pack_messages(messages, self.chunk_token_budget, self.chunk_max_messages)
+        return self._chunk_list(messages, self.chunk_size)
+
+    def _llm_scheduler(self) -> LlmScheduler:
+        # One scheduler per event loop (the UI runs agent calls on their own loops in worker threads);
+        # the RPM/TPM windows are shared by all of them
+        loop = asyncio.get_running_loop()
+        scheduler = self._llm_schedulers.get(loop)
+        if scheduler is None:
+            scheduler = LlmScheduler(self._llm_windows, self.llm_concurrency, logger=self.logger)
+            self._llm_schedulers[loop] = scheduler
+        return scheduler
+
+    async def _summarize_chunks(self, chunks: list, source_title: Optional[str] = None,
+                                source_username: Optional[str] = None) -> List[Optional[str]]:
+        """Summarize all chunks concurrently (up to ``llm_concurrency`` of them at once; the LLM
+        scheduler interleaves them with the calls of other chats).
+
+        Results are returned in chunk order; a failed chunk yields None without affecting the others.
+        """
+        sem = asyncio.Semaphore(self.llm_concurrency)
 
-            # Prepare content from messages, appending per-message source links when possible
-            lines: list[str] = []
-            for m in messages:
-                text = m.get('text', '')
-                if not text:
-                    continue
-                display = m.get('from', {}).get('display', 'Unknown')
-                link_suffix = ''
+        async def _one(idx: int, chunk: list) -> Optional[str]:
+            async with sem:
                 try:
-                    if source_username:
-                        mid = int(m.get('id', 0))
-                        if mid > 0:
-                            link_suffix = f" [src: https://t.me/{source_username}/{mid}]"
-                except Exception:
-                    link_suffix = ''
-                lines.append(f"{display}: {text}{link_suffix}")
-            content = "\n".join(lines)
-
-            user_prompt = (
-                (f"Источник: {source_title}\n\n" if source_title else "") +
-                "Проанализируй следующий батч сообщений и дай структурированную сводку по критериям из системного промпта:\n\n" +
-                content
-            )
+                    return await self.summarize_news_and_trends(
+                        chunk, source_title=source_title, source_username=source_username
+                    )
+                except Exception as e:
+                    self.logger.error(f"Error summarizing chunk {idx}/{len(chunks)} for {source_title}: {e}")
+                    return None
+
+        return list(await asyncio.gather(*(_one(idx, chunk) for idx, chunk in enumerate(chunks, start=1))))
+
+    @staticmethod
+    def _format_messages(messages: list, source_username: Optional[str] = None) -> str:
+        """Prompt lines "<sender>: <text> [src: <link>]" for the messages that have text."""
+        # Prepare content from messages, appending per-message source links when possible
+        lines: list[str] = []
+        for m in messages:
+            text = m.get('text', '')
+            if not text:
+                continue
+            display = m.get('from', {}).get('display', 'Unknown')
+            link_suffix = ''
+            try:
+                if source_username:
+                    mid = int(m.get('id', 0))
+                    if mid > 0:
+                        link_suffix = f" [src: https://t.me/{source_username}/{mid}]"
+            except Exception:
+                link_suffix = ''
+            if m.get('parts'):
+                text = f"(часть {m.get('part')}/{m['parts']}) {text}"
+            lines.append(f"{display}: {text}{link_suffix}")
+        return "\n".join(lines)
+
+    def _news_summary_prompt(self, messages: list, source_title: Optional[str] = None,
+                             source_username: Optional[str] = None) -> list[dict]:
+        """Build the system/user conversation for summarizing a batch of messages."""
+        # Build conversation with system prompt
+        system_prompt = (
+            "Ты — аналитик новостей ИИ.\n"
+            "Твоя задача: проанализировать сообщения из Telegram-чата и кратко выделить:\n"
+            "1) Новости и анонсы в сфере нейросетей (модели, релизы, исследования).\n"
+            "2) Тенденции развития и важные сдвиги на рынке/в технологиях.\n"
+            "3) Отдельным блоком: новые фреймворки, библиотеки и инструменты для работы с нейросетями (название → краткое описание).\n"
+            "4) Если присутствуют практические советы/гайды — вынеси их тезисно.\n"
+            "Обязательные требования к оформлению:\n"
+            "- В КАЖДОМ пункте указывай ссылку(и) на исходные сообщения канала, если это возможно (например, формат t.me/<username>/<messageId>).\n"
+            "- Если в тексте встречаются внешние источники (статьи, репозитории, релизы) — обязательно добавляй прямые URL на эти источники.\n"
+            "- Отвечай по-русски, структурировано по пунктам, без воды, с маркерами.\n"
+        )
 
-            text = await self._llm_complete([
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-                max_tokens=min(350, int(self.config.get('deepseek_max_tokens', 2000))),
-                temperature=float(self.config.get('deepseek_temperature', 0.3))
+        content = self._format_messages(messages, source_username)
+
+        user_prompt = (
+            (f"Источник: {source_title}\n\n" if source_title else "") +
+            "Проанализируй следующий батч сообщений и дай структурированную сводку по критериям из системного промпта:\n\n" +
+            content
+        )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    def _digest_prompt(self, summaries: List[str], source_title: Optional[str] = None) -> list[dict]:
+        """Build the conversation for merging partial summaries (the reduce step of a digest)."""
+        system_prompt = (
+            "Ты — редактор дайджеста новостей ИИ.\n"
+            "Тебе даны частичные сводки сообщений в хронологическом порядке. Объедини их в одну сводку:\n"
+            "- убери повторы и объедини одинаковые новости из разных сводок;\n"
+            "- сохрани блоки: новости и анонсы, тенденции, новые инструменты, практические советы;\n"
+            "- сохрани все ссылки на исходные сообщения и внешние источники;\n"
+            "- отвечай по-русски, структурировано по пунктам, без воды, с маркерами.\n"
+            f"Объём ответа — не больше {self.digest_max_chars} символов.\n"
+        )
+        parts = "\n\n---\n\n".join(f"[{idx}]\n{text}" for idx, text in enumerate(summaries, start=1))
+        user_prompt = (
+            (f"Источник: {source_title}\n\n" if source_title else "") +
+            "Объедини следующие частичные сводки в одну:\n\n" +
+            parts
+        )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    async def reduce_summaries(self, summaries: List[str], source_title: Optional[str] = None,
+                               chat: Optional[str] = None) -> str:
+        """Merge chunk summaries into one digest of at most ``digest_max_chars`` characters.
+
+        Summaries are merged ``digest_fanin`` at a time, level by level. Each group's result is kept
+        in the state store under ``chat``, keyed by its prompt: re-reducing the same summaries plus
+        new chunks (e.g. after a failed digest) only calls the LLM for the groups that changed,
+        whether or not the LLM cache is on. Summaries of a new run form new groups and are reduced anew.
+        """
+        # Cyrillic output runs at about 2.5 chars per token
+        max_tokens = min(int(self.digest_max_chars / 2.5) + 50, int(self.config.get('deepseek_max_tokens', 2000)))
+        scope = chat or source_title or ""
+        store = self.state_store
+
+        async def _reduce(group: List[str]) -> str:
+            messages = self._digest_prompt(group, source_title)
+            key = make_cache_key("digest", None, messages, max_tokens, 0)
+            if store is not None:
+                saved = await store.acall(store.reduction_get, scope, key)
+                if saved:
+                    return saved
+            text = await self._llm_complete(
+                messages,
+                max_tokens=max_tokens,
+                temperature=float(self.config.get('deepseek_temperature', 0.3)),
+                priority="summary",
+                chat=scope or None
             )
-            summary = (text or "").strip()
-            # Enrich with Yandex Search MCP if available
-            try:
-                enriched = await self._enrich_with_yandex_search(summary)
-                if enriched:
-                    summary = enriched
-            except Exception as _e:
-                # best-effort, keep original summary
-                self.logger.debug(f"Enrichment skipped: {_e}")
-            return summary
-        except Exception as e:
-            return f"LLM summarization error: {str(e)}"
+            if not (text or "").strip():
+                raise RuntimeError("Empty digest from LLM")
+            if store is not None:
+                await store.acall(store.reduction_save, scope, key, text)
+            return text
+
+        digest = await reduce_tree(summaries, _reduce, self.digest_fanin)
+        return fit_message(digest, self.digest_max_chars)
+
+    def _rolling_summary_prompt(self, state: Optional[str], messages: list, source_title: Optional[str] = None,
+                                source_username: Optional[str] = None) -> list[dict]:
+        """Build the conversation that updates a chat's rolling summary with new messages."""
+        system_prompt = (
+            "Ты — аналитик новостей ИИ и ведёшь сжатую память о Telegram-чате между запусками.\n"
+            "Тебе даны текущая память о чате и новые сообщения. Ответь ровно двумя блоками:\n"
+            f"{STATE_MARKER}\n"
+            "Обновлённая память: ключевые темы, проекты, продукты и повторяющиеся сюжеты чата с датами "
+            "и ссылками на важные сообщения. Добавь новое, сожми и убери устаревшее. "
+            f"Не больше {self.rolling_summary_max_chars} символов.\n"
+            f"{REPORT_MARKER}\n"
+            "Сводка только того, что появилось в новых сообщениях:\n"
+            "1) Новости и анонсы в сфере нейросетей (модели, релизы, исследования).\n"
+            "2) Тенденции развития и важные сдвиги на рынке/в технологиях.\n"
+            "3) Новые фреймворки, библиотеки и инструменты (название → краткое описание).\n"
+            "4) Практические советы/гайды — тезисно.\n"
+            "Не пересказывай заново то, что уже есть в памяти: для продолжающихся тем напиши коротко, что изменилось.\n"
+            "- В КАЖДОМ пункте указывай ссылку(и) на исходные сообщения канала, если это возможно (например, формат t.me/<username>/<messageId>).\n"
+            "- Если в тексте встречаются внешние источники (статьи, репозитории, релизы) — обязательно добавляй прямые URL на эти источники.\n"
+            "- Отвечай по-русски, структурировано по пунктам, без воды, с маркерами.\n"
+        )
+        user_prompt = (
+            (f"Источник: {source_title}\n\n" if source_title else "") +
+            "Текущая память о чате:\n" + ((state or "").strip() or "(пусто — первый запуск)") +
+            "\n\nНовые сообщения:\n\n" + self._format_messages(messages, source_username)
+        )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    async def summarize_with_state(self, state: Optional[str], messages: list, source_title: Optional[str] = None,
+                                   source_username: Optional[str] = None) -> tuple:
+        """Summarize new messages against a chat's rolling summary.
+
+        Returns (updated state, delta report). The prompt holds the previous state instead of any
+        earlier messages, so its size stays bounded however long the chat has been monitored.
+        """
+        base_tokens = min(350, int(self.config.get('deepseek_max_tokens', 2000)))
+        text = await self._llm_complete(
+            self._rolling_summary_prompt(state, messages, source_title, source_username),
+            # The reply carries the state as well as the report
+            max_tokens=base_tokens + int(self.rolling_summary_max_chars / 2.5),
+            temperature=float(self.config.get('deepseek_temperature', 0.3)),
+            priority="summary",
+            chat=source_username or source_title
+        )
+        new_state, report = parse_rolling_reply(text)
+        if not report:
+            raise RuntimeError("Rolling summary reply has no report section")
+        if new_state:
+            new_state = fit_message(new_state, self.rolling_summary_max_chars)
+        else:
+            self.logger.warning(f"Rolling summary for {source_title}: no state in the reply, keeping the previous one")
+            new_state = state
+        try:
+            enriched = await self._enrich_with_yandex_search(report)
+            if enriched:
+                report = enriched
+        except Exception as _e:
+            self.logger.debug(f"Enrichment skipped: {_e}")
+        return new_state, report
+
+    async def summarize_news_and_trends(self, messages: list, source_title: Optional[str] = None, source_username: Optional[str] = None) -> str:
+        """Summarize messages focusing on AI news, trends, frameworks, and tools using a system prompt.
+
+        LLM errors are raised, not returned as text, so a failed chunk stays pending in the outbox
+        instead of an error message being posted as its summary.
+        """
+        text = await self._llm_complete(
+            self._news_summary_prompt(messages, source_title, source_username),
+            max_tokens=min(350, int(self.config.get('deepseek_max_tokens', 2000))),
+            temperature=float(self.config.get('deepseek_temperature', 0.3)),
+            priority="summary",
+            chat=source_username or source_title
+        )
+        summary = (text or "").strip()
+        # Enrich with Yandex Search MCP if available
+        try:
+            enriched = await self._enrich_with_yandex_search(summary)
+            if enriched:
+                summary = enriched
+        except Exception as _e:
+            # best-effort, keep original summary
+            self.logger.debug(f"Enrichment skipped: {_e}")
+        return summary
         
         for handler in logging.getLogger().handlers:
             handler.addFilter(SensitiveDataFilter())
@@ -377,62 +652,83 @@ class TelegramAgent:
             self.logger.debug(f"_enrich_with_yandex_search error: {e}")
             return None
 
-    def _load_last_seen(self):
-        """Load last_seen_ids from state file if exists"""
-        try:
-            import os
-            if os.path.exists(self.state_file):
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if isinstance(data, dict):
-                        # Keep only int ids
-                        self.last_seen_ids = {str(k): int(v) for k, v in data.items() if str(k)}
-                        self.logger.debug(f"Loaded last_seen_ids for {len(self.last_seen_ids)} chats from state")
-        except Exception as e:
-            self.logger.warning(f"Failed to load last_seen_ids: {e}")
+    @property
+    def last_seen_ids(self) -> Dict[str, int]:
+        if self._last_seen_ids is None:
+            self._last_seen_ids = self.state_store.load_last_seen()
+            self.logger.debug(f"Loaded last_seen_ids for {len(self._last_seen_ids)} chats from state")
+        return self._last_seen_ids
+
+    @last_seen_ids.setter
+    def last_seen_ids(self, value: Dict[str, int]) -> None:
+        self._last_seen_ids = value
+
+    def _advance_last_seen(self, chat_ref: str, message_id: Optional[int]) -> None:
+        """Move a chat's last_seen_id forward (never back) and stage it for _flush_state."""
+        if not message_id:
+            return
+        self.last_seen_ids[chat_ref] = max(int(self.last_seen_ids.get(chat_ref, 0)), int(message_id))
+        self._save_last_seen()
 
     def _save_last_seen(self):
-        """Persist last_seen_ids to state file"""
+        """Stage last_seen_ids in the state store; written by _flush_state at the end of the iteration"""
         try:
-            import os
-            os.makedirs('logs', exist_ok=True)
-            with open(self.state_file, 'w', encoding='utf-8') as f:
-                json.dump(self.last_seen_ids, f, ensure_ascii=False, indent=2)
+            self.state_store.set_last_seen(self.last_seen_ids)
         except Exception as e:
             self.logger.warning(f"Failed to save last_seen_ids: {e}")
 
-    def get_llm_client(self):
-        """Return LLM client and model name based on provider configuration"""
-        provider = (self.config.get('llm_provider') or 'deepseek').lower()
+    async def _flush_state(self):
+        """Commit all staged state and archived messages (batched, off the event loop)"""
         try:
-            from openai import AsyncOpenAI
+            await self.state_store.aflush()
         except Exception as e:
-            return None, None, f"OpenAI library not installed: {e}"
+            self.logger.warning(f"Failed to flush agent state: {e}")
+        if self.archive is not None:
+            try:
+                await self.archive.aflush()
+            except Exception as e:
+                self.logger.warning(f"Failed to flush message archive: {e}")
 
-        import os as _os
-        if provider == 'deepseek':
-            # Read only from environment (e.g., .env): DEEPSEEK_API_KEY
-            api_key = (_os.environ.get('DEEPSEEK_API_KEY') or '').strip()
-            if not api_key:
-                return None, None, "DeepSeek API key not configured"
-            # DeepSeek is OpenAI-compatible via base_url
-            client = AsyncOpenAI(api_key=api_key, base_url="https://api.deepseek.com")
-            model = self.config.get('deepseek_model', 'deepseek-chat')
-            return client, model, None
-        elif provider == 'yandex':
-            # Yandex handled via YandexGptUseCase in _llm_complete; here only validate env for compatibility
-            iam = (_os.environ.get('YANDEX_IAM_TOKEN') or '').strip()
-            apikey = (_os.environ.get('YANDEX_API_KEY') or '').strip()
-            folder = (_os.environ.get('YANDEX_FOLDER_ID') or '').strip()
-            if not folder or (not iam and not apikey):
-                return None, None, "Yandex GPT credentials not configured"
-            # Return placeholders; _llm_complete will use YandexGptUseCase
-            return None, 'yandex', None
-        else:
-            return None, None, f"Unsupported llm_provider: {provider}"
+    def get_llm_client(self):
+        """Return the shared LLM use case and model name based on provider configuration"""
+        provider = (self.config.get('llm_provider') or 'deepseek').lower()
+        ok, err = self._provider_configured(provider)
+        if not ok:
+            return None, None, err
+        # Use cases come from the process-wide registry and reuse its keep-alive HTTP sessions
+        return resolve_llm_usecase(provider), self._llm_model(provider), None
+
+    def _llm_model(self, provider: str) -> str:
+        return self.config.get('deepseek_model', 'deepseek-chat') if provider == 'deepseek' else provider
+
+    def _llm_fallbacks(self) -> list[str]:
+        """Providers tried after the configured one when it fails (DeepSeek <-> Yandex)."""
+        if not self.llm_failover:
+            return []
+        provider = (self.config.get('llm_provider') or 'deepseek').lower()
+        return [p for p in ('deepseek', 'yandex') if p != provider]
+
+    def _llm_providers(self) -> list:
+        """Configured providers in order of preference as (name, use case, model)."""
+        providers = []
+        usecase, model, err = self.get_llm_client()
+        if not err:
+            providers.append(((self.config.get('llm_provider') or 'deepseek').lower(), usecase, model))
+        for name in self._llm_fallbacks():
+            if self._provider_configured(name)[0]:
+                providers.append((name, resolve_llm_usecase(name), self._llm_model(name)))
+        if not providers:
+            raise RuntimeError(err)
+        return providers
 
     def _llm_is_configured(self) -> tuple[bool, Optional[str]]:
         provider = (self.config.get('llm_provider') or 'deepseek').lower()
+        ok, err = self._provider_configured(provider)
+        if not ok and any(self._provider_configured(name)[0] for name in self._llm_fallbacks()):
+            return True, None
+        return ok, err
+
+    def _provider_configured(self, provider: str) -> tuple[bool, Optional[str]]:
         env = os.environ
         if provider == 'deepseek':
             if (env.get('DEEPSEEK_API_KEY') or '').strip():
@@ -589,25 +885,134 @@ class TelegramAgent:
         # Fallback: none found within a year
         return None
 
-    async def _llm_complete(self, messages: list[dict], max_tokens: int, temperature: float) -> str:
-        """Unified completion for configured LLM provider (DeepSeek or Yandex)."""
-        provider = (self.config.get('llm_provider') or 'deepseek').lower()
-        if provider == 'deepseek':
-            client, model, err = self.get_llm_client()
-            if err:
-                raise RuntimeError(err)
-            resp = await client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
-            return resp.choices[0].message.content.strip()
-        elif provider == 'yandex':
-            usecase = YandexGptUseCase()
-            return await usecase.complete(messages, temperature=temperature, max_tokens=max_tokens)
-        else:
-            raise RuntimeError(f"Unsupported llm_provider: {provider}")
+    async def _llm_cache_lookup(self, provider: str, model: Optional[str], messages: list[dict], max_tokens: int,
+                                temperature: float, use_cache: bool) -> tuple[Optional[str], Optional[str]]:
+        """Return (cache key, cached text); the key is None when the request must not be cached."""
+        cache = self.llm_cache
+        if cache is None or not use_cache:
+            return None, None
+        if not cache.cacheable(temperature):
+            cache.stats["bypassed"] += 1
+            return None, None
+        key = make_cache_key(provider, model, messages, max_tokens, temperature)
+        try:
+            return key, await cache.aget(key)
+        except Exception as e:
+            self.logger.warning(f"LLM cache lookup failed: {e}")
+            return key, None
+
+    async def _llm_cache_store(self, key: Optional[str], text: str, provider: str, model: Optional[str]) -> None:
+        if key is None or not text:
+            return
+        try:
+            await self.llm_cache.aput(key, text, provider, model)
+        except Exception as e:
+            self.logger.warning(f"LLM cache store failed: {e}")
+
+    async def _llm_complete(self, messages: list[dict], max_tokens: int, temperature: float,
+                            use_cache: bool = True, priority: str = "summary", chat: Optional[str] = None) -> str:
+        """Unified completion for configured LLM provider (DeepSeek or Yandex).
+
+        Identical low-temperature requests are answered from ``llm_cache``; pass ``use_cache=False``
+        to always call the provider. Other calls wait for the scheduler: ``priority`` is
+        "interactive", "summary" or "analytics", and calls of different ``chat`` values take turns.
+        """
+        providers = self._llm_providers()
+        model = providers[0][2]
+        key, cached = await self._llm_cache_lookup(providers[0][0], model, messages, max_tokens, temperature, use_cache)
+        if cached is not None:
+            return cached
+        scheduler = self._llm_scheduler()
+        async with scheduler.slot(providers[0][0], estimate_request_tokens(messages, max_tokens), priority, chat) as grant:
+            if self.llm_resilience is None:
+                name, usecase, model = providers[0]
+                text = await usecase.complete(messages, model=model, max_tokens=max_tokens, temperature=temperature)
+            else:
+                text, name = await self.llm_resilience.complete(
+                    providers, messages, max_tokens=max_tokens, temperature=temperature
+                )
+                # After a failover the tokens were spent on the backup provider's budget
+                scheduler.charge_to(grant, name)
+        self.logger.debug(f"LLM call served by {name}")
+        text = text.strip()
+        if key is not None and name != providers[0][0]:
+            # Failover answer: stored under the provider and model that produced it
+            model = next((m for n, _, m in providers if n == name), None)
+            key = make_cache_key(name, model, messages, max_tokens, temperature)
+        await self._llm_cache_store(key, text, name, model)
+        return text
+
+    async def _llm_stream(self, messages: list[dict], max_tokens: int, temperature: float,
+                          use_cache: bool = True, priority: str = "interactive", chat: Optional[str] = None):
+        """Streaming variant of ``_llm_complete``: yields text pieces as the provider produces them.
+
+        Generation is aborted once ``stream_max_chars`` characters have arrived (0 = no limit);
+        only complete answers are cached. A cache hit is yielded as a single piece.
+        """
+        # Streams are not retried or hedged: the first configured provider is used
+        name, usecase, model = self._llm_providers()[0]
+        key, cached = await self._llm_cache_lookup(name, model, messages, max_tokens, temperature, use_cache)
+        if cached is not None:
+            yield cached
+            return
+        parts: list[str] = []
+        received = 0
+        aborted = False
+        async with self._llm_scheduler().slot(name, estimate_request_tokens(messages, max_tokens), priority, chat):
+            stream = usecase.complete_stream(messages, model=model, max_tokens=max_tokens, temperature=temperature)
+            try:
+                async for piece in stream:
+                    parts.append(piece)
+                    received += len(piece)
+                    yield piece
+                    if self.stream_max_chars and received >= self.stream_max_chars:
+                        self.logger.warning(f"LLM stream stopped after {received} chars (stream_max_chars)")
+                        aborted = True
+                        break
+            finally:
+                # Closes the HTTP response, which stops the generation on the provider side
+                await stream.aclose()
+        if not aborted:
+            await self._llm_cache_store(key, "".join(parts).strip(), name, model)
+
+    async def _send_streamed(self, target_chat: str, prefix: str, stream) -> tuple[Optional[int], str]:
+        """Send a message as soon as the first text arrives and keep editing it while ``stream`` runs.
+
+        Edits are throttled to one per ``stream_edit_interval_sec``; the final text is always applied.
+        Returns (message id or None, full text).
+        """
+        text = ""
+        shown = ""
+        message_id: Optional[int] = None
+        last_edit = 0.0
+        loop = asyncio.get_running_loop()
+
+        async def _show(body: str) -> None:
+            nonlocal message_id, shown, last_edit
+            last_edit = loop.time()
+            body = body[:4096]
+            if message_id is None:
+                res = await self.mcp_client.send_message(target_chat, body)
+                if isinstance(res, dict) and res.get("message_id"):
+                    message_id = int(res["message_id"])
+                else:
+                    self.logger.error(f"Failed to send streamed message to {target_chat}: {res}")
+                    return
+            elif body != shown:
+                res = await self.mcp_client.edit_message(target_chat, message_id, body)
+                if isinstance(res, dict) and res.get("error"):
+                    self.logger.warning(f"Failed to edit streamed message {message_id} in {target_chat}: {res}")
+                    return
+            shown = body
+
+        async for piece in stream:
+            text += piece
+            if text.strip() and loop.time() - last_edit >= self.stream_edit_interval_sec:
+                await _show(prefix + text + " …")
+        text = text.strip()
+        if text:
+            await _show(prefix + text)
+        return message_id, text
 
     async def start_continuous_monitoring(self):
         """Start continuous monitoring of chats"""
@@ -666,43 +1071,359 @@ class TelegramAgent:
             if not chats:
                 self.logger.warning("No chats configured to monitor")
                 return
-            # Process chats sequentially to avoid any potential interleaving across requests
-            for chat_id in chats:
-                await self.monitor_chat(chat_id)
+            try:
+                # Summaries left pending by an earlier run go out first, without refetching or re-prompting
+                await self._resume_outbox()
+                # One tg.get_chats snapshot per iteration: skip chats whose top message is already seen
+                self._dialog_snapshot = await self._take_dialog_snapshot() if self.skip_idle_chats else {}
+                if self._dialog_snapshot:
+                    active = [c for c in chats if self._chat_has_news(c)]
+                    if len(active) < len(chats):
+                        self.logger.info(f"Dialog snapshot: {len(chats) - len(active)} of {len(chats)} chat(s) unchanged, skipped")
+                    chats = active
+                    if not chats:
+                        return
+                # One batched round-trip resolves and fetches the first page of every chat on the server
+                prefetched = await self._prefetch_histories(chats)
+                await self._monitor_chats(chats, prefetched)
+            finally:
+                await self._flush_state()
+
+    async def _take_dialog_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Fetch all dialogs once via tg.get_chats and index them by username and id.
+
+        An empty mapping means no snapshot is available and every chat is monitored as before.
+        """
+        try:
+            dialogs = await asyncio.wait_for(self.mcp_client.get_chats(), timeout=20.0)
+        except asyncio.TimeoutError:
+            self.logger.warning("Timeout taking dialog snapshot; monitoring all chats")
+            return {}
+        except Exception as e:
+            self.logger.debug(f"Dialog snapshot unavailable: {e}")
+            return {}
+        if not isinstance(dialogs, list):
+            self.logger.debug(f"Dialog snapshot returned no list: {dialogs}")
+            return {}
+        snapshot: Dict[str, Dict[str, Any]] = {}
+        for d in dialogs:
+            if not isinstance(d, dict):
+                continue
+            if d.get('username'):
+                snapshot[str(d['username']).lower()] = d
+            try:
+                did = int(d.get('id'))
+            except (TypeError, ValueError):
+                continue
+            snapshot[str(did)] = d
+            # Dialog ids are "marked" (-100<id> for channels, -<id> for groups); resolve_chat returns the bare id
+            if did < -10**12:
+                snapshot[str(-did - 10**12)] = d
+            elif did < 0:
+                snapshot[str(-did)] = d
+        return snapshot
+
+    def _snapshot_entry(self, *refs: Any) -> Optional[Dict[str, Any]]:
+        snapshot = getattr(self, '_dialog_snapshot', None) or {}
+        for ref in refs:
+            if ref is None:
+                continue
+            entry = snapshot.get(str(self.mcp_client._normalize_chat(str(ref))).lower())
+            if entry:
+                return entry
+        return None
+
+    def _chat_has_news(self, chat_id: str) -> bool:
+        """True unless the snapshot proves the chat's top message id is not newer than last_seen."""
+        entry = self._snapshot_entry(chat_id)
+        if not entry:
+            return True
+        try:
+            top_id = int(entry.get('top_message_id'))
+        except (TypeError, ValueError):
+            return True
+        seen = 0
+        for key in (entry.get('username'), str(entry.get('id')), self.mcp_client._normalize_chat(chat_id)):
+            if key:
+                seen = max(seen, int(self.last_seen_ids.get(str(key), 0)))
+        if seen <= 0:
+            # Nothing recorded yet for this chat: let monitor_chat decide
+            return True
+        return top_id > seen
+
+    async def _monitor_chats(self, chats: list, prefetched: Dict[str, Dict[str, Any]]):
+        """Run all chats through the fetch -> filter -> summarize -> send pipeline.
+
+        Stages are joined by bounded queues, so fetching one chat overlaps with summarizing and
+        sending the previous ones. ``monitor_concurrency`` chats are fetched at once and a failing
+        chat never affects the others. When ``monitor_iteration_deadline_sec`` is set, work still
+        running at the deadline is cancelled and picked up again on the next run (last_seen_id only
+        advances once a chat's new messages are stored in the outbox).
+        """
+        async def _fetch(chat_id: str):
+            try:
+                batch = await self._fetch_chat(chat_id, prefetched.get(chat_id))
+            except asyncio.TimeoutError:
+                self.logger.error(f"Timeout monitoring chat {chat_id}")
+                return None
+            except Exception as e:
+                self.logger.error(f"Monitoring failed for {chat_id}: {e!r}")
+                return None
+            return [batch] if batch else None
+
+        async def _filter(batch: Dict[str, Any]):
+            batch = self._filter_chat(batch)
+            return [batch] if batch else None
+
+        async def _summarize(batch: Dict[str, Any]):
+            batch = await self._summarize_chat(batch)
+            return [batch] if batch and batch.get('outgoing') else None
+
+        run_batches: List[Dict[str, Any]] = []
+
+        async def _send(batch: Dict[str, Any]):
+            if self.digest_mode == 'run':
+                # Sent as one message once all chats are through
+                run_batches.append(batch)
+            else:
+                await self._send_chat_summaries(batch)
+            return [batch]
+
+        cfg = self.pipeline_config
+        pipeline = StagePipeline(
+            [
+                ("fetch", _fetch, int(cfg.get('fetch_workers') or self.monitor_concurrency)),
+                ("filter", _filter, int(cfg.get('filter_workers') or 1)),
+                ("summarize", _summarize, int(cfg.get('summarize_workers') or 2)),
+                ("send", _send, int(cfg.get('send_workers') or 1)),
+            ],
+            queue_size=int(cfg.get('queue_size') or 8),
+            logger=self.logger,
+        )
+        timeout = self.monitor_iteration_deadline_sec if self.monitor_iteration_deadline_sec > 0 else None
+        try:
+            await asyncio.wait_for(pipeline.run(chats), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"Monitoring iteration deadline ({self.monitor_iteration_deadline_sec:g}s) reached; "
+                f"unfinished chats will be retried on the next run"
+            )
+        if run_batches:
+            await self._send_run_digest(run_batches)
+        for line in pipeline.summary_lines():
+            self.logger.info(f"Monitoring pipeline: {line}")
+        if self.llm_cache is not None:
+            self.logger.info(f"Monitoring pipeline: {self.llm_cache.summary()}")
+        if self.llm_resilience is not None:
+            for line in self.llm_resilience.summary_lines():
+                self.logger.info(f"Monitoring pipeline: {line}")
+        for line in self._llm_scheduler().summary_lines():
+            self.logger.info(f"Monitoring pipeline: {line}")
+
+    async def _prefetch_histories(self, chats: list) -> Dict[str, Dict[str, Any]]:
+        """Resolve and fetch the first history page of all chats with a single tg.fetch_history_multi call.
+
+        Returns a mapping of the configured chat id -> {"chat": info, "messages": [...], "min_id": int, "cap": int}.
+        An empty mapping means the caller should fall back to per-chat resolve/fetch calls.
+        """
+        entries = []
+        keys: Dict[str, str] = {}
+        for chat_id in chats:
+            norm = self.mcp_client._normalize_chat(chat_id)
+            last_seen = int(self.last_seen_ids.get(str(norm), 0))
+            cap = self._start_page_size(chat_id, norm)
+            entries.append({"chat": chat_id, "min_id": last_seen if last_seen > 0 else None, "cap": cap})
+            keys[str(norm)] = chat_id
+        try:
+            res = await asyncio.wait_for(
+                self.mcp_client.fetch_history_multi(entries, concurrency=self.multi_fetch_concurrency,
+                                                    compact=self.compact_history),
+                timeout=30.0
+            )
+        except asyncio.TimeoutError:
+            self.logger.warning("Timeout in batched history prefetch; falling back to per-chat fetch")
+            return {}
+        except Exception as e:
+            self.logger.debug(f"Batched history prefetch unavailable: {e}")
+            return {}
+        if not isinstance(res, dict) or not isinstance(res.get('results'), dict):
+            self.logger.debug(f"Batched history prefetch returned no results: {res}")
+            return {}
+        out: Dict[str, Dict[str, Any]] = {}
+        min_ids = {str(self.mcp_client._normalize_chat(e['chat'])): e['min_id'] for e in entries}
+        caps = {str(self.mcp_client._normalize_chat(e['chat'])): e['cap'] for e in entries}
+        for key, item in res['results'].items():
+            chat_id = keys.get(str(key))
+            if chat_id is None or not isinstance(item, dict):
+                continue
+            out[chat_id] = {
+                "chat": item.get('chat'),
+                "messages": item.get('messages') or [],
+                "min_id": int(min_ids.get(str(key)) or 0),
+                "cap": caps.get(str(key)),
+            }
+        retry_after = res.get('retry_after') or {}
+        for key, err in (res.get('errors') or {}).items():
+            if key in retry_after:
+                self.logger.warning(f"Flood wait for {keys.get(str(key), key)}: retry after {retry_after[key]}s")
+            else:
+                self.logger.warning(f"Batched prefetch failed for {keys.get(str(key), key)}: {err}")
+        self.logger.debug(f"Batched prefetch returned {len(out)}/{len(chats)} chat(s)")
+        return out
+
+    async def monitor_chat(self, chat_id: str, prefetched: Optional[Dict[str, Any]] = None):
+        """Monitor a specific chat using MCP. Assumes MCP session is already open by the caller.
 
-    async def monitor_chat(self, chat_id: str):
-        """Monitor a specific chat using MCP. Assumes MCP session is already open by the caller."""
+        Runs the pipeline stages (fetch -> filter -> summarize -> send) for a single chat.
+        When ``prefetched`` (from _prefetch_histories) is given, the resolve call and the first
+        history page are taken from it instead of separate MCP round-trips.
+        """
+        try:
+            batch = await self._fetch_chat(chat_id, prefetched)
+            if batch:
+                batch = self._filter_chat(batch)
+            if batch:
+                batch = await self._summarize_chat(batch)
+            if batch:
+                await self._send_chat_summaries(batch)
+        except asyncio.TimeoutError:
+            self.logger.error(f"Timeout monitoring chat {chat_id}")
+        except Exception as e:
+            self.logger.error(f"Error monitoring chat {chat_id}: {e}")
+        finally:
+            await self._flush_state()
+
+    def _chat_setting(self, key: str, default: Any, *refs: Any) -> Any:
+        """Per-chat override from ``chat_settings`` (keys matched like chat ids: '@name', 'name', id)."""
+        if not self.chat_settings:
+            return default
+        wanted = {str(self.mcp_client._normalize_chat(str(r))).lower() for r in refs if r is not None}
+        for name, settings in self.chat_settings.items():
+            if isinstance(settings, dict) and str(self.mcp_client._normalize_chat(str(name))).lower() in wanted:
+                if settings.get(key) is not None:
+                    return settings[key]
+        return default
+
+    @staticmethod
+    def _optional_int(value: Any) -> Optional[int]:
+        if value is None or value == '':
+            return None
+        return max(0, int(value))
+
+    async def _bootstrap_seed(self, chat_ref: str, prefetched: Optional[Dict[str, Any]], latest_only: bool,
+                              cutoff: Optional[datetime]) -> Optional[int]:
+        """Pick the starting last_seen_id for a chat that has none.
+
+        ``latest_only`` seeds at the newest message (only later messages get summarized). With a
+        ``cutoff`` the server returns the last message sent before it (``offset_date``), so
+        everything older is skipped without paging through it. None means "no seed".
+        """
+        if not latest_only and cutoff is None:
+            return None
+        if latest_only and prefetched and prefetched.get('messages'):
+            return max(int(m.get('id') or 0) for m in prefetched['messages']) or None
+        kwargs: Dict[str, Any] = {"page_size": 1}
+        if not latest_only:
+            kwargs["offset_date"] = cutoff.isoformat()
+        try:
+            page = await asyncio.wait_for(self.mcp_client.fetch_history(chat_ref, **kwargs), timeout=15.0)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Timeout bootstrapping {chat_ref}")
+            return None
+        messages = (page or {}).get('messages') if isinstance(page, dict) else None
+        if not messages:
+            return None
+        m = messages[0]
+        # A server without offset_date support returns the newest message: keep paging with the cutoff instead
+        if not latest_only and not self._message_older_than(m, cutoff):
+            return None
+        return int(m.get('id') or 0) or None
+
+    def _start_page_size(self, *refs: Any) -> int:
+        base = max(1, int(self._chat_setting('page_size', self.page_size, *refs)))
+        for ref in refs:
+            if ref is not None and str(ref) in self._next_page_size:
+                return max(1, self._next_page_size[str(ref)])
+        return base
+
+    @staticmethod
+    def _message_older_than(message: Dict[str, Any], cutoff: datetime) -> bool:
         try:
+            dt = datetime.fromisoformat(str(message.get('date')).replace('Z', '+00:00'))
+        except (TypeError, ValueError):
+            return False
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt < cutoff
+
+    async def _fetch_chat(self, chat_id: str, prefetched: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Fetch stage: resolve the chat and page history since last_seen.
+
+        Returns a batch dict (chat_ref, chat_info, new_msgs, ...) for the next stages, or None.
+        The batch's ``last_seen`` is committed by the later stages, not here.
+        """
+        chat_info = (prefetched or {}).get('chat')
+        if not chat_info:
             # Resolve chat first with timeout
             self.logger.debug(f"Resolving chat: {chat_id}")
             chat_info = await asyncio.wait_for(
                 self.mcp_client.resolve_chat(chat_id),
                 timeout=10.0
             )
-            if not chat_info:
-                self.logger.warning(f"Could not resolve chat: {chat_id}")
-                return
-                
-            # Pick a reference to fetch history: prefer username, fallback to id, else original input
-            chat_ref = chat_info.get('username') or str(chat_info.get('id')) or chat_id
-            self.logger.info(f"Resolved chat '{chat_id}' -> ref='{chat_ref}', title='{chat_info.get('title')}', type='{chat_info.get('type')}'")
-
-            # Fetch full history since last_seen using pagination
-            last_seen = int(self.last_seen_ids.get(chat_ref, 0))
-            self.logger.debug(
-                f"Fetching history for {chat_ref} starting from last_seen_id={last_seen} (batch={self.page_size})"
+        if not chat_info:
+            self.logger.warning(f"Could not resolve chat: {chat_id}")
+            return None
+            
+        # Pick a reference to fetch history: prefer username, fallback to id, else original input
+        chat_ref = chat_info.get('username') or str(chat_info.get('id')) or chat_id
+        self.logger.info(f"Resolved chat '{chat_id}' -> ref='{chat_ref}', title='{chat_info.get('title')}', type='{chat_info.get('type')}'")
+
+        # Fetch full history since last_seen using pagination
+        last_seen = int(self.last_seen_ids.get(chat_ref, 0))
+        base_size = max(1, int(self._chat_setting('page_size', self.page_size, chat_id, chat_ref)))
+        max_size = max(base_size, int(self._chat_setting('max_page_size', self.max_page_size, chat_id, chat_ref)))
+        page_size = self._start_page_size(chat_id, chat_ref)
+        # Without last_seen the history would be walked to the very first message: bootstrap instead
+        max_count, cutoff = None, None
+        if last_seen <= 0:
+            max_count = self._optional_int(
+                self._chat_setting('first_run_max_messages', self.first_run_max_messages, chat_id, chat_ref)
             )
+            max_age = float(self._chat_setting('first_run_max_age_hours', self.first_run_max_age_hours, chat_id, chat_ref) or 0)
+            if max_age > 0:
+                cutoff = datetime.now(timezone.utc) - timedelta(hours=max_age)
+            seed = await self._bootstrap_seed(chat_ref, prefetched, latest_only=(max_count == 0), cutoff=cutoff)
+            if seed:
+                last_seen = seed
+                # Only skips history older than the bootstrap window, so it is safe to persist now
+                self._advance_last_seen(chat_ref, seed)
+                self.logger.info(f"Bootstrap for {chat_ref}: last_seen_id seeded at {seed}")
+            if max_count == 0:
+                return None
+        self.logger.debug(
+            f"Fetching history for {chat_ref} starting from last_seen_id={last_seen} (batch={page_size}, max={max_size})"
+        )
 
-            msgs = []
-            max_id_cursor = None  # paginate older within (min_id; max_id]
-            while True:
+        # Reuse the prefetched first page only if it was requested with the same lower bound
+        first_page = None
+        if prefetched and 'messages' in prefetched and int(prefetched.get('min_id') or 0) == last_seen:
+            first_page = prefetched.get('messages') or []
+            page_size = int(prefetched.get('cap') or page_size)
+
+        msgs = []
+        max_id_cursor = None  # paginate older within (min_id; max_id]
+        while True:
+            if first_page is not None:
+                page_msgs, first_page = first_page, None
+            else:
                 try:
                     batch = await asyncio.wait_for(
                         self.mcp_client.fetch_history(
                             chat_ref,
-                            page_size=self.page_size,
+                            page_size=page_size,
                             min_id=last_seen if last_seen > 0 else None,
-                            max_id=max_id_cursor
+                            max_id=max_id_cursor,
+                            compact=self.compact_history
                         ),
                         timeout=15.0
                     )
@@ -710,31 +1431,58 @@ class TelegramAgent:
                     self.logger.warning(f"Timeout fetching history page for {chat_ref}")
                     break
 
+                if isinstance(batch, dict) and batch.get('retry_after'):
+                    self.logger.warning(
+                        f"Flood wait while fetching {chat_ref}: server asks to retry after {batch.get('retry_after')}s; "
+                        f"keeping last_seen_id={last_seen} for the next run"
+                    )
+                    break
                 if not batch or 'messages' not in batch:
                     break
 
                 page_msgs = batch['messages'] or []
-                if not page_msgs:
-                    break
-
-                # Extend and move cursor to fetch older messages above last_seen
-                msgs.extend(page_msgs)
-                # Determine next max_id (strictly less than current min id)
-                try:
-                    current_min = min(int(m.get('id', 0)) for m in page_msgs)
-                except Exception:
-                    current_min = None
-                # Stop if page smaller than batch, otherwise set cursor and continue
-                if len(page_msgs) < self.page_size or not current_min:
-                    break
-                max_id_cursor = current_min - 1
+            if not page_msgs:
+                break
 
-            if not msgs:
-                self.logger.info(f"No messages returned for {chat_ref}")
-                return
+            # Extend and move cursor to fetch older messages above last_seen
+            msgs.extend(page_msgs)
+            # Determine next max_id (strictly less than current min id)
+            try:
+                current_min = min(int(m.get('id', 0)) for m in page_msgs)
+            except Exception:
+                current_min = None
+            # Stop if page smaller than batch, otherwise set cursor and continue
+            if len(page_msgs) < page_size or not current_min:
+                break
+            if max_count is not None and len(msgs) >= max_count:
+                break
+            if cutoff and any(self._message_older_than(m, cutoff) for m in page_msgs):
+                break
+            max_id_cursor = current_min - 1
+            # Full page: there is a backlog, so ask for more per round-trip
+            page_size = min(max_size, page_size * 2)
+
+        if msgs and (max_count is not None or cutoff):
+            before = len(msgs)
+            if cutoff:
+                msgs = [m for m in msgs if not self._message_older_than(m, cutoff)]
+            if max_count is not None:
+                msgs = sorted(msgs, key=lambda m: int(m.get('id') or 0))[-max_count:]
+            if len(msgs) < before:
+                self.logger.info(f"First run for {chat_ref}: keeping newest {len(msgs)} of {before} fetched message(s)")
+        # Next run starts with a page sized to this backlog; quiet chats shrink back to page_size
+        self._next_page_size[chat_ref] = max(base_size, min(max_size, len(msgs)))
+
+        if not msgs:
+            self.logger.info(f"No messages returned for {chat_ref}")
+            return None
 
-            self.logger.debug(f"Fetched total {len(msgs)} message(s) for {chat_ref} before de-dup")
-            # Query server-side unread counters
+        self.logger.debug(f"Fetched total {len(msgs)} message(s) for {chat_ref} before de-dup")
+        # Unread counters: from this iteration's dialog snapshot, else ask the server
+        snap = self._snapshot_entry(chat_ref, chat_info.get('id'), chat_id)
+        if snap is not None:
+            unread_info = snap
+        else:
             try:
                 unread_info = await asyncio.wait_for(
                     self.mcp_client.get_unread_count(chat_ref),
@@ -743,93 +1491,361 @@ class TelegramAgent:
             except asyncio.TimeoutError:
                 unread_info = {}
                 self.logger.warning(f"Timeout getting unread count for {chat_ref}")
-            unread = 0
-            if isinstance(unread_info, dict):
-                try:
-                    unread = int(unread_info.get('unread', 0))
-                except Exception:
-                    unread = 0
+        unread = 0
+        if isinstance(unread_info, dict):
+            try:
+                unread = int(unread_info.get('unread', 0))
+            except Exception:
+                unread = 0
 
-            # Deduplicate: process only messages with id > last_seen_id
-            def _mid(m: Dict[str, Any]) -> int:
-                try:
-                    return int(m.get('id', 0))
-                except Exception:
-                    return 0
-            new_msgs = [m for m in msgs if _mid(m) > last_seen]
-            self.logger.debug(f"New messages for {chat_ref} since {last_seen}: {len(new_msgs)}")
-            if new_msgs:
-                # Sort ascending by id to preserve chronology, update last_seen
-                new_msgs.sort(key=_mid)
-                new_max = max((_mid(m) for m in new_msgs), default=last_seen)
-                self.last_seen_ids[chat_ref] = max(self.last_seen_ids.get(chat_ref, 0), new_max)
-                # Persist state after update
-                self._save_last_seen()
-            self.logger.info(f"History for {chat_ref}: {len(msgs)} messages, unread: {unread}. New since last_seen_id={last_seen}: {len(new_msgs)}")
-
-            if not new_msgs:
-                return
+        # Deduplicate: process only messages with id > last_seen_id
+        def _mid(m: Dict[str, Any]) -> int:
+            try:
+                return int(m.get('id', 0))
+            except Exception:
+                return 0
+        new_msgs = [m for m in msgs if _mid(m) > last_seen]
+        self.logger.debug(f"New messages for {chat_ref} since {last_seen}: {len(new_msgs)}")
+        if new_msgs:
+            # Sort ascending by id to preserve chronology
+            new_msgs.sort(key=_mid)
+        self.logger.info(f"History for {chat_ref}: {len(msgs)} messages, unread: {unread}. New since last_seen_id={last_seen}: {len(new_msgs)}")
+        self.state_store.add_chat_stats(chat_ref, runs=1, messages=len(new_msgs))
+        if self.archive is not None and new_msgs:
+            self.archive.add(chat_ref, new_msgs)
+
+        if not new_msgs:
+            return None
+        return {
+            "chat_id": chat_id,
+            "chat_ref": chat_ref,
+            "chat_info": chat_info,
+            "title": chat_info.get('title') or chat_ref,
+            "target_chat": self.summary_chat or chat_ref,
+            "new_msgs": new_msgs,
+            # Advanced only once the messages are safe in the outbox (or need no summary), so a
+            # batch cancelled in between is fetched again on the next run
+            "last_seen": _mid(new_msgs[-1]),
+        }
 
-            # Apply filters and chunk by configured size
-            filtered = [m for m in new_msgs if self.should_process_message(m)]
-            self.logger.info(f"Filtered messages for {chat_ref}: {len(filtered)} of {len(new_msgs)} passed filters")
-            if not filtered:
-                self.logger.warning(f"No messages passed filters for {chat_ref} (0/{len(new_msgs)}).")
-                # Soft mode: fall back to all new messages
-                if self.filter_mode == 'soft' and new_msgs:
-                    self.logger.info(f"filter_mode=soft: using all {len(new_msgs)} new messages for {chat_ref} to build summary")
-                    filtered = new_msgs
-                else:
-                    # Optionally send a placeholder report
-                    if self.report_if_empty:
-                        target_chat = self.summary_chat or chat_ref
-                        title = chat_info.get('title') or chat_ref
-                        placeholder = (
-                            f"🧠 Сводка для {title}: релевантных сообщений по фильтрам не найдено. "
-                            f"Новых сообщений за период: {len(new_msgs)}."
-                        )
-                        try:
-                            send_res = await self.mcp_client.send_message(target_chat, placeholder)
-                            if isinstance(send_res, dict) and send_res.get("message_id"):
-                                self.logger.info(f"Empty report note sent to {target_chat} for {chat_ref}")
-                            else:
-                                self.logger.error(f"Failed to send empty report note to {target_chat}: {send_res}")
-                        except Exception as e:
-                            self.logger.error(f"Error sending empty report note for {chat_ref}: {e}")
-                    return
+    def _filter_chat(self, batch: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Filter stage: apply message filters and split into chunks (or prepare an empty-report note)."""
+        chat_ref, new_msgs = batch['chat_ref'], batch['new_msgs']
+        filtered = self.message_filter.filter_batch(new_msgs)
+        self.logger.info(f"Filtered messages for {chat_ref}: {len(filtered)} of {len(new_msgs)} passed filters")
+        if not filtered:
+            self.logger.warning(f"No messages passed filters for {chat_ref} (0/{len(new_msgs)}).")
+            # Soft mode: fall back to all new messages
+            if self.filter_mode == 'soft' and new_msgs:
+                self.logger.info(f"filter_mode=soft: using all {len(new_msgs)} new messages for {chat_ref} to build summary")
+                filtered = new_msgs
+            elif self.report_if_empty:
+                # Optionally send a placeholder report (goes straight to the send stage)
+                batch['outgoing'] = [{
+                    "label": f"Empty report note for {chat_ref}",
+                    "text": (
+                        f"🧠 Сводка для {batch['title']}: релевантных сообщений по фильтрам не найдено. "
+                        f"Новых сообщений за период: {len(new_msgs)}."
+                    ),
+                }]
+                self._advance_last_seen(chat_ref, batch.get('last_seen'))
+                return batch
+            else:
+                # Nothing to summarize: the messages are done with
+                self._advance_last_seen(chat_ref, batch.get('last_seen'))
+                return None
+
+        batch['chunks'] = self._make_chunks(filtered)
+        self.logger.info(f"Processing {len(filtered)} new messages in {len(batch['chunks'])} chunks for {chat_ref}")
+        return batch
+
+    async def _summarize_chat(self, batch: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Summarize stage: turn each chunk into a "Сводка #i/N" message for the send stage."""
+        if batch.get('outgoing') is not None:
+            return batch
+        chat_ref, chunks = batch['chat_ref'], batch['chunks']
+        # Ensure LLM is configured before summarizing
+        ok, err = self._llm_is_configured()
+        if not ok:
+            self.logger.warning(f"Skipping summarization for {chat_ref}: {err}")
+            return None
+        username = batch['chat_info'].get('username') if isinstance(batch['chat_info'], dict) else None
+        # Persist the chunks as pending outbox records (together with last_seen) before any LLM call;
+        # chunks already sent in an earlier run are not returned
+        records = await self.state_store.acall(
+            self.state_store.outbox_add, chat_ref, batch['target_chat'], batch['title'], username,
+            [(self._chunk_key(chunk), idx, len(chunks), chunk) for idx, chunk in enumerate(chunks, start=1)],
+            batch.get('last_seen')
+        )
+        self._advance_last_seen(chat_ref, batch.get('last_seen'))
+        if len(records) < len(chunks):
+            self.logger.info(f"Skipping {len(chunks) - len(records)} already sent chunk(s) for {chat_ref}")
+        return await self._complete_outbox(batch, records)
+
+    def _outbox_text(self, batch: Dict[str, Any], rec: Dict[str, Any], summary: str) -> str:
+        # Digest modes keep the bare summary: it is a reduce input, not a message
+        if self.digest_mode != 'chunks':
+            return summary
+        return f"🧠 Сводка #{rec['idx']}/{rec['total']} для {batch['title']}:\n\n" + summary
 
-            chunks = self._chunk_list(filtered, self.chunk_size)
-            self.logger.info(f"Processing {len(filtered)} new messages in {len(chunks)} chunks for {chat_ref}")
+    async def _summarize_rolling(self, batch: Dict[str, Any], records: list) -> Dict[int, Optional[str]]:
+        """Summarize a chat's records in order against its rolling summary (see ``summarize_with_state``).
 
-            # Summarize each chunk and send
-            target_chat = self.summary_chat or chat_ref
-            for idx, chunk in enumerate(chunks, start=1):
-                try:
-                    # Ensure LLM is configured before summarizing
-                    ok, err = self._llm_is_configured()
-                    if not ok:
-                        self.logger.warning(f"Skipping summarization for {chat_ref}: {err}")
-                        continue
-                    summary = await self.summarize_news_and_trends(
-                        chunk,
-                        source_title=chat_info.get('title') or chat_ref,
-                        source_username=(chat_info.get('username') if isinstance(chat_info, dict) else None)
+        Returns {outbox id: report or None}. Each chunk's state update is stored together with its
+        outbox text, so a resumed run continues from the right state. The first failed chunk stops
+        the chat: later chunks are left out of the result and wait, unsummarized, for its retry.
+        """
+        chat_ref = batch['chat_ref']
+        username = batch['chat_info'].get('username') if isinstance(batch['chat_info'], dict) else None
+        saved = await self.state_store.acall(self.state_store.rolling_summary, chat_ref)
+        state = saved['summary'] if saved else None
+        reports: Dict[int, Optional[str]] = {}
+        # The state threads through the chunks, so they run one after another (chats still run in parallel)
+        for rec in sorted(records, key=lambda r: r['idx'] or 0):
+            try:
+                new_state, report = await self.summarize_with_state(state, rec['messages'], batch['title'], username)
+            except Exception as e:
+                self.logger.error(f"Error updating rolling summary for {chat_ref} (chunk {rec['idx']}/{rec['total']}): {e}")
+                reports[rec['id']] = None
+                break
+            ids = [int(m.get('id') or 0) for m in rec['messages'] if isinstance(m, dict)]
+            await self.state_store.acall(
+                self.state_store.rolling_save, chat_ref, new_state or "", max(ids) if ids else None,
+                (rec['id'], self._outbox_text(batch, rec, report))
+            )
+            state, reports[rec['id']] = new_state, report
+        return reports
+
+    async def _complete_outbox(self, batch: Dict[str, Any], records: list) -> Dict[str, Any]:
+        """Summarize outbox records that have no text yet and turn all of them into outgoing messages."""
+        need = [r for r in records if not r.get('text')]
+        if self.rolling_summary_enabled:
+            reports = await self._summarize_rolling(batch, need)
+            # Records after a failed chunk were not attempted: they stay pending without using an attempt
+            need = [r for r in need if r['id'] in reports]
+            summaries = [reports[r['id']] for r in need]
+        else:
+            summaries = await self._summarize_chunks(
+                [r['messages'] for r in need],
+                source_title=batch['title'],
+                source_username=(batch['chat_info'].get('username') if isinstance(batch['chat_info'], dict) else None)
+            )
+        texts: Dict[int, str] = {}
+        failed = []
+        for rec, summary in zip(need, summaries):
+            if summary and summary.strip():
+                rec['text'] = texts[rec['id']] = self._outbox_text(batch, rec, summary)
+            else:
+                failed.append(rec['id'])
+        if texts:
+            await self.state_store.acall(self.state_store.outbox_set_summaries, texts)
+        if failed:
+            await self.state_store.acall(self.state_store.outbox_mark_failed, failed, "empty or failed summary",
+                                         self.outbox_max_attempts)
+        # Outgoing messages keep chunk order regardless of which LLM call finished first
+        ready = [r for r in sorted(records, key=lambda r: r['idx'] or 0) if r.get('text')]
+        if self.digest_mode == 'chunks':
+            batch['outgoing'] = [
+                {"label": f"Summary chunk {r['idx']}/{r['total']}", "text": r['text'], "outbox_ids": [r['id']]}
+                for r in ready
+            ]
+            return batch
+        batch['outgoing'] = []
+        if not ready:
+            return batch
+        ids = [r['id'] for r in ready]
+        username = batch['chat_info'].get('username') if isinstance(batch['chat_info'], dict) else None
+        try:
+            digest = await self.reduce_summaries([r['text'] for r in ready], batch['title'],
+                                                 chat=username or batch['title'])
+        except Exception as e:
+            # The chunk summaries stay in the outbox; the next run only repeats the reduce
+            self.logger.error(f"Error reducing {len(ready)} summaries for {batch['chat_ref']}: {e}")
+            await self.state_store.acall(self.state_store.outbox_mark_failed, ids, f"digest failed: {e}",
+                                         self.outbox_max_attempts)
+            return batch
+        batch['digest'] = digest
+        header = f"🧠 Дайджест для {batch['title']} ({len(ready)} сводок):\n\n"
+        batch['outgoing'] = [
+            {"label": f"Digest of {len(ready)} chunk(s)", "text": fit_message(header + digest), "outbox_ids": ids}
+        ]
+        return batch
+
+    async def _resume_outbox(self):
+        """Finish outbox records left pending by an earlier run (crash, LLM or send failure).
+
+        Records that already have a summary are only sent; the rest are summarized from the stored
+        messages. Nothing is fetched from Telegram again.
+        """
+        try:
+            pending = await self.state_store.acall(self.state_store.outbox_pending)
+        except Exception as e:
+            self.logger.warning(f"Failed to read outbox: {e}")
+            return
+        if not pending:
+            return
+        self.logger.info(f"Resuming {len(pending)} pending outbox record(s)")
+        by_chat: Dict[tuple, list] = {}
+        for rec in pending:
+            by_chat.setdefault((rec['chat'], rec['target'], rec['title'], rec['username']), []).append(rec)
+        run_batches: List[Dict[str, Any]] = []
+        for (chat_ref, target, title, username), records in by_chat.items():
+            batch = {
+                "chat_ref": chat_ref,
+                "chat_info": {"username": username},
+                "title": title or chat_ref,
+                "target_chat": target or self.summary_chat or chat_ref,
+            }
+            if any(not r.get('text') for r in records):
+                ok, err = self._llm_is_configured()
+                if not ok:
+                    self.logger.warning(f"Outbox for {chat_ref}: summaries still pending, {err}")
+                    records = [r for r in records if r.get('text')]
+            try:
+                batch = await self._complete_outbox(batch, records)
+                if self.digest_mode == 'run':
+                    run_batches.append(batch)
+                else:
+                    await self._send_chat_summaries(batch)
+            except Exception as e:
+                self.logger.error(f"Error resuming outbox for {chat_ref}: {e}")
+        if run_batches:
+            await self._send_run_digest(run_batches)
+
+    @staticmethod
+    def _chunk_key(chunk: list) -> str:
+        ids = [int(m.get('id') or 0) for m in chunk if isinstance(m, dict)]
+        if not ids:
+            return ""
+        key = f"{min(ids)}-{max(ids)}"
+        # Parts of one split message land in different chunks with the same id range
+        if chunk[0].get('parts') or chunk[-1].get('parts'):
+            key += f"/p{chunk[0].get('part', 0)}-{chunk[-1].get('part', 0)}"
+        return key
+
+    async def _send_chat_summaries(self, batch: Dict[str, Any]) -> None:
+        """Send stage: deliver the prepared messages of one chat in order."""
+        for item in batch.get('outgoing') or []:
+            await self._send_outgoing(batch['target_chat'], item, [batch['chat_ref']])
+
+    async def _send_outgoing(self, target_chat: str, item: Dict[str, Any], chat_refs: List[str]) -> bool:
+        """Send one prepared message and settle its outbox records (``outbox_ids``)."""
+        ids = item.get('outbox_ids') or []
+        try:
+            send_res = await self.mcp_client.send_message(target_chat, item['text'])
+            if isinstance(send_res, dict) and send_res.get("message_id"):
+                self.logger.info(f"{item['label']} sent to {target_chat}")
+                for rec_id in ids:
+                    await self.state_store.acall(
+                        self.state_store.outbox_mark_sent, rec_id, send_res.get("message_id")
                     )
-                    if summary and summary.strip():
-                        prefix = f"🧠 Сводка #{idx}/{len(chunks)} для {chat_info.get('title') or chat_ref}:\n\n"
-                        send_res = await self.mcp_client.send_message(target_chat, prefix + summary)
-                        if isinstance(send_res, dict) and send_res.get("message_id"):
-                            self.logger.info(f"Summary chunk {idx}/{len(chunks)} sent to {target_chat}")
-                        else:
-                            self.logger.error(f"Failed to send summary chunk {idx} to {target_chat}: {send_res}")
-                except Exception as e:
-                    self.logger.error(f"Error summarizing/sending chunk {idx}: {e}")
-                    
-        except asyncio.TimeoutError:
-            self.logger.error(f"Timeout monitoring chat {chat_id}")
+                for chat_ref in chat_refs:
+                    self.state_store.add_chat_stats(chat_ref, summaries=1)
+                return True
+            self.logger.error(f"Failed to send {item['label']} to {target_chat}: {send_res}")
+            error = str(send_res)
         except Exception as e:
-            self.logger.error(f"Error monitoring chat {chat_id}: {e}")
-            
+            self.logger.error(f"Error sending {item['label']} for {', '.join(chat_refs)}: {e}")
+            error = str(e)
+        for chat_ref in chat_refs:
+            self.state_store.add_chat_stats(chat_ref, errors=1)
+        if ids:
+            # The summary text stays in the outbox; the next run retries the send only
+            await self.state_store.acall(
+                self.state_store.outbox_mark_failed, ids, error, self.outbox_max_attempts
+            )
+        return False
+
+    async def _send_run_digest(self, batches: List[Dict[str, Any]]) -> None:
+        """Merge the chat digests of one run into a single message ("run" digest mode).
+
+        It goes to ``summary_chat`` (or the first chat's target); all chunk records of the run are
+        settled by this one send.
+        """
+        parts = [b for b in batches if b.get('digest')]
+        if not parts:
+            return
+        target_chat = self.summary_chat or parts[0]['target_chat']
+        ids = [rec_id for b in parts for item in b['outgoing'] for rec_id in item.get('outbox_ids') or []]
+        chat_refs = [b['chat_ref'] for b in parts]
+        try:
+            digest = await self.reduce_summaries([f"{b['title']}:\n{b['digest']}" for b in parts],
+                                                 "все отслеживаемые чаты", chat="run")
+        except Exception as e:
+            self.logger.error(f"Error reducing the run digest of {len(parts)} chat(s): {e}")
+            await self.state_store.acall(self.state_store.outbox_mark_failed, ids, f"digest failed: {e}",
+                                         self.outbox_max_attempts)
+            return
+        titles = ", ".join(b['title'] for b in parts)
+        header = f"🧠 Дайджест по чатам: {titles}\n\n"
+        if len(header) > 300:
+            header = f"🧠 Дайджест по {len(parts)} чатам:\n\n"
+        item = {"label": f"Run digest of {len(parts)} chat(s)", "text": fit_message(header + digest), "outbox_ids": ids}
+        await self._send_outgoing(target_chat, item, chat_refs)
+
+    async def summarize_export(self, path: str, source_title: Optional[str] = None,
+                               source_username: Optional[str] = None, min_id: int = 0,
+                               target_chat: Optional[str] = None) -> list:
+        """Summarize a history file written by the server's tg.export_history tool.
+
+        Reads the local export (JSONL.gz or SQLite) instead of paging history over MCP,
+        applies the usual filters and chunking, and returns the chunk summaries.
+        If target_chat is given, each summary is also sent there; with ``stream_summaries`` the chunks
+        are summarized one by one and each message is sent on the first tokens and edited as it grows.
+        In the "chat"/"run" digest modes one merged digest is sent instead of the chunk summaries.
+        """
+        loop = asyncio.get_event_loop()
+        messages = await loop.run_in_executor(None, lambda: list(iter_exported_messages(path, min_id)))
+        filtered = self.message_filter.filter_batch(messages)
+        if not filtered and self.filter_mode == 'soft':
+            filtered = messages
+        chunks = self._make_chunks(filtered)
+        title = source_title or os.path.basename(path)
+        self.logger.info(f"Export {path}: {len(messages)} message(s), {len(filtered)} passed filters, {len(chunks)} chunk(s)")
+        if target_chat and self.stream_summaries and self.digest_mode == 'chunks':
+            return await self._stream_export_summaries(chunks, title, source_username, target_chat)
+        summaries = await self._summarize_chunks(chunks, source_title=title, source_username=source_username)
+        if target_chat and self.digest_mode != 'chunks':
+            ready = [s for s in summaries if s and s.strip()]
+            if ready:
+                digest = await self.reduce_summaries(ready, title, chat=source_username or title)
+                header = f"🧠 Дайджест для {title} ({len(ready)} сводок):\n\n"
+                send_res = await self.mcp_client.send_message(target_chat, fit_message(header + digest))
+                if not (isinstance(send_res, dict) and send_res.get("message_id")):
+                    self.logger.error(f"Failed to send export digest to {target_chat}: {send_res}")
+            return summaries
+        for idx, summary in enumerate(summaries, start=1):
+            if target_chat and summary and summary.strip():
+                prefix = f"🧠 Сводка #{idx}/{len(chunks)} для {title}:\n\n"
+                send_res = await self.mcp_client.send_message(target_chat, prefix + summary)
+                if not (isinstance(send_res, dict) and send_res.get("message_id")):
+                    self.logger.error(f"Failed to send export summary chunk {idx} to {target_chat}: {send_res}")
+        return summaries
+
+    async def _stream_export_summaries(self, chunks: list, title: str, source_username: Optional[str],
+                                       target_chat: str) -> list:
+        """Summarize chunks in order, streaming each summary into its own Telegram message."""
+        summaries: List[Optional[str]] = []
+        for idx, chunk in enumerate(chunks, start=1):
+            prefix = f"🧠 Сводка #{idx}/{len(chunks)} для {title}:\n\n"
+            try:
+                stream = self._llm_stream(
+                    self._news_summary_prompt(chunk, title, source_username),
+                    max_tokens=min(350, int(self.config.get('deepseek_max_tokens', 2000))),
+                    temperature=float(self.config.get('deepseek_temperature', 0.3)),
+                    priority="summary",
+                    chat=source_username or title
+                )
+                message_id, summary = await self._send_streamed(target_chat, prefix, stream)
+            except Exception as e:
+                self.logger.error(f"Error streaming export summary chunk {idx}/{len(chunks)} for {title}: {e}")
+                summaries.append(None)
+                continue
+            if message_id is None and summary:
+                self.logger.error(f"Failed to send export summary chunk {idx} to {target_chat}")
+            summaries.append(summary or None)
+        return summaries
+
     async def process_message(self, message: Dict[str, Any]):
         """Process a single message"""
         text = message.get('text', '')
@@ -850,30 +1866,20 @@ class TelegramAgent:
                 summary = await self.summarize_with_llm({'messages': [message]})
                 print(f"Summary: {summary}")
                 
+    @property
+    def message_filter(self) -> MessageFilter:
+        """Filter compiled from config['filters']; rebuilt only when the section's contents change."""
+        filters = self.config.get('filters') or {}
+        cached = getattr(self, '_message_filter', None)
+        # Compared by value against a snapshot: a missing section or a settings dialog editing the
+        # dict in place must neither rebuild the filter per message nor keep a stale one
+        if cached is None or cached[0] != filters:
+            self._message_filter = (copy.deepcopy(filters), MessageFilter(filters))
+        return self._message_filter[1]
+
     def should_process_message(self, message: Dict[str, Any]) -> bool:
         """Check if message passes filters"""
-        filters = self.config.get('filters', {})
-        
-        # Check minimum length
-        min_length = filters.get('min_length', 0)
-        text = message.get('text', '')
-        if len(text) < min_length:
-            return False
-        
-        # Check keywords
-        keywords = filters.get('keywords', [])
-        if keywords:
-            has_keyword = any(keyword.lower() in text.lower() for keyword in keywords)
-            if not has_keyword:
-                return False
-        
-        # Check excluded senders
-        exclude_senders = filters.get('exclude_senders', [])
-        sender = message.get('from', {}).get('display', '')
-        if sender in exclude_senders:
-            return False
-        
-        return True
+        return self.message_filter.matches(message)
 
     async def test_connection(self) -> bool:
         """Test MCP stdio connection (initialize, tools/list, resolve a test chat)."""
@@ -932,6 +1938,12 @@ class TelegramAgent:
             if not text:
                 return {"sentiment": "neutral", "intent": "unknown", "confidence": 0}
 
+            local = self.lexicon.classify(text) if self.lexicon is not None else None
+            if local is not None and self.lexicon.confident(local):
+                self._record_analysis_path("lexicon", local)
+                return {"sentiment": local.sentiment, "intent": local.intent, "confidence": local.confidence,
+                        "path": "lexicon"}
+
             prompt = (
                 "Определи для сообщения: 1) тональность (positive, negative, neutral), "
                 "2) намерение (question, statement, command, request, complaint, praise, other), "
@@ -942,24 +1954,31 @@ class TelegramAgent:
             result_text = await self._llm_complete(
                 [{"role": "user", "content": prompt}],
                 max_tokens=120,
-                temperature=0.2
+                temperature=0.2,
+                priority="analytics"
             )
-            import json as _json
             result_text = (result_text or "").strip()
+            # Always a dict: a bare list, an array with one object or a wrapped result are all accepted
             try:
-                return _json.loads(result_text)
-            except _json.JSONDecodeError:
-                sentiment = "neutral"
-                intent = "statement"
-                confidence = 0.5
-                low = result_text.lower()
-                if "positive" in low:
-                    sentiment = "positive"
-                elif "negative" in low:
-                    sentiment = "negative"
-                if "question" in low or '?' in text:
-                    intent = "question"
-                return {"sentiment": sentiment, "intent": intent, "confidence": confidence}
+                result = results_by_id(repair_json(result_text), 1).get(1)
+            except ValueError:
+                result = None
+            if result is not None:
+                self._record_analysis_path("llm", local, result)
+                result["path"] = "llm"
+                return result
+            self._record_analysis_path("fallback", local)
+            sentiment = "neutral"
+            intent = "statement"
+            confidence = 0.5
+            low = result_text.lower()
+            if "positive" in low:
+                sentiment = "positive"
+            elif "negative" in low:
+                sentiment = "negative"
+            if "question" in low or '?' in text:
+                intent = "question"
+            return {"sentiment": sentiment, "intent": intent, "confidence": confidence, "path": "fallback"}
         except Exception:
             return {"sentiment": "error", "intent": "error", "confidence": 0}
 
@@ -982,17 +2001,131 @@ class TelegramAgent:
             result_text = await self._llm_complete(
                 [{"role": "user", "content": prompt}],
                 max_tokens=180,
-                temperature=0.2
+                temperature=0.2,
+                priority="analytics"
             )
-            import json as _json
             result_text = (result_text or "").strip()
             try:
-                return _json.loads(result_text)
-            except _json.JSONDecodeError:
+                return repair_json(result_text)
+            except ValueError:
                 return {"entities": [], "topics": [], "urgency": "low", "dates": []}
         except Exception as e:
             return {"entities": [], "topics": [], "urgency": "low", "error": str(e)}
 
+    def _record_analysis_path(self, path: str, local: Optional[LexiconResult] = None,
+                              result: Optional[Dict[str, Any]] = None) -> None:
+        """Count which path answered an analysis ("lexicon", "llm" or "fallback").
+
+        For LLM answers the lexicon's guess is compared too: a high ``llm_agreed`` share means the
+        ``analysis_fast_path.threshold`` can be lowered.
+        """
+        self.analysis_stats[path] = self.analysis_stats.get(path, 0) + 1
+        if local is None:
+            return
+        agreed = bool(result) and (result.get('sentiment'), result.get('intent')) == (local.sentiment, local.intent)
+        if agreed:
+            self.analysis_stats["llm_agreed"] += 1
+        self.logger.debug(
+            f"Analysis path={path} lexicon={local.sentiment}/{local.intent} confidence={local.confidence:.2f}"
+            + (f" agreed={agreed}" if path == "llm" else "")
+        )
+
+    def _analysis_batches(self, items: list) -> list:
+        """Split ``(index, text)`` pairs into batches bounded by message count and estimated tokens."""
+        batches, current, used = [], [], 0
+        for idx, text in items:
+            # Per-message overhead: the "[n] " label and about 60 tokens of JSON in the reply
+            cost = estimate_tokens(text) + 64
+            if current and (len(current) >= self.analysis_batch_size or used + cost > self.analysis_batch_tokens):
+                batches.append(current)
+                current, used = [], 0
+            current.append((idx, text))
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _analysis_prompt(self, texts: List[str]) -> str:
+        lines = "\n".join(f"[{n}] {text}" for n, text in enumerate(texts, start=1))
+        return (
+            "Для каждого сообщения определи: sentiment (positive, negative, neutral), "
+            "intent (question, statement, command, request, complaint, praise, other), confidence (0-1), "
+            "entities (люди, организации, продукты, локации), topics (1-3 основные темы), urgency (high, medium, low).\n"
+            "Ответ строго JSON-массивом без пояснений, по одному объекту на каждое сообщение с его номером: "
+            "[{\"id\": 1, \"sentiment\": \"...\", \"intent\": \"...\", \"confidence\": 0.x, "
+            "\"entities\": [...], \"topics\": [...], \"urgency\": \"...\"}].\n\n"
+            f"Сообщения:\n{lines}"
+        )
+
+    async def _analyze_batch(self, batch: list, chat: Optional[str] = None) -> Dict[int, Dict[str, Any]]:
+        """One LLM call for a batch of ``(index, text)``; returns {index: result} for the parsed ones."""
+        result_text = await self._llm_complete(
+            [{"role": "user", "content": self._analysis_prompt([text for _, text in batch])}],
+            max_tokens=80 * len(batch) + 50,
+            temperature=0.2,
+            priority="analytics",
+            chat=chat
+        )
+        try:
+            parsed = results_by_id(repair_json(result_text), len(batch))
+        except ValueError as e:
+            self.logger.warning(f"Batch analysis of {len(batch)} message(s): {e}")
+            return {}
+        return {batch[local_id - 1][0]: result for local_id, result in parsed.items()}
+
+    async def analyze_messages(self, messages: list, chat: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Sentiment, intent, confidence, entities, topics and urgency for many messages at once.
+
+        Messages the local lexicon classifier is confident about are answered without the LLM
+        (``path`` "lexicon", no entities/topics). The rest are packed into a few batched LLM calls
+        (``analysis_batch``); the JSON replies are repaired and validated, and results are mapped back
+        by their number in the prompt. Messages missing from a reply are asked once more; still
+        missing or failed ones get a heuristic result with ``confidence`` 0 (``path`` "fallback").
+        Results are in input order and carry the message ``id``.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(messages)
+        todo = []
+        for idx, message in enumerate(messages):
+            text = " ".join(str(message.get('text') or '').split())
+            if text:
+                todo.append((idx, text[:ANALYSIS_TEXT_CHARS]))
+            else:
+                results[idx] = {"sentiment": "neutral", "intent": "unknown", "confidence": 0,
+                                "entities": [], "topics": [], "urgency": "low"}
+        local: Dict[int, LexiconResult] = {}
+        if self.lexicon is not None and todo:
+            uncertain = []
+            for (idx, text), guess in zip(todo, self.lexicon.classify_batch([text for _, text in todo])):
+                if self.lexicon.confident(guess):
+                    self._record_analysis_path("lexicon", guess)
+                    results[idx] = {"sentiment": guess.sentiment, "intent": guess.intent,
+                                    "confidence": guess.confidence, "entities": [], "topics": [],
+                                    "urgency": "low", "path": "lexicon"}
+                else:
+                    local[idx] = guess
+                    uncertain.append((idx, text))
+            todo = uncertain
+        for attempt in range(2):
+            if not todo:
+                break
+            outcomes = await asyncio.gather(
+                *(self._analyze_batch(batch, chat) for batch in self._analysis_batches(todo)),
+                return_exceptions=True
+            )
+            for outcome in outcomes:
+                if isinstance(outcome, BaseException):
+                    self.logger.warning(f"Batch analysis call failed: {outcome}")
+                    continue
+                for idx, result in outcome.items():
+                    self._record_analysis_path("llm", local.get(idx), result)
+                    results[idx] = dict(result, path="llm")
+            todo = [(idx, text) for idx, text in todo if results[idx] is None]
+        for idx, text in todo:
+            self._record_analysis_path("fallback", local.get(idx))
+            results[idx] = {"sentiment": "neutral", "intent": "question" if "?" in text else "statement",
+                            "confidence": 0, "entities": [], "topics": [], "urgency": "low", "path": "fallback"}
+        return [dict(result, id=message.get('id')) for message, result in zip(messages, results)]
+
     async def generate_response(self, message: Dict[str, Any], analysis: Dict[str, Any] = None) -> str:
         """Generate automated response using LLM"""
         try:
@@ -1018,17 +2151,19 @@ class TelegramAgent:
             result_text = await self._llm_complete(
                 [{"role": "user", "content": prompt}],
                 max_tokens=160,
-                temperature=float(self.config.get('deepseek_temperature', 0.7))
+                temperature=float(self.config.get('deepseek_temperature', 0.7)),
+                priority="interactive"
             )
             return (result_text or "").strip()
         except Exception as e:
             return f"Response generation error: {str(e)}"
 
-    async def send_auto_response(self, chat_id: str, message: Dict[str, Any]):
+    async def send_auto_response(self, chat_id: str, message: Dict[str, Any], analysis: Dict[str, Any] = None):
         """Send automated response to chat"""
         try:
-            # Analyze the message
-            analysis = await self.analyze_sentiment_and_intent(message)
+            # Analyze the message unless the caller already did (see send_auto_responses)
+            if not analysis:
+                analysis = await self.analyze_sentiment_and_intent(message)
             
             # Generate response
             response_text = await self.generate_response(message, analysis)
@@ -1044,6 +2179,12 @@ class TelegramAgent:
         except Exception as e:
             print(f"Error sending auto-response: {e}")
             
+    async def send_auto_responses(self, chat_id: str, messages: list):
+        """Answer several messages: one batched analysis instead of an analysis call per message."""
+        analyses = await self.analyze_messages(messages, chat=chat_id)
+        for message, analysis in zip(messages, analyses):
+            await self.send_auto_response(chat_id, message, analysis)
+
     async def send_notification(self, message: str, target_chat: str = None):
         """Send notification message"""
         try:
@@ -1140,6 +2281,13 @@ class TelegramAgent:
                 health_status["checks"]["llm_api"] = "not_configured"
         else:
             health_status["checks"]["llm_api"] = f"configured ({provider})" if self.config.get(f"{provider}_api_key", '').strip() else "not_configured"
+        if self.llm_resilience is not None and self.llm_resilience.breakers:
+            health_status["checks"]["llm_breakers"] = ", ".join(
+                f"{name}={br.state}" for name, br in self.llm_resilience.breakers.items()
+            )
+
+        if any(self.analysis_stats.values()):
+            health_status["checks"]["analysis_paths"] = ", ".join(f"{k}={v}" for k, v in self.analysis_stats.items())
 
         # Additional info
         health_status["checks"]["monitored_chats"] = len(self.config.get('chats', []))
@@ -1215,15 +2363,71 @@ class TelegramAgent:
         if health['checks'].get('telegram_connection') not in ['healthy', 'not_configured']:
             await self.reconnect_telegram()
 
-    async def process_user_query(self, query: str) -> str:
-        """Process user query and return response"""
+    async def process_user_query(self, query: str, on_token=None) -> str:
+        """Process user query and return response.
+
+        Questions like "what did @prog_tools say about LangGraph this week" are answered from the
+        local message archive (no MCP or LLM calls). Queries starting with ``/ask`` go to the LLM
+        (with matching archive messages as context); its answer is streamed piece by piece to
+        ``on_token`` while it is generated.
+        """
         try:
-            # For now, just echo back with processing info
-            # In the future, this could integrate with the MCP client
+            if query.strip().lower().startswith('/ask'):
+                return await self._ask_llm(query.strip()[4:].strip(), on_token)
+            terms, chat, since = parse_search_query(query)
+            if self.archive is not None and terms:
+                loop = asyncio.get_event_loop()
+                hits = await loop.run_in_executor(None, lambda: self.archive.search(terms, chat=chat, since=since))
+                return self._format_search_results(terms, chat, hits)
             return f"Processed query: {query}\nAgent is running and monitoring configured chats."
         except Exception as e:
             return f"Error processing query: {str(e)}"
 
+    async def _ask_llm(self, question: str, on_token=None) -> str:
+        if not question:
+            return "Использование: /ask <вопрос>"
+        ok, err = self._llm_is_configured()
+        if not ok:
+            return f"LLM не настроен: {err}"
+        context = ""
+        terms, chat, since = parse_search_query(question)
+        if self.archive is not None and terms:
+            loop = asyncio.get_event_loop()
+            hits = await loop.run_in_executor(None, lambda: self.archive.search(terms, chat=chat, since=since))
+            if hits:
+                context = "Сообщения из отслеживаемых чатов:\n" + "\n".join(
+                    f"[{str(h.get('date') or '')[:16]}] @{h['chat']}: {h.get('text')}" for h in hits
+                ) + "\n\n"
+        stream = self._llm_stream(
+            [
+                {"role": "system", "content": "Ты — ассистент агента мониторинга Telegram. Отвечай по-русски, кратко и по делу."},
+                {"role": "user", "content": context + question},
+            ],
+            max_tokens=int(self.config.get('deepseek_max_tokens', 2000)),
+            temperature=float(self.config.get('deepseek_temperature', 0.3))
+        )
+        parts = []
+        async for piece in stream:
+            parts.append(piece)
+            if on_token is not None:
+                on_token(piece)
+        return "".join(parts).strip()
+
+    @staticmethod
+    def _format_search_results(terms: list, chat: Optional[str], hits: list) -> str:
+        scope = f" в @{chat}" if chat else ""
+        if not hits:
+            return f"По запросу «{' '.join(terms)}»{scope} в архиве ничего не найдено."
+        lines = [f"Найдено в архиве{scope} по запросу «{' '.join(terms)}»: {len(hits)}"]
+        for h in hits:
+            date = str(h.get('date') or '')[:16].replace('T', ' ')
+            text = ' '.join(str(h.get('text') or '').split())
+            if len(text) > 200:
+                text = text[:200] + '…'
+            link = f" https://t.me/{h['chat']}/{h['id']}" if not str(h['chat']).lstrip('-').isdigit() else ""
+            lines.append(f"- [{date}] @{h['chat']} / {h.get('sender') or '?'}: {text}{link}")
+        return "\n".join(lines)
+
     def get_monitored_chats(self) -> list:
         """Get list of monitored chats"""
         return self.config.get('chats', [])
@@ -1329,7 +2533,16 @@ class TelegramAgent:
     def run(self):
         """Run the agent"""
         print("Starting Telegram Monitoring Agent...")
-        self.ui.run()
+        try:
+            self.ui.run()
+        finally:
+            self.state_store.close()
+            if self.archive is not None:
+                self.archive.close()
+            if self.llm_cache is not None:
+                self.logger.info(self.llm_cache.summary())
+                self.llm_cache.close()
+            get_llm_registry().close()
 
 if __name__ == "__main__":
     agent = TelegramAgent()
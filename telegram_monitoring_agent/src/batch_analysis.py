@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Batched message analysis: tolerant JSON parsing of LLM replies and validation of per-message results
+"""
+
+import ast
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+SENTIMENTS = ("positive", "negative", "neutral")
+INTENTS = ("question", "statement", "command", "request", "complaint", "praise", "other")
+URGENCIES = ("high", "medium", "low")
+
+# Long posts are cut for analysis: the opening is enough to classify them
+ANALYSIS_TEXT_CHARS = 1000
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.S | re.I)
+_TRAILING_COMMA = re.compile(r",\s*([\]}])")
+
+
+def _close_truncated(text: str) -> str:
+    """Close the strings and brackets left open by a reply cut off at ``max_tokens``.
+
+    Inside a top-level array the unfinished last element is dropped instead.
+    """
+    stack: List[str] = []
+    in_string = escape = False
+    last_element_end = -1
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "[{":
+            stack.append("]" if ch == "[" else "}")
+        elif ch in "]}" and stack:
+            stack.pop()
+            if len(stack) == 1 and stack[0] == "]":
+                last_element_end = i + 1
+    if not stack and not in_string:
+        return text
+    if stack and stack[0] == "]" and last_element_end > 0:
+        return text[:last_element_end] + "]"
+    return text + ('"' if in_string else "") + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> Any:
+    """Parse the JSON value in an LLM reply.
+
+    Handles code fences, prose around the value, trailing commas, truncated output and
+    Python-style literals (single quotes, True/None). Raises ValueError if nothing parses.
+    """
+    raw = (text or "").strip()
+    fence = _FENCE.search(raw)
+    if fence:
+        raw = fence.group(1).strip()
+    starts = [i for i in (raw.find("["), raw.find("{")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON value in reply")
+    raw = raw[min(starts):]
+    decoder = json.JSONDecoder()
+    candidates = [raw, _TRAILING_COMMA.sub(r"\1", raw)]
+    candidates.append(_TRAILING_COMMA.sub(r"\1", _close_truncated(candidates[1])))
+    for candidate in candidates:
+        try:
+            # raw_decode ignores any text after the value
+            return decoder.raw_decode(candidate)[0]
+        except json.JSONDecodeError:
+            continue
+    pythonic = re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", re.sub(r"\bnull\b", "None", candidates[2])))
+    try:
+        return ast.literal_eval(pythonic)
+    except (ValueError, SyntaxError) as e:
+        raise ValueError(f"Unparseable JSON in reply: {e}") from None
+
+
+def _choice(value: Any, allowed: tuple, default: str) -> str:
+    value = str(value or "").strip().lower()
+    return value if value in allowed else default
+
+
+def _strings(value: Any) -> List[str]:
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple)):
+        return []
+    return [str(v).strip() for v in value if isinstance(v, (str, int, float)) and str(v).strip()]
+
+
+def normalize_analysis(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Coerce one result to the analysis schema; unknown labels fall back to neutral/other/low."""
+    try:
+        confidence = min(1.0, max(0.0, float(item.get("confidence", 0.5))))
+    except (TypeError, ValueError):
+        confidence = 0.5
+    return {
+        "sentiment": _choice(item.get("sentiment"), SENTIMENTS, "neutral"),
+        "intent": _choice(item.get("intent"), INTENTS, "other"),
+        "confidence": confidence,
+        "entities": _strings(item.get("entities")),
+        "topics": _strings(item.get("topics")),
+        "urgency": _choice(item.get("urgency"), URGENCIES, "low"),
+    }
+
+
+def results_by_id(parsed: Any, expected: int) -> Dict[int, Dict[str, Any]]:
+    """Map a parsed batch reply to {local id: normalized result}.
+
+    Accepts an array of objects with ``id``, an object wrapping such an array, or (for a batch of
+    one) a single result object. Objects without a valid id are matched by position when the
+    reply has exactly ``expected`` items.
+    """
+    if isinstance(parsed, dict):
+        wrapped = next((v for v in parsed.values()
+                        if isinstance(v, list) and v and all(isinstance(i, dict) for i in v)), None)
+        parsed = wrapped if wrapped is not None else [dict(parsed, id=parsed.get("id", 1))]
+    if not isinstance(parsed, list):
+        return {}
+    items = [item for item in parsed if isinstance(item, dict)]
+    out: Dict[int, Dict[str, Any]] = {}
+    for pos, item in enumerate(items, start=1):
+        local_id: Optional[int]
+        try:
+            local_id = int(str(item.get("id")).strip("#[] "))
+        except (TypeError, ValueError):
+            local_id = pos if len(items) == expected else None
+        if local_id is not None and 1 <= local_id <= expected and local_id not in out:
+            out[local_id] = normalize_analysis(item)
+    return out
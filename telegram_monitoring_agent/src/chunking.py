@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Token-budget chunking: pack messages greedily into LLM prompts of a bounded size
+"""
+
+import re
+from typing import Any, Dict, Iterable, List
+
+# Words, numbers and single punctuation marks, the units BPE tokenizers split around
+_PIECE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]", re.U)
+# Places to split an oversized message, from the most to the least natural
+_BREAKS = (
+    (re.compile(r"\n\s*\n"), "\n\n"),
+    (re.compile(r"\n"), "\n"),
+    (re.compile(r"(?<=[.!?…])\s+"), " "),
+    (re.compile(r"\s+"), " "),
+)
+
+# Per-message prompt overhead: "<sender>: " prefix and the " [src: https://t.me/<user>/<id>]" suffix
+MESSAGE_OVERHEAD_TOKENS = 16
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local approximation of a BPE token count.
+
+    Latin words cost about one token per 4 chars, Cyrillic and other non-ASCII words about one per
+    2.5 chars (they are split into more pieces), digits one per 3, punctuation one each.
+    """
+    if not text:
+        return 0
+    total = 0
+    for piece in _PIECE.findall(text):
+        n = len(piece)
+        if piece.isdigit():
+            total += (n + 2) // 3
+        elif piece.isascii():
+            total += (n + 3) // 4 if piece.isalpha() else 1
+        else:
+            total += max(1, int(n / 2.5 + 0.99))
+    return total
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    sender = (message.get('from') or {}).get('display') or ''
+    return estimate_tokens(message.get('text') or '') + estimate_tokens(sender) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _split_text(text: str, budget: int) -> List[str]:
+    """Split ``text`` into pieces of at most ``budget`` estimated tokens at the most natural breaks."""
+    if estimate_tokens(text) <= budget:
+        return [text]
+    for brk, joiner in _BREAKS:
+        parts = [p for p in brk.split(text) if p.strip()]
+        if len(parts) > 1:
+            break
+    else:
+        # One unbroken run of characters: cut by length
+        step = max(1, budget * 2)
+        return [text[i:i + step] for i in range(0, len(text), step)]
+    pieces: List[str] = []
+    current, used = "", 0
+    for part in parts:
+        cost = estimate_tokens(part)
+        if cost > budget:
+            if current:
+                pieces.append(current)
+                current, used = "", 0
+            pieces.extend(_split_text(part, budget))
+            continue
+        if current and used + cost <= budget:
+            current, used = f"{current}{joiner}{part}", used + cost
+        else:
+            if current:
+                pieces.append(current)
+            current, used = part, cost
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_message(message: Dict[str, Any], budget: int) -> List[Dict[str, Any]]:
+    """Copies of ``message`` with the text split to fit ``budget``; parts carry ``part``/``parts``."""
+    text_budget = max(1, budget - (message_tokens(message) - estimate_tokens(message.get('text') or '')))
+    texts = _split_text(message.get('text') or '', text_budget)
+    if len(texts) == 1:
+        return [message]
+    return [dict(message, text=t, part=i, parts=len(texts)) for i, t in enumerate(texts, start=1)]
+
+
+def pack_messages(messages: Iterable[Dict[str, Any]], budget: int, max_messages: int = 0) -> List[List[Dict[str, Any]]]:
+    """Greedily pack messages, in order, into chunks of at most ``budget`` estimated prompt tokens
+    (and at most ``max_messages`` messages if set). Oversized messages are split into parts."""
+    budget = max(1, int(budget))
+    chunks: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    used = 0
+    for message in messages:
+        for part in split_message(message, budget) if message_tokens(message) > budget else [message]:
+            cost = message_tokens(part)
+            if current and (used + cost > budget or (max_messages and len(current) >= max_messages)):
+                chunks.append(current)
+                current, used = [], 0
+            current.append(part)
+            used += cost
+    if current:
+        chunks.append(current)
+    return chunks
@@ -6,21 +6,21 @@ DeepSeek LLM Implementation
 import aiohttp
 import json
 import os
-from typing import List, Dict, Any
-from .llm_usecase import LlmUseCase
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional
+from .llm_usecase import LlmHttpError, LlmUseCase, parse_retry_after
 
 
 class DeepSeekUseCase(LlmUseCase):
     """DeepSeek LLM implementation"""
 
-    def __init__(self):
+    def __init__(self, session_factory: Optional[Callable[[], aiohttp.ClientSession]] = None):
+        super().__init__(session_factory)
         self.api_url = "https://api.deepseek.com/chat/completions"
-        self.api_key = os.getenv('DEEPSEEK_API_KEY', '')
 
-    async def complete(self, messages: List[Dict[str, str]], **kwargs) -> str:
-        """Complete the conversation using DeepSeek API"""
-
-        if not self.api_key:
+    def _request(self, messages: List[Dict[str, str]], stream: bool, **kwargs) -> tuple:
+        # Read per request: the use case is shared for the whole process and keys may be set later (UI, .env)
+        api_key = os.getenv('DEEPSEEK_API_KEY', '')
+        if not api_key:
             raise Exception("DeepSeek API key not found. Set DEEPSEEK_API_KEY environment variable")
 
         # Get parameters from kwargs or use defaults
@@ -31,21 +31,27 @@ class DeepSeekUseCase(LlmUseCase):
         request_body = {
             'model': model,
             'messages': messages,
-            'stream': False,
+            'stream': stream,
             'max_tokens': max_tokens,
             'temperature': temperature,
         }
 
         headers = {
             'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.api_key}',
+            'Authorization': f'Bearer {api_key}',
         }
+        return headers, request_body
+
+    async def complete(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """Complete the conversation using DeepSeek API"""
+        headers, request_body = self._request(messages, False, **kwargs)
 
-        async with aiohttp.ClientSession() as session:
+        async with self._session() as session:
             async with session.post(self.api_url, headers=headers, json=request_body) as response:
                 if response.status != 200:
                     error_text = await response.text()
-                    raise Exception(f"DeepSeek API error {response.status}: {error_text}")
+                    raise LlmHttpError(f"DeepSeek API error {response.status}: {error_text}", response.status,
+                                       parse_retry_after(response.headers.get('Retry-After')))
 
                 data = await response.json()
                 content = data.get('choices', [{}])[0].get('message', {}).get('content', '')
@@ -54,3 +60,31 @@ class DeepSeekUseCase(LlmUseCase):
                     raise Exception("Empty response from DeepSeek")
 
                 return content
+
+    async def complete_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """Stream the completion using DeepSeek server-sent events (``data: {...}`` lines)"""
+        headers, request_body = self._request(messages, True, **kwargs)
+
+        async with self._session() as session:
+            async with session.post(self.api_url, headers=headers, json=request_body) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise LlmHttpError(f"DeepSeek API error {response.status}: {error_text}", response.status,
+                                       parse_retry_after(response.headers.get('Retry-After')))
+
+                async for raw in response.content:
+                    line = raw.decode('utf-8', errors='replace').strip()
+                    # Blank separators and ": keep-alive" comments carry no data
+                    if not line.startswith('data:'):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == '[DONE]':
+                        break
+                    try:
+                        event = json.loads(payload)
+                    except json.JSONDecodeError:
+                        continue
+                    delta = (event.get('choices') or [{}])[0].get('delta') or {}
+                    piece = delta.get('content')
+                    if piece:
+                        yield piece
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Map-reduce digests: merge chunk summaries hierarchically into one Telegram-sized message
+"""
+
+import asyncio
+from typing import Awaitable, Callable, List
+
+# Telegram rejects longer text messages
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+DIGEST_MODES = ("chunks", "chat", "run")
+
+
+def fit_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> str:
+    """Trim ``text`` to ``limit`` chars, cutting at a paragraph, line or word break when possible."""
+    text = (text or "").strip()
+    if len(text) <= limit:
+        return text
+    head = text[:max(1, limit - 1)]
+    for brk in ("\n\n", "\n", " "):
+        cut = head.rfind(brk)
+        # Do not throw away more than a quarter of the message for a nicer break
+        if cut >= limit * 3 // 4:
+            head = head[:cut]
+            break
+    return head.rstrip() + "…"
+
+
+async def reduce_tree(items: List[str], reduce_fn: Callable[[List[str]], Awaitable[str]],
+                      fanin: int = 4) -> str:
+    """Merge ``items`` level by level, ``fanin`` at a time, until one text is left.
+
+    Groups are always cut from the start of the list, so appending an item only changes the last
+    group of each level: if ``reduce_fn`` reuses stored results by content, the other reduce calls
+    are hits and a new chunk costs about one call per level. A lone item in a group is passed up unchanged.
+    Calls of one level run concurrently.
+    """
+    level = [t for t in (s.strip() for s in items if s) if t]
+    if not level:
+        return ""
+    fanin = max(2, int(fanin))
+    while len(level) > 1:
+        groups = [level[i:i + fanin] for i in range(0, len(level), fanin)]
+        merged = await asyncio.gather(*(
+            reduce_fn(group) if len(group) > 1 else _passthrough(group[0]) for group in groups
+        ))
+        level = [m.strip() for m in merged]
+    return level[0]
+
+
+async def _passthrough(text: str) -> str:
+    return text
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Readers for history files produced by the MCP server's tg.export_history tool
+"""
+
+import gzip
+import json
+import sqlite3
+from typing import Any, Dict, Iterator
+
+
+def iter_exported_messages(path: str, min_id: int = 0) -> Iterator[Dict[str, Any]]:
+    """Yield exported messages (same shape as tg.fetch_history) with id > min_id, oldest first.
+
+    Supports ``.jsonl.gz`` / ``.jsonl`` and ``.sqlite`` exports. A JSONL export resumed after a crash
+    between a batch write and its cursor save holds that batch twice; each id is yielded once.
+    """
+    if path.endswith(".sqlite") or path.endswith(".db"):
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute(
+                "SELECT id, date, from_id, sender, text FROM messages WHERE id > ? ORDER BY id", (int(min_id),)
+            )
+            for _id, date, from_id, sender, text in rows:
+                yield {"id": _id, "text": text or "", "date": date, "from": {"id": from_id, "display": sender}}
+        finally:
+            conn.close()
+        return
+
+    opener = gzip.open if path.endswith(".gz") else open
+    seen = set()
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    m = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a truncated last line; skip it
+                    continue
+                try:
+                    mid = int(m.get("id") or 0)
+                except (TypeError, ValueError):
+                    continue
+                if mid <= int(min_id) or mid in seen:
+                    continue
+                seen.add(mid)
+                yield m
+        except EOFError:
+            # Truncated last gzip member (export interrupted mid-flush): keep what was read
+            return
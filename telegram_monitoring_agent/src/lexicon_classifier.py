@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Local sentiment/intent classifier for trivial messages (reactions, links, questions, commands)
+"""
+
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+# Russian words are matched by stem (the longest known prefix of at least 4 letters), so all word
+# forms hit. English words and the short Russian ones must match a whole word: English prefixes hit
+# unrelated words ("good" -> "goodbye")
+_POSITIVE_STEMS = (
+    "хорош", "отличн", "класс", "круто", "крут", "супер", "спасиб", "благодар", "нравит", "понрав", "люблю",
+    "удобн", "полезн", "огонь", "шикарн", "прекрасн", "молодц", "восторг", "впечатл", "замечат", "интересн",
+    "годн", "лучш", "кайф", "мощн",
+)
+_POSITIVE_WORDS = (
+    "рад", "рада", "топ", "ура", "awesome", "excellent", "amazing", "perfect", "useful", "helpful", "impressive",
+    "great", "thank", "thanks", "love", "loved", "nice", "cool", "glad", "best", "good", "brilliant", "fantastic",
+    "wonderful", "wow", "yay", "thx", "kudos",
+)
+_NEGATIVE_STEMS = (
+    "плох", "ужас", "отстой", "сломал", "сломан", "ошибк", "бесит", "разочар", "жаль", "проблем", "кошмар",
+    "медлен", "хуже", "худш", "глюч", "глюк", "падает", "тормоз", "обман", "грустн", "печал",
+    "недовол", "отврат", "позор",
+)
+_NEGATIVE_WORDS = (
+    "баг", "бред", "фу", "bad", "bug", "bugs", "meh", "ugh", "terrible", "awful", "broken", "error", "errors",
+    "fail", "fails", "failed", "hate", "worse", "worst", "slow", "sucks", "disappointed", "disappointing",
+    "annoying", "problem", "problems", "issue", "issues", "crash", "crashes", "crashed", "useless", "wrong", "sad",
+)
+# "без проблем" is agreement, not a complaint
+_NEGATIONS = {"не", "нет", "ни", "без", "not", "no", "never", "dont", "doesnt", "isnt", "cant", "without"}
+
+_POSITIVE_EMOJI = "👍❤🔥👏😍🥰😊🙂😀😃😄😁🎉💯🚀✅🙏💪🤝😎⭐"
+_NEGATIVE_EMOJI = "👎😡😠🤬😢😭😞😔💩🤮❌😤🙄"
+
+_WORD = re.compile(r"[^\W\d_]+", re.U)
+_URL = re.compile(r"(?:https?://|www\.|t\.me/)\S+", re.I)
+_MENTION = re.compile(r"[@#]\w+")
+_COMMAND = re.compile(r"^/[A-Za-z]\w*")
+# Words that open a question; without a "?" they also open exclamations and statements
+# ("Как же круто!", "Как я и говорил, ..."), so alone they are a weak signal
+_QUESTION_WORD = re.compile(
+    r"^(?:что|как|почему|зачем|когда|где|куда|откуда|кто|какой|какая|какие|каким|сколько|"
+    r"what|how|why|when|where|who|which)\b",
+    re.I,
+)
+_NOT_WORKING = re.compile(
+    r"\bне\s+(?:работает|работают|запускается|открывается|грузится|помогает)\b|"
+    r"\b(?:doesn'?t|does not|don'?t|do not|not)\s+work", re.I
+)
+_REQUEST = re.compile(r"\b(?:пожалуйста|подскажите|подскажи|помогите|помоги|please|pls|plz|help)\b", re.I)
+
+MIN_STEM = 4
+
+
+class LexiconResult(NamedTuple):
+    sentiment: str
+    intent: str
+    confidence: float
+
+
+class LexiconClassifier:
+    """Scores messages with a Russian/English sentiment lexicon and question/command/request rules.
+
+    ``classify`` returns a label pair with a confidence; callers treat results of at least
+    ``threshold`` as final and send the rest to the LLM. Only an explicit signal (a lexicon hit,
+    a "?", a /command, a link-only message) reaches the default threshold; a guess without one
+    (neutral statement) stays below it. Long messages score lower: the lexicon cannot see nuance.
+    """
+
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = float(threshold)
+        self._words: Dict[str, int] = {}
+        self._stems: Dict[str, int] = {}
+        for stems, words, polarity in ((_POSITIVE_STEMS, _POSITIVE_WORDS, 1), (_NEGATIVE_STEMS, _NEGATIVE_WORDS, -1)):
+            self._stems.update((stem, polarity) for stem in stems if len(stem) >= MIN_STEM)
+            self._words.update((word, polarity) for word in words)
+            self._words.update((stem, polarity) for stem in stems if len(stem) < MIN_STEM)
+
+    def confident(self, result: LexiconResult) -> bool:
+        return result.confidence >= self.threshold
+
+    def _polarity(self, word: str) -> int:
+        polarity = self._words.get(word)
+        if polarity is not None:
+            return polarity
+        if word.isascii():
+            return 0
+        for n in range(len(word), MIN_STEM - 1, -1):
+            polarity = self._stems.get(word[:n])
+            if polarity is not None:
+                return polarity
+        return 0
+
+    @staticmethod
+    def _prepare(text: Optional[str]) -> tuple:
+        text = (text or "").strip()
+        rest = _MENTION.sub(" ", _URL.sub(" ", text)).strip()
+        return text, rest, _WORD.findall(rest.lower().replace("'", ""))
+
+    @staticmethod
+    def _score(rest: str, words: List[str], polarity: Dict[str, int]) -> tuple:
+        pos = neg = 0
+        negate = False
+        for word in words:
+            if word in _NEGATIONS:
+                negate = True
+                continue
+            value = -polarity[word] if negate else polarity[word]
+            negate = False
+            if value > 0:
+                pos += 1
+            elif value < 0:
+                neg += 1
+        neg += len(_NOT_WORKING.findall(rest))
+        pos += sum(rest.count(e) for e in _POSITIVE_EMOJI)
+        neg += sum(rest.count(e) for e in _NEGATIVE_EMOJI)
+        return pos, neg
+
+    @staticmethod
+    def _decide(text: str, rest: str, n_words: int, pos: int, neg: int) -> LexiconResult:
+        if not text:
+            return LexiconResult("neutral", "unknown", 1.0)
+        if not rest or (n_words == 0 and not (pos or neg)):
+            # Link, mention or punctuation only: a share without an opinion
+            return LexiconResult("neutral", "statement", 0.95)
+
+        if _COMMAND.match(rest):
+            intent, intent_conf = "command", 0.95
+        elif rest.endswith("?"):
+            intent, intent_conf = "question", 0.9
+        elif _QUESTION_WORD.match(rest) and not rest.endswith("!"):
+            intent, intent_conf = "question", 0.7
+        elif _REQUEST.search(rest):
+            intent, intent_conf = "request", 0.85
+        elif pos and not neg and n_words <= 6:
+            intent, intent_conf = "praise", 0.85
+        elif neg and not pos and n_words <= 6:
+            intent, intent_conf = "complaint", 0.8
+        else:
+            intent, intent_conf = "statement", 0.7
+
+        if pos and not neg:
+            sentiment, sentiment_conf = "positive", 0.9
+        elif neg and not pos:
+            sentiment, sentiment_conf = "negative", 0.9
+        elif pos and neg:
+            sentiment, sentiment_conf = ("positive" if pos > neg else "negative" if neg > pos else "neutral"), 0.5
+        elif intent in ("command", "question", "request"):
+            # No opinion words in a question/command/request: neutral is the expected case
+            sentiment, sentiment_conf = "neutral", 0.85
+        else:
+            sentiment, sentiment_conf = "neutral", 0.7
+
+        # Longer texts carry nuance (sarcasm, several topics) the lexicon cannot see
+        if n_words <= 6:
+            length_factor = 1.0
+        elif n_words <= 15:
+            length_factor = 0.85
+        else:
+            length_factor = 0.6
+        return LexiconResult(sentiment, intent, round(min(sentiment_conf, intent_conf) * length_factor, 2))
+
+    def classify(self, text: Optional[str]) -> LexiconResult:
+        return self.classify_batch([text])[0]
+
+    def classify_batch(self, texts: List[Optional[str]]) -> List[LexiconResult]:
+        """Classify a page of messages.
+
+        All messages are tokenized first and every distinct word of the page is looked up in the
+        lexicon once; the messages are then scored against that table.
+        """
+        prepared = [self._prepare(text) for text in texts]
+        polarity = {word: self._polarity(word) for _, _, words in prepared for word in set(words)}
+        return [
+            self._decide(text, rest, len(words), *self._score(rest, words, polarity))
+            for text, rest, words in prepared
+        ]
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of LLM completions on SQLite (TTL + LRU eviction, size cap)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS completions ("
+    "key TEXT PRIMARY KEY, provider TEXT, model TEXT, response TEXT NOT NULL, size INTEGER NOT NULL, "
+    "created REAL NOT NULL, accessed REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)",
+)
+
+
+def make_cache_key(provider: str, model: Optional[str], messages: List[Dict[str, Any]], max_tokens: int,
+                   temperature: float) -> str:
+    """SHA-256 of the request; message contents are stripped so re-sent/forwarded texts match."""
+    payload = {
+        "provider": (provider or "").lower(),
+        "model": model or "",
+        "messages": [{"role": m.get("role"), "content": str(m.get("content") or "").strip()} for m in messages],
+        "max_tokens": int(max_tokens),
+        "temperature": round(float(temperature), 3),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LlmCache:
+    """Completions keyed by ``make_cache_key``.
+
+    Entries older than ``ttl_sec`` are misses (0 = no expiry). After each ``put`` the least
+    recently used entries are evicted until the cache holds at most ``max_entries`` rows and
+    ``max_bytes`` of response text. Calls with ``temperature > max_temperature`` are not
+    deterministic enough to reuse and bypass the cache. ``aget``/``aput`` run in the default executor.
+    """
+
+    def __init__(self, path: str = "logs/llm_cache.sqlite", ttl_sec: float = 7 * 24 * 3600,
+                 max_entries: int = 5000, max_bytes: int = 50 * 1024 * 1024, max_temperature: float = 0.5):
+        self.path = path
+        self.ttl_sec = float(ttl_sec or 0)
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.max_temperature = float(max_temperature)
+        self.logger = logging.getLogger('LlmCache')
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "evicted": 0}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg: Dict[str, Any]) -> "LlmCache":
+        """Build from the ``llm_cache`` config section (ttl_hours, max_entries, max_mb, max_temperature)."""
+        return cls(
+            path=cfg.get('path', 'logs/llm_cache.sqlite'),
+            ttl_sec=float(cfg.get('ttl_hours', 168) or 0) * 3600,
+            max_entries=int(cfg.get('max_entries', 5000)),
+            max_bytes=int(float(cfg.get('max_mb', 50)) * 1024 * 1024),
+            max_temperature=float(cfg.get('max_temperature', 0.5)),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._conn is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                for stmt in _SCHEMA:
+                    conn.execute(stmt)
+                conn.commit()
+                self._conn = conn
+            return self._conn
+
+    def cacheable(self, temperature: float) -> bool:
+        return float(temperature) <= self.max_temperature
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._connect()
+        now = time.time()
+        with self._lock, conn:
+            row = conn.execute("SELECT response, created FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_sec and now - row[1] > self.ttl_sec:
+                conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.stats["evicted"] += 1
+                row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+            self.stats["hits"] += 1
+            return row[0]
+
+    def put(self, key: str, response: str, provider: str = "", model: Optional[str] = None) -> None:
+        if not response:
+            return
+        conn = self._connect()
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, provider, model, response, size, created, accessed) "
+                "VALUES (?,?,?,?,?,?,?)",
+                (key, provider, model or "", response, size, now, now),
+            )
+            self.stats["stored"] += 1
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        evicted = 0
+        if self.ttl_sec:
+            evicted += conn.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl_sec,)).rowcount
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        if count > self.max_entries or total > self.max_bytes:
+            # Walk from the least recently used entry until both caps hold
+            drop = []
+            for key, size in conn.execute("SELECT key, size FROM completions ORDER BY accessed ASC, created ASC"):
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                drop.append((key,))
+                count -= 1
+                total -= size
+            conn.executemany("DELETE FROM completions WHERE key = ?", drop)
+            evicted += len(drop)
+        self.stats["evicted"] += evicted
+
+    async def aget(self, key: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get, key)
+
+    async def aput(self, key: str, response: str, provider: str = "", model: Optional[str] = None) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.put, key, response, provider, model)
+
+    def summary(self) -> str:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        ratio = self.stats["hits"] / lookups if lookups else 0.0
+        return ("llm_cache hits={hits} misses={misses} bypassed={bypassed} stored={stored} evicted={evicted}"
+                .format(**self.stats) + f" hit_ratio={ratio:.2f}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Resilient LLM completions: retries with jittered backoff, Retry-After, per-provider circuit
+breakers, provider failover and optional hedged requests
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from .llm_usecase import LlmHttpError, LlmUseCase
+
+# (provider name, use case, model) in order of preference
+Provider = Tuple[str, LlmUseCase, Optional[str]]
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, LlmHttpError):
+        return error.retryable
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError))
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and lets one probe call through
+    after ``reset_timeout`` seconds (half-open); a success closes it again.
+
+    ``admit`` hands the probe out as a token; only the call holding it may release it with
+    ``end_probe``, so other calls still in flight cannot let a second probe through.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.open_for = self.reset_timeout
+        self._probe: Optional[int] = None
+        self._probe_seq = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.open_for:
+            return "half_open"
+        return "open"
+
+    def admit(self) -> Optional[int]:
+        """Admit a call: 0 while closed, a probe token for the one half-open probe, None if refused."""
+        state = self.state
+        if state == "closed":
+            return 0
+        if state == "half_open" and self._probe is None:
+            self._probe_seq += 1
+            self._probe = self._probe_seq
+            return self._probe
+        return None
+
+    def allow(self) -> bool:
+        return self.admit() is not None
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probe is not None or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def end_probe(self, token: int) -> None:
+        """Free the half-open probe slot held by ``token`` after an attempt that neither succeeded
+        nor counted as a failure (non-retryable error, cancellation), so the next call can probe.
+        Tokens of an earlier probe (the breaker tripped or closed since) are ignored."""
+        if token and self._probe == token:
+            self._probe = None
+
+    def trip(self, seconds: Optional[float] = None) -> None:
+        """Open the breaker now (for ``seconds``, e.g. a long Retry-After, or ``reset_timeout``)."""
+        self.opened_at = time.monotonic()
+        self.open_for = max(self.reset_timeout, float(seconds or 0))
+        self._probe = None
+
+
+class ResilientLlm:
+    """Completion across an ordered provider list.
+
+    Each provider gets ``retries`` extra attempts on retryable errors (429, 5xx, timeouts,
+    connection errors) with exponential backoff and full jitter; a Retry-After header is honoured,
+    and one longer than ``backoff_max_sec`` fails over right away. Other errors fail over at once.
+    With ``hedge`` enabled, a call still running after ``hedge_after_sec`` (or the provider's p95
+    latency once ``hedge_min_samples`` calls are recorded) gets a second request to the next
+    available provider; the first answer wins. Per-provider counters are kept in ``metrics``.
+    """
+
+    def __init__(self, retries: int = 2, backoff_base_sec: float = 1.0, backoff_max_sec: float = 20.0,
+                 attempt_timeout_sec: float = 90.0, breaker_failures: int = 5, breaker_reset_sec: float = 60.0,
+                 hedge: bool = False, hedge_after_sec: float = 0.0, hedge_min_samples: int = 20,
+                 logger: Optional[logging.Logger] = None):
+        self.retries = max(0, int(retries))
+        self.backoff_base_sec = float(backoff_base_sec)
+        self.backoff_max_sec = float(backoff_max_sec)
+        self.attempt_timeout_sec = float(attempt_timeout_sec or 0)
+        self.breaker_failures = int(breaker_failures)
+        self.breaker_reset_sec = float(breaker_reset_sec)
+        self.hedge = bool(hedge)
+        self.hedge_after_sec = float(hedge_after_sec or 0)
+        self.hedge_min_samples = max(1, int(hedge_min_samples))
+        self.logger = logger or logging.getLogger('ResilientLlm')
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._sleep = asyncio.sleep
+
+    @classmethod
+    def from_config(cls, cfg: Dict[str, Any], logger: Optional[logging.Logger] = None) -> "ResilientLlm":
+        """Build from the ``llm_resilience`` config section."""
+        return cls(
+            retries=cfg.get('retries', 2),
+            backoff_base_sec=cfg.get('backoff_base_sec', 1.0),
+            backoff_max_sec=cfg.get('backoff_max_sec', 20.0),
+            attempt_timeout_sec=cfg.get('attempt_timeout_sec', 90.0),
+            breaker_failures=cfg.get('breaker_failures', 5),
+            breaker_reset_sec=cfg.get('breaker_reset_sec', 60.0),
+            hedge=cfg.get('hedge', False),
+            hedge_after_sec=cfg.get('hedge_after_sec', 0.0),
+            hedge_min_samples=cfg.get('hedge_min_samples', 20),
+            logger=logger,
+        )
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        br = self.breakers.get(name)
+        if br is None:
+            br = self.breakers[name] = CircuitBreaker(self.breaker_failures, self.breaker_reset_sec)
+        return br
+
+    def _stat(self, name: str) -> Dict[str, Any]:
+        st = self.metrics.get(name)
+        if st is None:
+            st = self.metrics[name] = {"calls": 0, "served": 0, "failures": 0, "retries": 0,
+                                       "failovers": 0, "hedges": 0, "hedge_wins": 0}
+        return st
+
+    def latency_percentile(self, name: str, pct: float) -> Optional[float]:
+        samples = sorted(self._latencies.get(name) or ())
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))]
+
+    def _hedge_delay(self, name: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        if self.hedge_after_sec > 0:
+            return self.hedge_after_sec
+        if len(self._latencies.get(name) or ()) < self.hedge_min_samples:
+            return None
+        return self.latency_percentile(name, 95)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.backoff_max_sec, self.backoff_base_sec * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def _attempt(self, provider: Provider, messages: List[Dict[str, str]], kwargs: Dict[str, Any],
+                       probe: int = 0) -> str:
+        """One request; ``probe`` is the breaker's probe token when this attempt is the half-open probe."""
+        name, usecase, model = provider
+        st = self._stat(name)
+        st["calls"] += 1
+        started = time.monotonic()
+        call = usecase.complete(messages, model=model, **kwargs)
+        try:
+            if self.attempt_timeout_sec > 0:
+                text = await asyncio.wait_for(call, self.attempt_timeout_sec)
+            else:
+                text = await call
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            st["failures"] += 1
+            if is_retryable(e):
+                self.breaker(name).record_failure()
+            raise
+        finally:
+            # A probe that lost a hedge, was cancelled or hit a non-retryable error must not keep
+            # the half-open breaker waiting for it forever
+            if probe:
+                self.breaker(name).end_probe(probe)
+        self.breaker(name).record_success()
+        latencies = self._latencies.setdefault(name, deque(maxlen=200))
+        latencies.append(time.monotonic() - started)
+        return text
+
+    async def _hedged(self, primary: Provider, backup: Optional[Provider], messages, kwargs,
+                      probe: int = 0) -> Tuple[str, str]:
+        delay = self._hedge_delay(primary[0])
+        first = asyncio.ensure_future(self._attempt(primary, messages, kwargs, probe))
+        if delay is None or backup is None:
+            return await first, primary[0]
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result(), primary[0]
+        self._stat(primary[0])["hedges"] += 1
+        second = asyncio.ensure_future(self._attempt(backup, messages, kwargs))
+        owners = {first: primary[0], second: backup[0]}
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._stat(backup[0])["hedge_wins"] += 1
+                        return task.result(), owners[task]
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def complete(self, providers: List[Provider], messages: List[Dict[str, str]],
+                       **kwargs) -> Tuple[str, str]:
+        """Return (text, name of the provider that served it); raises the last error if all fail."""
+        if not providers:
+            raise RuntimeError("No LLM provider configured")
+        last_error: Optional[BaseException] = None
+        for idx, provider in enumerate(providers):
+            name = provider[0]
+            probe = self.breaker(name).admit()
+            if probe is None:
+                self.logger.debug(f"LLM provider {name} skipped: circuit breaker open")
+                continue
+            if last_error is not None:
+                self._stat(name)["failovers"] += 1
+                self.logger.warning(f"LLM failover to {name} after: {last_error}")
+            backup = next((p for p in providers[idx + 1:] if self.breaker(p[0]).state == "closed"), None)
+            for attempt in range(self.retries + 1):
+                try:
+                    text, served_by = await self._hedged(provider, backup, messages, kwargs, probe)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable(e):
+                        break
+                    retry_after = getattr(e, 'retry_after', None)
+                    if retry_after is not None and retry_after > self.backoff_max_sec:
+                        # Rate limited for long: stop sending to this provider until the window ends
+                        self.breaker(name).trip(retry_after)
+                        break
+                    if attempt >= self.retries:
+                        break
+                    probe = self.breaker(name).admit()
+                    if probe is None:
+                        break
+                    self._stat(name)["retries"] += 1
+                    try:
+                        await self._sleep(self.backoff(attempt, retry_after))
+                    except asyncio.CancelledError:
+                        self.breaker(name).end_probe(probe)
+                        raise
+                    continue
+                self._stat(served_by)["served"] += 1
+                return text, served_by
+        raise last_error or RuntimeError("All LLM providers are unavailable (circuit breakers open)")
+
+    def summary_lines(self) -> List[str]:
+        lines = []
+        for name, st in self.metrics.items():
+            p50, p95 = self.latency_percentile(name, 50), self.latency_percentile(name, 95)
+            lat = f" p50={p50:.2f}s p95={p95:.2f}s" if p50 is not None else ""
+            lines.append(
+                f"llm provider={name} breaker={self.breaker(name).state} served={st['served']} calls={st['calls']} "
+                f"failures={st['failures']} retries={st['retries']} failovers={st['failovers']} "
+                f"hedges={st['hedges']} hedge_wins={st['hedge_wins']}{lat}"
+            )
+        return lines
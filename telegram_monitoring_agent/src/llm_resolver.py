@@ -1,19 +1,96 @@
 #!/usr/bin/env python3
 """
 LLM Resolver - selects appropriate LLM implementation
+
+Use cases are created once per process by LlmRegistry and share one keep-alive
+aiohttp session per event loop instead of opening a connection pool per call.
 """
 
+import asyncio
+import weakref
+from typing import Dict, Optional
+
+import aiohttp
+
 from .llm_usecase import LlmUseCase
 from .deepseek_usecase import DeepSeekUseCase
 from .yandexgpt_usecase import YandexGptUseCase
 
+_PROVIDER_ALIASES = {"deepseek": "deepseek", "yandex": "yandex", "yandexgpt": "yandex"}
+
+
+class LlmRegistry:
+    """Process-wide registry of LLM use cases and their pooled HTTP sessions.
+
+    aiohttp sessions are bound to the event loop that created them, and the UI runs agent
+    calls on short-lived loops in worker threads, so one session is kept per running loop.
+    ``aclose`` closes the session of the current loop; ``close`` is for process shutdown.
+    """
+
+    def __init__(self, limit: int = 32, limit_per_host: int = 8, keepalive_timeout: float = 60.0,
+                 timeout_sec: float = 120.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout_sec = timeout_sec
+        self._usecases: Dict[str, LlmUseCase] = {}
+        self._sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = \
+            weakref.WeakKeyDictionary()
+
+    def session(self) -> aiohttp.ClientSession:
+        """Shared session for the running event loop (created on first use)."""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout_sec)
+            )
+            self._sessions[loop] = session
+        return session
+
+    def get(self, provider: str = "deepseek") -> LlmUseCase:
+        name = _PROVIDER_ALIASES.get((provider or "deepseek").lower(), "deepseek")
+        usecase = self._usecases.get(name)
+        if usecase is None:
+            cls = YandexGptUseCase if name == "yandex" else DeepSeekUseCase
+            usecase = cls(session_factory=self.session)
+            self._usecases[name] = usecase
+        return usecase
+
+    async def aclose(self) -> None:
+        """Close the session owned by the running event loop."""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.pop(loop, None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    def close(self) -> None:
+        """Close all sessions at shutdown (loops that are gone or running elsewhere are skipped)."""
+        for loop, session in list(self._sessions.items()):
+            if session.closed:
+                continue
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(session.close())
+        self._sessions.clear()
+        self._usecases.clear()
+
+
+_registry: Optional[LlmRegistry] = None
+
+
+def get_llm_registry() -> LlmRegistry:
+    global _registry
+    if _registry is None:
+        _registry = LlmRegistry()
+    return _registry
+
 
 def resolve_llm_usecase(llm_provider: str = "deepseek") -> LlmUseCase:
-    """Resolve LLM use case based on provider name"""
-    if llm_provider.lower() == "deepseek":
-        return DeepSeekUseCase()
-    elif llm_provider.lower() == "yandexgpt":
-        return YandexGptUseCase()
-    else:
-        # Default to DeepSeek
-        return DeepSeekUseCase()
+    """Resolve LLM use case based on provider name (shared instance from the registry)"""
+    return get_llm_registry().get(llm_provider)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+LLM call scheduler: per-provider RPM/TPM budgets, priority classes and a fair queue across chats
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from .chunking import estimate_tokens
+
+# Lower value is served first
+PRIORITIES = {"interactive": 0, "summary": 1, "analytics": 2}
+
+_WINDOW_SEC = 60.0
+
+
+def estimate_request_tokens(messages: List[Dict[str, Any]], max_tokens: int = 0) -> int:
+    """Token count of a request: prompt estimate plus per-message overhead and the completion
+    budget (TPM limits count prompt and completion tokens)."""
+    prompt = sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+    return prompt + 4 * len(messages) + max(0, int(max_tokens))
+
+
+class RateWindow:
+    """Sliding one-minute window of requests and tokens for one provider (thread-safe, so one
+    window is shared by the schedulers of all event loops)."""
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.rpm = max(0, int(rpm or 0))
+        self.tpm = max(0, int(tpm or 0))
+        self._events: Deque[Tuple[float, int]] = deque()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        while self._events and now - self._events[0][0] >= _WINDOW_SEC:
+            self._tokens -= self._events.popleft()[1]
+
+    def reserve(self, tokens: int, now: Optional[float] = None) -> float:
+        """Record the request and return 0 if it fits the budgets, else the seconds to wait."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._trim(now)
+            wait = 0.0
+            if self.rpm and len(self._events) >= self.rpm:
+                wait = self._events[len(self._events) - self.rpm][0] + _WINDOW_SEC - now
+            # A request larger than the whole budget still runs once the window is empty
+            if self.tpm and self._events and self._tokens + tokens > self.tpm:
+                freed, release_at = self._tokens, now
+                for ts, tok in self._events:
+                    freed -= tok
+                    release_at = ts + _WINDOW_SEC
+                    if freed + tokens <= self.tpm:
+                        break
+                wait = max(wait, release_at - now)
+            if wait > 0:
+                return wait
+            self._events.append((now, tokens))
+            self._tokens += tokens
+            return 0.0
+
+    def refund(self, at: float, tokens: int) -> None:
+        """Take back the request recorded by ``reserve`` at time ``at`` (if still in the window)."""
+        with self._lock:
+            try:
+                self._events.remove((at, tokens))
+            except ValueError:
+                return
+            self._tokens -= tokens
+
+    def record(self, tokens: int, now: Optional[float] = None) -> None:
+        """Record a request that has already been made, whatever the budgets say."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._trim(now)
+            self._events.append((now, tokens))
+            self._tokens += tokens
+
+    def usage(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """(requests, tokens) in the last minute."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._trim(now)
+            return len(self._events), self._tokens
+
+
+class LlmScheduler:
+    """Admits LLM calls of one event loop.
+
+    Waiting calls are ordered by priority class; inside a class, chats (``key``) take turns
+    round-robin, so one chat with many chunks cannot starve the others. A call starts when fewer
+    than ``max_concurrency`` calls are running and its provider's RPM/TPM window has room; while a
+    provider is out of budget, calls for other providers are admitted past its waiters.
+    """
+
+    def __init__(self, windows: Dict[str, RateWindow], max_concurrency: int = 4,
+                 logger: Optional[logging.Logger] = None):
+        self.windows = windows
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.logger = logger or logging.getLogger('LlmScheduler')
+        self.running = 0
+        # priority -> chat key -> FIFO of waiters; OrderedDict order is the round-robin order
+        self._queues: Dict[int, "OrderedDict[Any, Deque[Dict[str, Any]]]"] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._started = time.monotonic()
+        self.stats: Dict[str, Dict[str, Any]] = {
+            name: {"calls": 0, "tokens": 0, "wait_total_sec": 0.0, "wait_max_sec": 0.0}
+            for name in PRIORITIES
+        }
+
+    @asynccontextmanager
+    async def slot(self, provider: str, tokens: int, priority: str = "summary",
+                   key: Any = None) -> AsyncIterator[Dict[str, Any]]:
+        """Hold a call slot; yields the grant to pass to ``charge_to`` if another provider serves the call."""
+        grant = await self.acquire(provider, tokens, priority, key)
+        try:
+            yield grant
+        finally:
+            self.release()
+
+    async def acquire(self, provider: str, tokens: int, priority: str = "summary",
+                      key: Any = None) -> Dict[str, Any]:
+        prio_name = priority if priority in PRIORITIES else "summary"
+        waiter = {
+            "provider": provider,
+            "tokens": int(tokens),
+            "priority": prio_name,
+            "future": asyncio.get_running_loop().create_future(),
+            "queued": time.monotonic(),
+            "reserved_at": None,
+        }
+        self._queues.setdefault(PRIORITIES[prio_name], OrderedDict()).setdefault(key, deque()).append(waiter)
+        self._pump()
+        try:
+            await waiter["future"]
+        except asyncio.CancelledError:
+            if waiter["future"].done() and not waiter["future"].cancelled():
+                # Admitted just before the cancellation: give the slot back
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        waited = time.monotonic() - waiter["queued"]
+        st = self.stats[prio_name]
+        st["calls"] += 1
+        st["tokens"] += waiter["tokens"]
+        st["wait_total_sec"] += waited
+        st["wait_max_sec"] = max(st["wait_max_sec"], waited)
+        return waiter
+
+    def charge_to(self, grant: Dict[str, Any], provider: str) -> None:
+        """Move the budget charge of an admitted call to the provider that served it (failover)."""
+        if provider == grant["provider"]:
+            return
+        old, new = self.windows.get(grant["provider"]), self.windows.get(provider)
+        if old is not None and grant["reserved_at"] is not None:
+            old.refund(grant["reserved_at"], grant["tokens"])
+        if new is not None:
+            new.record(grant["tokens"])
+        grant["provider"] = provider
+        grant["reserved_at"] = None
+
+    def release(self) -> None:
+        self.running = max(0, self.running - 1)
+        self._pump()
+
+    def _discard(self, waiter: Dict[str, Any]) -> None:
+        for chats in self._queues.values():
+            for key, q in list(chats.items()):
+                if waiter in q:
+                    q.remove(waiter)
+                    if not q:
+                        del chats[key]
+                    return
+
+    def _next_ready(self, blocked: Dict[str, float]) -> Optional[Tuple[OrderedDict, Any, Dict[str, Any]]]:
+        """First waiter, in priority and round-robin order, whose provider window has room; the
+        window is charged for it. Providers found out of budget go to ``blocked`` (seconds to wait)
+        and their waiters are passed over, so they keep their own order."""
+        for prio in sorted(self._queues):
+            chats = self._queues[prio]
+            for key in list(chats):
+                q = chats[key]
+                while q and q[0]["future"].done():
+                    # Cancelled while queued
+                    q.popleft()
+                if not q:
+                    del chats[key]
+                    continue
+                waiter = q[0]
+                provider = waiter["provider"]
+                if provider in blocked:
+                    continue
+                window = self.windows.get(provider)
+                if window is not None:
+                    now = time.monotonic()
+                    wait = window.reserve(waiter["tokens"], now)
+                    if wait > 0:
+                        blocked[provider] = wait
+                        continue
+                    waiter["reserved_at"] = now
+                return chats, key, waiter
+        return None
+
+    def _pump(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        blocked: Dict[str, float] = {}
+        while self.running < self.max_concurrency:
+            picked = self._next_ready(blocked)
+            if picked is None:
+                break
+            chats, key, waiter = picked
+            q = chats[key]
+            q.popleft()
+            # Round-robin: this chat goes to the back of its priority class
+            del chats[key]
+            if q:
+                chats[key] = q
+            self.running += 1
+            waiter["future"].set_result(None)
+        if blocked:
+            # Budget exhausted: retry when a window frees up (other loops may free it earlier)
+            self._timer = asyncio.get_running_loop().call_later(min(min(blocked.values()), 1.0), self._pump)
+
+    def summary_lines(self) -> List[str]:
+        elapsed = max(1e-6, time.monotonic() - self._started)
+        lines = []
+        for name, st in self.stats.items():
+            if not st["calls"]:
+                continue
+            lines.append(
+                f"llm_scheduler class={name} calls={st['calls']} rate={st['calls'] * 60 / elapsed:.1f}/min "
+                f"tokens={st['tokens']} avg_wait={st['wait_total_sec'] / st['calls']:.2f}s "
+                f"max_wait={st['wait_max_sec']:.2f}s"
+            )
+        for provider, window in self.windows.items():
+            requests, tokens = window.usage()
+            lines.append(f"llm_budget provider={provider} last_min_requests={requests}/{window.rpm or '∞'} "
+                         f"last_min_tokens={tokens}/{window.tpm or '∞'}")
+        return lines
@@ -4,13 +4,68 @@ LLM Use Case Interface
 """
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional
+
+import aiohttp
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class LlmHttpError(Exception):
+    """Non-200 answer from an LLM API; ``retry_after`` comes from the Retry-After header"""
+
+    def __init__(self, message: str, status: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in (408, 409, 429) or self.status >= 500
 
 
 class LlmUseCase(ABC):
     """Abstract base class for LLM implementations"""
 
+    def __init__(self, session_factory: Optional[Callable[[], aiohttp.ClientSession]] = None):
+        # Returns a shared keep-alive session (see LlmRegistry); without it each call opens its own
+        self._session_factory = session_factory
+
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[aiohttp.ClientSession]:
+        if self._session_factory is not None:
+            yield self._session_factory()
+            return
+        async with aiohttp.ClientSession() as session:
+            yield session
+
     @abstractmethod
     async def complete(self, messages: List[Dict[str, str]], **kwargs) -> str:
         """Complete the conversation with LLM"""
         pass
+
+    async def complete_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """Yield the completion in text pieces as they arrive.
+
+        Closing the iterator early (``aclose``/``break``) drops the HTTP response and stops the
+        generation. Providers without streaming support yield the whole ``complete`` result once.
+        """
+        yield await self.complete(messages, **kwargs)
@@ -46,6 +46,8 @@ class MCPClient:
         self._start_lock: asyncio.Lock = asyncio.Lock()
         # Persistent receive buffer to store any extra bytes between calls
         self._rx_buffer: bytearray = bytearray()
+        # stdout read still running in the executor after its caller gave up; its bytes go to _rx_buffer
+        self._pending_read: Optional[asyncio.Future] = None
         # WS session/socket
         self._ws_session = None
         self._ws = None
@@ -268,6 +270,8 @@ class MCPClient:
                 except Exception:
                     pass
                 self.process = None
+                self._rx_buffer.clear()
+                self._pending_read = None
 
         # Close WS session/socket if any
         try:
@@ -453,27 +457,29 @@ class MCPClient:
             self.logger.debug(f"WS initialize best-effort failed: {e}")
 
     async def _ws_rpc(self, method: str, params: Dict[str, Any], timeout: float = 20.0) -> Optional[Dict[str, Any]]:
-        await self._ensure_ws()
-        req_id = self.request_id
-        self.request_id += 1
-        payload = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params}
-        await self._ws.send_str(json.dumps(payload))
-        # Wait for matching id
-        while True:
-            msg = await asyncio.wait_for(self._ws.receive(), timeout=timeout)
-            if msg.type == aiohttp.WSMsgType.TEXT:
-                try:
-                    obj = json.loads(msg.data)
-                except Exception:
-                    continue
-                if isinstance(obj, dict) and obj.get("id") == req_id:
-                    if "error" in obj:
-                        # propagate as dict to match stdio behavior
-                        return {"error": obj["error"]}
-                    return obj.get("result")
-            elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
-                break
-        return None
+        # One request in flight at a time: the receive loop below would otherwise drop other callers' replies
+        async with self._io_lock:
+            await self._ensure_ws()
+            req_id = self.request_id
+            self.request_id += 1
+            payload = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params}
+            await self._ws.send_str(json.dumps(payload))
+            # Wait for matching id
+            while True:
+                msg = await asyncio.wait_for(self._ws.receive(), timeout=timeout)
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    try:
+                        obj = json.loads(msg.data)
+                    except Exception:
+                        continue
+                    if isinstance(obj, dict) and obj.get("id") == req_id:
+                        if "error" in obj:
+                            # propagate as dict to match stdio behavior
+                            return {"error": obj["error"]}
+                        return obj.get("result")
+                elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+            return None
 
     async def list_tools_ws(self) -> Optional[List[Dict[str, Any]]]:
         if self.transport not in ("ws", "wss"):
@@ -579,6 +585,55 @@ class MCPClient:
         return uniq
 
 
+    async def _read_frame(self, deadline: float) -> Optional[bytes]:
+        """Read the body of one Content-Length frame from stdout; None on timeout or EOF.
+
+        Bytes stay in ``_rx_buffer`` until a whole frame is there, and a read still running in the
+        executor when the caller gives up is kept in ``_pending_read`` for the next call, so a
+        timeout or cancellation never loses part of a frame.
+        """
+        loop = asyncio.get_running_loop()
+        buf = self._rx_buffer
+        while True:
+            sep = buf.find(b"\r\n\r\n")
+            want = 64
+            if sep >= 0:
+                content_length = 0
+                for line in bytes(buf[:sep]).decode("ascii", errors="ignore").splitlines():
+                    if line.strip().lower().startswith("content-length:"):
+                        try:
+                            content_length = int(line.split(":", 1)[1].strip())
+                        except ValueError:
+                            content_length = 0
+                        break
+                if content_length <= 0:
+                    self.logger.error(f"Invalid Content-Length in headers: {bytes(buf[:sep])!r}")
+                    del buf[:sep + 4]
+                    continue
+                end = sep + 4 + content_length
+                if len(buf) >= end:
+                    body = bytes(buf[sep + 4:end])
+                    del buf[:end]
+                    return body
+                want = end - len(buf)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            if self._pending_read is None:
+                assert self.process and self.process.stdout is not None
+                self._pending_read = loop.run_in_executor(None, self.process.stdout.read, want)
+            fut = self._pending_read
+            try:
+                chunk = await asyncio.wait_for(asyncio.shield(fut), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                if fut.done():
+                    self._pending_read = None
+            if not chunk:
+                return None
+            buf.extend(chunk)
+
     async def _send_and_read(self, request: Dict[str, Any], timeout_sec: float) -> Optional[Dict[str, Any]]:
         """Send a JSON-RPC request over stdio using Content-Length framing and read a single response.
 
@@ -588,7 +643,8 @@ class MCPClient:
         if not self.process:
             return None
         try:
-            # Serialize all writes/reads to avoid interleaved frames
+            # Serialize the whole request/response exchange: concurrent callers must never
+            # interleave frames on stdin or steal each other's responses from stdout
             async with self._io_lock:
                 # If the child process already exited, abort early with diagnostics
                 if self.process and (self.process.poll() is not None):
@@ -599,170 +655,61 @@ class MCPClient:
                     self.logger.error(f"MCP server already exited with code {self.process.poll()}. Stderr: {err_out[:500]}")
                     return None
 
-            # Encode body and build headers (Content-Length only per LSP framing)
-            body = (json.dumps(request)).encode("utf-8")
-            headers = (f"Content-Length: {len(body)}\r\n\r\n").encode("ascii")
-            self.logger.debug(f"Sending request (len={len(body)}): {request}")
-            self.logger.debug(f"Raw message being sent: {repr(headers + body)}")
-            try:
-                assert self.process.stdin is not None
-                combined = headers + body
-                self.process.stdin.write(combined)
-                self.process.stdin.flush()
-                self.logger.debug("Message sent successfully, waiting for response...")
-            except OSError as e:
-                self.logger.error(f"Failed to write to MCP stdin: {e}")
-                return None
+                # Encode body and build headers (Content-Length only per LSP framing)
+                body = (json.dumps(request)).encode("utf-8")
+                headers = (f"Content-Length: {len(body)}\r\n\r\n").encode("ascii")
+                self.logger.debug(f"Sending request (len={len(body)}): {request}")
+                self.logger.debug(f"Raw message being sent: {repr(headers + body)}")
+                try:
+                    assert self.process.stdin is not None
+                    combined = headers + body
+                    self.process.stdin.write(combined)
+                    self.process.stdin.flush()
+                    self.logger.debug("Message sent successfully, waiting for response...")
+                except OSError as e:
+                    self.logger.error(f"Failed to write to MCP stdin: {e}")
+                    return None
 
-            # Helpers to read until delimiter and then fixed-size body with a single overall deadline
-            async def _read_until(delim: bytes, deadline: float) -> Optional[bytes]:
-                loop = asyncio.get_event_loop()
-                # Start with any leftover bytes from previous call
-                buf = bytearray(self._rx_buffer)
-                self._rx_buffer.clear()
+                # Read frames until the one answering this request; a frame with another id is the late
+                # answer to an exchange that timed out or was cancelled, and is dropped
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + max(0.1, float(timeout_sec if timeout_sec else 60.0))
+                self.logger.debug(f"Waiting for response with timeout {timeout_sec}s...")
                 while True:
-                    remaining = max(0.0, deadline - loop.time())
-                    if remaining == 0.0:
-                        # timeout: return what we have for diagnostics
-                        self.logger.debug(f"Header read timeout with partial buffer length={len(buf)}")
-                        return bytes(buf) if buf else None
-                    def _read_some(sz: int = 64):
-                        assert self.process and self.process.stdout is not None
-                        return self.process.stdout.read(sz)
-                    try:
-                        chunk = await asyncio.wait_for(loop.run_in_executor(None, _read_some), timeout=remaining)
-                    except asyncio.TimeoutError:
-                        self.logger.debug("Header read inner timeout while waiting for bytes")
-                        return bytes(buf) if buf else None
-                    if not chunk:
-                        break
-                    buf += chunk
-                    bbuf = bytes(buf)
-                    # Break only when CRLFCRLF delimiter appears (LSP framing)
-                    if delim in bbuf:
-                        break
-                return bytes(buf)
-
-            async def _read_n(n: int, deadline: float) -> Optional[bytes]:
-                loop = asyncio.get_event_loop()
-                remaining_bytes = n
-                chunks: list[bytes] = []
-                while remaining_bytes > 0:
-                    remaining_time = max(0.0, deadline - loop.time())
-                    if remaining_time == 0.0:
+                    body_bytes = await self._read_frame(deadline)
+                    if body_bytes is None:
+                        self.logger.error(f"No response from MCP server (timeout after {timeout_sec}s or EOF)")
                         return None
-                    to_read = remaining_bytes
-                    def _read_size(k: int):
-                        assert self.process and self.process.stdout is not None
-                        return self.process.stdout.read(k)
                     try:
-                        chunk = await asyncio.wait_for(loop.run_in_executor(None, _read_size, to_read), timeout=remaining_time)
-                    except asyncio.TimeoutError:
-                        return None
-                    if not chunk:
+                        response_text = body_bytes.decode("utf-8")
+                        self.logger.debug(f"Raw response body: {repr(response_text)}")
+                        response = json.loads(response_text)
+                    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                        self.logger.error(f"Failed to parse JSON response: {e}")
+                        continue
+                    if isinstance(response, dict) and response.get("id") == request.get("id"):
                         break
-                    chunks.append(chunk)
-                    remaining_bytes -= len(chunk)
-                return b"".join(chunks)
+                    self.logger.debug(f"Discarding stale MCP frame (id={response.get('id') if isinstance(response, dict) else None})")
 
-            # Read headers with overall deadline, honoring any bytes already present in the buffer
-            loop = asyncio.get_event_loop()
-            deadline = loop.time() + max(0.1, float(timeout_sec if timeout_sec else 60.0))
-            self.logger.debug(f"Waiting for headers with timeout {timeout_sec}s...")
-            raw_headers = await _read_until(b"\r\n\r\n", deadline)
-            if not raw_headers:
-                # timeout or empty
-                try:
-                    err_out = self.process.stderr.read().decode("utf-8", errors="ignore") if self.process and self.process.stderr else ""
-                except Exception:
-                    err_out = ""
-                self.logger.error(f"No headers received from MCP server (timeout after {timeout_sec}s). Stderr: {err_out[:500]}")
-                return None
-            self.logger.debug(f"Received headers: {repr(raw_headers)}")
-            try:
-                # Split headers and any leftover body bytes
-                rh = bytes(raw_headers)
-                sep = b"\r\n\r\n"
-                sep_idx = rh.find(sep)
-                used_sep = sep
-                if sep_idx < 0:
-                    self.logger.error(f"Could not find header/body delimiter in: {rh!r}")
+                self.logger.debug(f"Parsed response: {response}")
+                if isinstance(response, dict) and "error" in response:
+                    self.logger.error(f"MCP server error: {response['error']}")
                     return None
-                header_bytes = rh[:sep_idx]
-                leftover_body = rh[sep_idx + len(used_sep):]
-                if leftover_body:
-                    self.logger.debug(f"Leftover body bytes present after headers: {len(leftover_body)} bytes")
-                headers_text = header_bytes.decode("ascii", errors="ignore")
-                content_length = 0
-                # split by either CRLF or LF
-                lines = headers_text.split("\r\n") if "\r\n" in headers_text else headers_text.split("\n")
-                for line in lines:
-                    if line.strip().lower().startswith("content-length:"):
-                        try:
-                            content_length = int(line.split(":", 1)[1].strip())
-                        except Exception:
-                            content_length = 0
-                        break
-                if content_length <= 0:
-                    self.logger.error(f"Invalid Content-Length in headers: {headers_text!r}")
-                    return None
-            except Exception as e:
-                self.logger.error(f"Failed to parse headers: {e}")
-                return None
 
-            # Read body with same overall deadline
-            # If we already have some of the body in leftover_body, consume it first
-            extra_after_body: bytes = b""
-            if 'leftover_body' in locals() and leftover_body:
-                have = bytes(leftover_body)
-                if len(have) >= content_length:
-                    body_bytes = have[:content_length]
-                    extra_after_body = have[content_length:]
-                else:
-                    need = content_length - len(have)
-                    tail = await _read_n(need, deadline)
-                    body_bytes = have + (tail or b"")
-            else:
-                body_bytes = await _read_n(content_length, deadline)
-            if not body_bytes or len(body_bytes) < content_length:
+                result = response.get("result") if isinstance(response, dict) else None
+                # Unwrap MCP content payload if present
                 try:
-                    err_out = self.process.stderr.read().decode("utf-8", errors="ignore") if self.process and self.process.stderr else ""
+                    if isinstance(result, dict) and isinstance(result.get("content"), list) and result["content"]:
+                        first = result["content"][0]
+                        text = first.get("text") if isinstance(first, dict) else None
+                        if isinstance(text, str):
+                            try:
+                                return json.loads(text)
+                            except json.JSONDecodeError:
+                                return {"text": text}
                 except Exception:
-                    err_out = ""
-                self.logger.error(f"Incomplete body from MCP server. Received={len(body_bytes) if body_bytes else 0}/{content_length}. Stderr: {err_out[:500]}")
-                return None
-
-            # Preserve any extra bytes beyond the declared Content-Length for the next call
-            if extra_after_body:
-                self._rx_buffer.extend(extra_after_body)
-
-            try:
-                response_text = body_bytes.decode("utf-8")
-                self.logger.debug(f"Raw response body: {repr(response_text)}")
-                response = json.loads(response_text)
-            except json.JSONDecodeError as e:
-                self.logger.error(f"Failed to parse JSON response: {e}")
-                return None
-
-            self.logger.debug(f"Parsed response: {response}")
-            if isinstance(response, dict) and "error" in response:
-                self.logger.error(f"MCP server error: {response['error']}")
-                return None
-
-            result = response.get("result") if isinstance(response, dict) else None
-            # Unwrap MCP content payload if present
-            try:
-                if isinstance(result, dict) and isinstance(result.get("content"), list) and result["content"]:
-                    first = result["content"][0]
-                    text = first.get("text") if isinstance(first, dict) else None
-                    if isinstance(text, str):
-                        try:
-                            return json.loads(text)
-                        except json.JSONDecodeError:
-                            return {"text": text}
-            except Exception:
-                pass
-            return result
+                    pass
+                return result
         except Exception as e:
             self.logger.error(f"Error during stdio exchange: {e!r}")
             return None
@@ -773,16 +720,67 @@ class MCPClient:
         return await self.call_tool("tg.resolve_chat", {"input": normalized})
 
     async def fetch_history(self, chat_id: str, **kwargs) -> Optional[Dict[str, Any]]:
-        """Fetch message history using tg.fetch_history tool"""
+        """Fetch message history using tg.fetch_history tool.
+
+        With ``compact=True`` the server sends a senders table instead of repeating sender
+        objects; the page is expanded back to the regular ``from: {id, display}`` shape here.
+        """
         args = {"chat": self._normalize_chat(chat_id)}
         args.update(kwargs)
-        return await self.call_tool("tg.fetch_history", args)
+        return self.expand_compact_page(await self.call_tool("tg.fetch_history", args))
+
+    @staticmethod
+    def expand_compact_page(page: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Turn a compact history page ({senders, messages[from_id]}) into the regular message shape."""
+        if not isinstance(page, dict) or not isinstance(page.get("senders"), dict):
+            return page
+        senders = page["senders"]
+        messages = []
+        for m in page.get("messages") or []:
+            if not isinstance(m, dict) or "from" in m:
+                messages.append(m)
+                continue
+            sender_id = m.get("from_id")
+            display = (senders.get(str(sender_id)) or {}).get("display") or str(sender_id)
+            item = {k: v for k, v in m.items() if k != "from_id"}
+            item["from"] = {"id": sender_id, "display": display}
+            messages.append(item)
+        out = {k: v for k, v in page.items() if k != "senders"}
+        out["messages"] = messages
+        return out
+
+    async def fetch_history_multi(self, entries: List[Dict[str, Any]], concurrency: Optional[int] = None,
+                                  compact: bool = False) -> Optional[Dict[str, Any]]:
+        """Fetch history for several chats in one round-trip using tg.fetch_history_multi tool.
+
+        Each entry is ``{"chat": ..., "min_id": ..., "cap": ...}``; chat identifiers are normalized
+        the same way as in fetch_history, so results are keyed by the normalized value.
+        """
+        norm_entries = []
+        for e in entries or []:
+            item = dict(e)
+            item["chat"] = self._normalize_chat(item.get("chat"))
+            norm_entries.append(item)
+        args: Dict[str, Any] = {"entries": norm_entries}
+        if concurrency:
+            args["concurrency"] = int(concurrency)
+        if compact:
+            args["compact"] = True
+        res = await self.call_tool("tg.fetch_history_multi", args)
+        if isinstance(res, dict) and isinstance(res.get("results"), dict):
+            res["results"] = {k: self.expand_compact_page(v) for k, v in res["results"].items()}
+        return res
 
     async def send_message(self, chat_id: str, message: str) -> Optional[Dict[str, Any]]:
         """Send message using tg.send_message tool"""
         chat = self._normalize_chat(chat_id)
         return await self.call_tool("tg.send_message", {"chat": chat, "message": message})
 
+    async def edit_message(self, chat_id: str, message_id: int, message: str) -> Optional[Dict[str, Any]]:
+        """Replace the text of a sent message using tg.edit_message tool"""
+        chat = self._normalize_chat(chat_id)
+        return await self.call_tool("tg.edit_message", {"chat": chat, "message_id": int(message_id), "message": message})
+
     async def forward_message(self, from_chat: str, to_chat: str, message_id: int) -> Optional[Dict[str, Any]]:
         """Forward message using tg.forward_message tool"""
         _from = self._normalize_chat(from_chat)
@@ -808,6 +806,20 @@ class MCPClient:
         chat = self._normalize_chat(chat_id)
         return await self.call_tool("tg.get_unread_count", {"chat": chat})
 
+    async def export_history(self, chat_id: str, **kwargs) -> Optional[Dict[str, Any]]:
+        """Start (or resume) a server-side bulk export using tg.export_history tool"""
+        args = {"chat": self._normalize_chat(chat_id)}
+        args.update(kwargs)
+        return await self.call_tool("tg.export_history", args)
+
+    async def export_status(self, job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Get export progress and resumable cursor using tg.export_status tool"""
+        return await self.call_tool("tg.export_status", {"job_id": job_id} if job_id else {})
+
+    async def get_server_metrics(self) -> Optional[Dict[str, Any]]:
+        """Get server-side rate limiter metrics using tg.get_metrics tool"""
+        return await self.call_tool("tg.get_metrics", {})
+
     def _normalize_chat(self, value: Optional[str]) -> Optional[str]:
         """Normalize chat identifiers for MCP tools.
 
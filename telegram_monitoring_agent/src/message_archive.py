@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Local archive of fetched messages with an SQLite FTS5 full-text index
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "chat TEXT NOT NULL, id INTEGER NOT NULL, date TEXT, ts REAL, sender TEXT, text TEXT, UNIQUE (chat, id))",
+    "CREATE INDEX IF NOT EXISTS messages_chat_ts ON messages (chat, ts)",
+)
+_FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "text, sender, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts (rowid, text, sender) VALUES (new.rowid, new.text, new.sender); END",
+)
+
+# Words that carry no search meaning in questions like "what did @chan say about X this week"
+_STOPWORDS = frozenset("""
+a about all an and any are as at be by did do does for from has have how in is it me of on or say said says
+show tell that the this to was were what when where which who why with
+а в во и или как какие какой ли мне на над не о об по про с со за что чём чем это эта этот
+говорил говорили говорит писал писали пишут сказал сказали найди найти покажи поиск
+""".split())
+
+_PERIODS = (
+    (re.compile(r"\b(this week|на этой неделе|за эту неделю)\b", re.I), "week"),
+    (re.compile(r"\b(last week|за неделю|за последнюю неделю)\b", re.I), 7),
+    (re.compile(r"\b(today|сегодня)\b", re.I), "today"),
+    (re.compile(r"\b(yesterday|вчера)\b", re.I), 1),
+    (re.compile(r"\b(this month|за месяц|в этом месяце)\b", re.I), 30),
+)
+_LAST_DAYS = re.compile(r"\b(?:last|past|за(?: последние)?)\s+(\d+)\s+(?:days?|дн(?:я|ей|ь))\b", re.I)
+_CHAT = re.compile(r"(?<!\w)@([A-Za-z0-9_]{3,})")
+_WORD = re.compile(r"[\w][\w.+#-]*", re.U)
+
+
+def _to_ts(date: Any) -> Optional[float]:
+    if not date:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(date).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def parse_search_query(query: str, now: Optional[datetime] = None) -> Tuple[List[str], Optional[str], Optional[float]]:
+    """Split a free-form question into (search terms, chat username, since timestamp)."""
+    now = now or datetime.now(timezone.utc)
+    text = query or ""
+    chat = None
+    m = _CHAT.search(text)
+    if m:
+        chat = m.group(1)
+        text = text[:m.start()] + " " + text[m.end():]
+    since = None
+    m = _LAST_DAYS.search(text)
+    if m:
+        since = (now - timedelta(days=int(m.group(1)))).timestamp()
+        text = text[:m.start()] + " " + text[m.end():]
+    for pattern, period in _PERIODS:
+        m = pattern.search(text)
+        if not m:
+            continue
+        text = text[:m.start()] + " " + text[m.end():]
+        if since is not None:
+            continue
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if period == "today":
+            since = midnight.timestamp()
+        elif period == "week":
+            since = (midnight - timedelta(days=midnight.weekday())).timestamp()
+        else:
+            since = (midnight - timedelta(days=int(period))).timestamp()
+    terms = [w for w in _WORD.findall(text) if w.lower() not in _STOPWORDS and len(w) > 1]
+    return terms, chat, since
+
+
+class MessageArchive:
+    """Append-only store of fetched messages, searchable with FTS5 (LIKE fallback without FTS5).
+
+    ``add`` only buffers rows; ``flush``/``aflush`` insert them in one batch (``aflush`` in the
+    default executor). The database is opened on first use.
+    """
+
+    def __init__(self, path: str = "logs/archive.sqlite"):
+        self.path = path
+        self.logger = logging.getLogger('MessageArchive')
+        self.fts = True
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, int, Any, Optional[float], str, str]] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._conn is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                for stmt in _SCHEMA:
+                    conn.execute(stmt)
+                try:
+                    for stmt in _FTS_SCHEMA:
+                        conn.execute(stmt)
+                except sqlite3.OperationalError as e:
+                    self.fts = False
+                    self.logger.warning(f"SQLite FTS5 unavailable ({e}); archive search falls back to LIKE")
+                conn.commit()
+                self._conn = conn
+            return self._conn
+
+    def add(self, chat: str, messages: List[Dict[str, Any]]) -> None:
+        """Buffer messages of a chat for the next flush."""
+        rows = []
+        for m in messages or []:
+            try:
+                mid = int(m.get('id'))
+            except (TypeError, ValueError):
+                continue
+            text = m.get('text') or ""
+            if not text:
+                continue
+            sender = (m.get('from') or {}).get('display') or ""
+            rows.append((str(chat), mid, m.get('date'), _to_ts(m.get('date')), sender, text))
+        with self._lock:
+            self._pending.extend(rows)
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        conn = self._connect()
+        with self._lock, conn:
+            cur = conn.executemany(
+                "INSERT OR IGNORE INTO messages (chat, id, date, ts, sender, text) VALUES (?,?,?,?,?,?)", rows
+            )
+            return max(0, cur.rowcount)
+
+    async def aflush(self) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.flush)
+
+    def search(self, terms: List[str], chat: Optional[str] = None, since: Optional[float] = None,
+               limit: int = 10) -> List[Dict[str, Any]]:
+        """Newest messages matching all ``terms`` (prefix match), optionally within a chat / since a time."""
+        if not terms:
+            return []
+        conn = self._connect()
+        where, params = [], []
+        if self.fts:
+            match = " ".join('"{}"*'.format(t.replace('"', '""')) for t in terms)
+            sql = ("SELECT m.chat, m.id, m.date, m.sender, m.text FROM messages_fts f "
+                   "JOIN messages m ON m.rowid = f.rowid WHERE messages_fts MATCH ?")
+            params.append(match)
+        else:
+            sql = "SELECT m.chat, m.id, m.date, m.sender, m.text FROM messages m WHERE 1 = 1"
+            for t in terms:
+                where.append("m.text LIKE ?")
+                params.append(f"%{t}%")
+        if chat:
+            where.append("lower(m.chat) = ?")
+            params.append(str(chat).lstrip("@").lower())
+        if since is not None:
+            where.append("m.ts >= ?")
+            params.append(float(since))
+        for clause in where:
+            sql += f" AND {clause}"
+        sql += " ORDER BY m.ts DESC, m.id DESC LIMIT ?"
+        params.append(int(limit))
+        with self._lock:
+            rows = conn.execute(sql, params).fetchall()
+        return [{"chat": c, "id": i, "date": d, "sender": s, "text": t} for c, i, d, s, t in rows]
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Precompiled message filter (min length, keywords, excluded senders)
+"""
+
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class MessageFilter:
+    """Filter built once from the ``filters`` config section.
+
+    Keywords are matched case-insensitively as substrings (same semantics as the original
+    ``keyword.lower() in text.lower()`` check) through a single compiled alternation, and
+    excluded senders are looked up in a frozenset.
+    """
+
+    def __init__(self, filters: Optional[Dict[str, Any]] = None):
+        filters = filters or {}
+        self.min_length: int = int(filters.get('min_length', 0) or 0)
+        keywords = [str(k) for k in (filters.get('keywords') or []) if str(k)]
+        self.keywords: Tuple[str, ...] = tuple(keywords)
+        # Lowercased keyword -> configured spelling, for reporting matches
+        self._by_lower: Dict[str, str] = {}
+        for k in keywords:
+            self._by_lower.setdefault(k.lower(), k)
+        # Longest first so "deep learning" wins over a shorter keyword at the same position
+        alternatives = sorted(self._by_lower, key=len, reverse=True)
+        self._pattern = re.compile("|".join(map(re.escape, alternatives)), re.IGNORECASE) if alternatives else None
+        self.exclude_senders = frozenset(str(s) for s in (filters.get('exclude_senders') or []))
+
+    def matches(self, message: Dict[str, Any]) -> bool:
+        text = message.get('text', '') or ''
+        if len(text) < self.min_length:
+            return False
+        if self._pattern is not None and self._pattern.search(text) is None:
+            return False
+        if self.exclude_senders and (message.get('from') or {}).get('display', '') in self.exclude_senders:
+            return False
+        return True
+
+    def matched_keywords(self, text: str) -> List[str]:
+        """Configured keywords found in ``text`` (in order of first occurrence)."""
+        if self._pattern is None or not text:
+            return []
+        found: Dict[str, None] = {}
+        for m in self._pattern.finditer(text):
+            found.setdefault(self._by_lower.get(m.group(0).lower(), m.group(0)), None)
+        return list(found)
+
+    def filter_batch(self, messages: Iterable[Dict[str, Any]], with_keywords: bool = False) -> List[Any]:
+        """Filter a whole page in one pass.
+
+        Returns the passing messages, or ``(message, matched_keywords)`` pairs with ``with_keywords``.
+        """
+        out: List[Any] = []
+        min_length, pattern, excluded = self.min_length, self._pattern, self.exclude_senders
+        for m in messages:
+            text = m.get('text', '') or ''
+            if len(text) < min_length:
+                continue
+            if excluded and (m.get('from') or {}).get('display', '') in excluded:
+                continue
+            if pattern is not None and pattern.search(text) is None:
+                continue
+            out.append((m, self.matched_keywords(text)) if with_keywords else m)
+        return out
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Staged asyncio pipeline: items flow through stages joined by bounded queues
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# A stage handler takes one item and returns the items for the next stage (None/empty to drop it)
+StageHandler = Callable[[Any], Awaitable[Optional[Iterable[Any]]]]
+
+_STOP = object()
+
+
+class StagePipeline:
+    """Run items through ``stages`` = [(name, handler, workers), ...] concurrently.
+
+    Each stage has its own worker pool and reads from a bounded queue of ``queue_size``,
+    so a slow stage applies backpressure to the ones before it while faster stages keep
+    working on other items. A handler exception only drops the failing item.
+    Per-stage counters are kept in ``stats`` (also available after cancellation).
+    """
+
+    def __init__(self, stages: List[Tuple[str, StageHandler, int]], queue_size: int = 8,
+                 logger: Optional[logging.Logger] = None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = [(name, handler, max(1, int(workers))) for name, handler, workers in stages]
+        self.queue_size = max(1, int(queue_size))
+        self.logger = logger or logging.getLogger('StagePipeline')
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self._started = 0.0
+
+    def _reset_stats(self) -> None:
+        self.stats = {
+            name: {"in": 0, "out": 0, "errors": 0, "busy_sec": 0.0, "max_queue": 0, "workers": workers}
+            for name, _, workers in self.stages
+        }
+
+    async def run(self, items: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        self._reset_stats()
+        self._started = time.monotonic()
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [workers for _, _, workers in self.stages]
+
+        async def _put(stage_idx: int, item: Any) -> None:
+            q = queues[stage_idx]
+            await q.put(item)
+            st = self.stats[self.stages[stage_idx][0]]
+            st["max_queue"] = max(st["max_queue"], q.qsize())
+
+        async def _feed() -> None:
+            for item in items:
+                await _put(0, item)
+            for _ in range(self.stages[0][2]):
+                await queues[0].put(_STOP)
+
+        async def _worker(stage_idx: int) -> None:
+            name, handler, _ = self.stages[stage_idx]
+            st = self.stats[name]
+            last = stage_idx == len(self.stages) - 1
+            while True:
+                item = await queues[stage_idx].get()
+                if item is _STOP:
+                    break
+                st["in"] += 1
+                started = time.monotonic()
+                try:
+                    out = await handler(item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    st["errors"] += 1
+                    self.logger.error(f"Pipeline stage '{name}' failed: {e!r}")
+                    out = None
+                finally:
+                    st["busy_sec"] += time.monotonic() - started
+                for nxt in out or ():
+                    st["out"] += 1
+                    if not last:
+                        await _put(stage_idx + 1, nxt)
+            # The last worker of a stage tells every worker of the next stage to stop
+            remaining[stage_idx] -= 1
+            if remaining[stage_idx] == 0 and not last:
+                for _ in range(self.stages[stage_idx + 1][2]):
+                    await queues[stage_idx + 1].put(_STOP)
+
+        tasks = [asyncio.create_task(_feed())]
+        for idx, (_, _, workers) in enumerate(self.stages):
+            tasks.extend(asyncio.create_task(_worker(idx)) for _ in range(workers))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.stats
+
+    def summary_lines(self) -> List[str]:
+        """Human-readable per-stage throughput/queue depth lines for logging."""
+        elapsed = max(1e-6, time.monotonic() - self._started) if self._started else 0.0
+        lines = []
+        for name, st in self.stats.items():
+            rate = st["in"] / elapsed if elapsed else 0.0
+            lines.append(
+                f"stage={name} workers={st['workers']} in={st['in']} out={st['out']} errors={st['errors']} "
+                f"rate={rate:.2f}/s busy={st['busy_sec']:.2f}s max_queue={st['max_queue']}"
+            )
+        return lines
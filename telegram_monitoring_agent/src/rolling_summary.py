@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Rolling per-chat summaries: the LLM reply format that carries the updated state and the delta report
+"""
+
+import re
+from typing import Optional, Tuple
+
+STATE_MARKER = "=== ПАМЯТЬ ==="
+REPORT_MARKER = "=== НОВОЕ ==="
+
+# Marker lines as written, or reformatted by the model as headings/bold text
+_SECTION = re.compile(r"^[ \t#=*_]*(ПАМЯТЬ|НОВОЕ)[ \t=*_:]*$", re.M | re.I)
+
+
+def parse_rolling_reply(text: str) -> Tuple[Optional[str], str]:
+    """Split a reply into (updated state, delta report).
+
+    The state is None when the reply has no usable state section; the caller then keeps the
+    previous one. Without any markers the whole reply is taken as the report.
+    """
+    sections = {}
+    matches = list(_SECTION.finditer(text or ""))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections[match.group(1).upper()] = text[match.end():end].strip()
+    if not matches:
+        return None, (text or "").strip()
+    return sections.get("ПАМЯТЬ") or None, sections.get("НОВОЕ", "")
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Durable agent state on SQLite (WAL): last seen ids, per-chat stats, the summary outbox (with its
+processed chunk and sent summary records), rolling summaries, intermediate digest reductions
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS last_seen (chat TEXT PRIMARY KEY, message_id INTEGER NOT NULL, updated REAL)",
+    "CREATE TABLE IF NOT EXISTS chat_stats ("
+    "chat TEXT PRIMARY KEY, runs INTEGER DEFAULT 0, messages INTEGER DEFAULT 0, "
+    "summaries INTEGER DEFAULT 0, errors INTEGER DEFAULT 0, last_run REAL)",
+    "CREATE TABLE IF NOT EXISTS processed_chunks ("
+    "chat TEXT NOT NULL, chunk_key TEXT NOT NULL, processed REAL, PRIMARY KEY (chat, chunk_key))",
+    "CREATE TABLE IF NOT EXISTS sent_summaries ("
+    "chat TEXT NOT NULL, chunk_key TEXT NOT NULL, target TEXT, message_id INTEGER, sent REAL, "
+    "PRIMARY KEY (chat, chunk_key))",
+    "CREATE TABLE IF NOT EXISTS outbox ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, chat TEXT NOT NULL, chunk_key TEXT NOT NULL, target TEXT, "
+    "title TEXT, username TEXT, idx INTEGER, total INTEGER, messages TEXT, text TEXT, "
+    "status TEXT NOT NULL, attempts INTEGER DEFAULT 0, error TEXT, message_id INTEGER, "
+    "created REAL, updated REAL, UNIQUE (chat, chunk_key))",
+    "CREATE TABLE IF NOT EXISTS rolling_summaries ("
+    "chat TEXT PRIMARY KEY, summary TEXT NOT NULL, last_id INTEGER, updates INTEGER DEFAULT 0, updated REAL)",
+    "CREATE TABLE IF NOT EXISTS digest_reductions ("
+    "chat TEXT NOT NULL, group_key TEXT NOT NULL, text TEXT NOT NULL, updated REAL, PRIMARY KEY (chat, group_key))",
+)
+
+# Reduce results unused for this long are dropped when the chat saves a new one
+REDUCTION_MAX_AGE_SEC = 7 * 24 * 3600
+
+# Outbox record lifecycle: pending_summary -> pending_send -> done (or failed after max attempts)
+_OUTBOX_COLUMNS = ("id", "chat", "chunk_key", "target", "title", "username", "idx", "total", "messages", "text",
+                   "status", "attempts")
+
+
+class StateStore:
+    """Agent state kept in one SQLite database in WAL mode.
+
+    The database is opened (and ``last_seen.json`` migrated) on first use, not at startup.
+    Updates are buffered in memory and written in a single transaction by ``flush`` —
+    ``aflush`` runs it in the default executor, so the event loop never blocks on disk I/O.
+    """
+
+    def __init__(self, path: str = "logs/state.sqlite", legacy_json: Optional[str] = "logs/last_seen.json"):
+        self.path = path
+        self.legacy_json = legacy_json
+        self.logger = logging.getLogger('StateStore')
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._last_seen: Optional[Dict[str, int]] = None
+        self._pending_last_seen: Dict[str, int] = {}
+        self._pending_stats: Dict[str, Dict[str, int]] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._conn is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                for stmt in _SCHEMA:
+                    conn.execute(stmt)
+                conn.commit()
+                self._conn = conn
+                self._migrate_legacy_json(conn)
+            return self._conn
+
+    def _migrate_legacy_json(self, conn: sqlite3.Connection) -> None:
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return
+        if conn.execute("SELECT COUNT(*) FROM last_seen").fetchone()[0]:
+            return
+        try:
+            with open(self.legacy_json, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            rows = [(str(k), int(v), time.time()) for k, v in (data or {}).items() if str(k)]
+        except Exception as e:
+            self.logger.warning(f"Failed to read legacy state {self.legacy_json}: {e}")
+            return
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO last_seen (chat, message_id, updated) VALUES (?,?,?)", rows)
+        os.replace(self.legacy_json, self.legacy_json + ".migrated")
+        self.logger.info(f"Migrated last_seen ids for {len(rows)} chat(s) from {self.legacy_json}")
+
+    # --- last seen ids -------------------------------------------------------------------------
+
+    def load_last_seen(self) -> Dict[str, int]:
+        if self._last_seen is None:
+            conn = self._connect()
+            with self._lock:
+                rows = conn.execute("SELECT chat, message_id FROM last_seen").fetchall()
+            self._last_seen = {str(chat): int(mid) for chat, mid in rows}
+        return dict(self._last_seen)
+
+    def set_last_seen(self, values: Dict[str, int]) -> None:
+        """Stage last seen ids; only values that changed since the last call are written."""
+        if self._last_seen is None:
+            self.load_last_seen()
+        with self._lock:
+            for chat, mid in values.items():
+                mid = int(mid)
+                if self._last_seen.get(chat) != mid:
+                    self._last_seen[chat] = mid
+                    self._pending_last_seen[chat] = mid
+
+    # --- stats ----------------------------------------------------------------------------------
+
+    def add_chat_stats(self, chat: str, **counters: int) -> None:
+        """Accumulate counters (runs, messages, summaries, errors) for a chat."""
+        with self._lock:
+            st = self._pending_stats.setdefault(chat, {})
+            for key, value in counters.items():
+                st[key] = st.get(key, 0) + int(value)
+
+    def chat_stats(self, chat: str) -> Dict[str, Any]:
+        conn = self._connect()
+        with self._lock:
+            row = conn.execute(
+                "SELECT runs, messages, summaries, errors, last_run FROM chat_stats WHERE chat = ?", (chat,)
+            ).fetchone()
+        keys = ("runs", "messages", "summaries", "errors", "last_run")
+        return dict(zip(keys, row)) if row else {k: 0 for k in keys}
+
+    # --- persistence --------------------------------------------------------------------------
+
+    def flush(self) -> int:
+        """Write all staged updates in one transaction. Returns the number of rows written."""
+        with self._lock:
+            last_seen, self._pending_last_seen = self._pending_last_seen, {}
+            stats, self._pending_stats = self._pending_stats, {}
+        if not (last_seen or stats):
+            return 0
+        conn = self._connect()
+        now = time.time()
+        with self._lock, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO last_seen (chat, message_id, updated) VALUES (?,?,?)",
+                [(chat, mid, now) for chat, mid in last_seen.items()],
+            )
+            for chat, st in stats.items():
+                conn.execute(
+                    "INSERT INTO chat_stats (chat, runs, messages, summaries, errors, last_run) VALUES (?,?,?,?,?,?) "
+                    "ON CONFLICT(chat) DO UPDATE SET runs = runs + excluded.runs, "
+                    "messages = messages + excluded.messages, summaries = summaries + excluded.summaries, "
+                    "errors = errors + excluded.errors, last_run = excluded.last_run",
+                    (chat, st.get("runs", 0), st.get("messages", 0), st.get("summaries", 0), st.get("errors", 0), now),
+                )
+        return len(last_seen) + len(stats)
+
+    async def aflush(self) -> int:
+        return await self.acall(self.flush)
+
+    async def acall(self, fn, *args: Any) -> Any:
+        """Run a (blocking) store method in the default executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: fn(*args))
+
+    # --- outbox -------------------------------------------------------------------------------
+    # Outbox writes are committed immediately (not batched): each state change must survive a crash.
+
+    def _outbox_rows(self, where: str, params: Tuple[Any, ...]) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        with self._lock:
+            rows = conn.execute(f"SELECT {', '.join(_OUTBOX_COLUMNS)} FROM outbox WHERE {where} ORDER BY chat, idx", params).fetchall()
+        out = []
+        for row in rows:
+            rec = dict(zip(_OUTBOX_COLUMNS, row))
+            rec["messages"] = json.loads(rec["messages"] or "[]")
+            out.append(rec)
+        return out
+
+    def outbox_add(self, chat: str, target: Optional[str], title: Optional[str], username: Optional[str],
+                   chunks: List[Tuple[str, int, int, List[Dict[str, Any]]]],
+                   last_seen: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Enqueue chunks ``(chunk_key, idx, total, messages)`` of a chat as pending summaries.
+
+        ``last_seen`` is written in the same transaction, so the fetched messages are either both
+        recorded and marked seen or neither. Returns the chat's records still to be completed for
+        these keys (already sent chunks are left out).
+        """
+        conn = self._connect()
+        now = time.time()
+        with self._lock, conn:
+            sent = {k for (k,) in conn.execute("SELECT chunk_key FROM processed_chunks WHERE chat = ?", (chat,))}
+            conn.executemany(
+                "INSERT OR IGNORE INTO outbox (chat, chunk_key, target, title, username, idx, total, messages, "
+                "status, created, updated) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                [(chat, key, target, title, username, idx, total, json.dumps(msgs, ensure_ascii=False),
+                  "pending_summary", now, now) for key, idx, total, msgs in chunks if key not in sent],
+            )
+            if last_seen:
+                conn.execute(
+                    "INSERT INTO last_seen (chat, message_id, updated) VALUES (?,?,?) ON CONFLICT(chat) DO UPDATE "
+                    "SET message_id = MAX(message_id, excluded.message_id), updated = excluded.updated",
+                    (chat, int(last_seen), now),
+                )
+        keys = [key for key, _, _, _ in chunks]
+        if not keys:
+            return []
+        marks = ",".join("?" * len(keys))
+        return self._outbox_rows(
+            f"chat = ? AND chunk_key IN ({marks}) AND status IN ('pending_summary', 'pending_send')", (chat, *keys)
+        )
+
+    def outbox_pending(self) -> List[Dict[str, Any]]:
+        return self._outbox_rows("status IN ('pending_summary', 'pending_send')", ())
+
+    def outbox_set_summaries(self, texts: Dict[int, str]) -> None:
+        """Store computed message texts so a restart sends them without asking the LLM again."""
+        conn = self._connect()
+        now = time.time()
+        with self._lock, conn:
+            conn.executemany(
+                "UPDATE outbox SET text = ?, status = 'pending_send', error = NULL, updated = ? WHERE id = ?",
+                [(text, now, rec_id) for rec_id, text in texts.items()],
+            )
+
+    def outbox_mark_sent(self, rec_id: int, message_id: Optional[int]) -> None:
+        conn = self._connect()
+        now = time.time()
+        with self._lock, conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'done', message_id = ?, messages = NULL, updated = ? WHERE id = ?",
+                (message_id, now, rec_id),
+            )
+            row = conn.execute("SELECT chat, chunk_key, target FROM outbox WHERE id = ?", (rec_id,)).fetchone()
+            if row:
+                chat, key, target = row
+                conn.execute("INSERT OR REPLACE INTO processed_chunks VALUES (?,?,?)", (chat, key, now))
+                conn.execute("INSERT OR REPLACE INTO sent_summaries VALUES (?,?,?,?,?)", (chat, key, target, message_id, now))
+
+    def outbox_mark_failed(self, rec_ids: List[int], error: str, max_attempts: int = 3) -> None:
+        """Count a failed attempt; records that used up ``max_attempts`` are parked as 'failed'."""
+        conn = self._connect()
+        now = time.time()
+        with self._lock, conn:
+            conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, error = ?, updated = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END WHERE id = ?",
+                [(error, now, int(max_attempts), rec_id) for rec_id in rec_ids],
+            )
+
+    # --- rolling summaries ------------------------------------------------------------------
+
+    def rolling_summary(self, chat: str) -> Optional[Dict[str, Any]]:
+        """The chat's rolling summary ``{"summary", "last_id", "updates", "updated"}`` or None."""
+        conn = self._connect()
+        with self._lock:
+            row = conn.execute(
+                "SELECT summary, last_id, updates, updated FROM rolling_summaries WHERE chat = ?", (chat,)
+            ).fetchone()
+        return dict(zip(("summary", "last_id", "updates", "updated"), row)) if row else None
+
+    def rolling_save(self, chat: str, summary: str, last_id: Optional[int],
+                     outbox_text: Optional[Tuple[int, str]] = None) -> None:
+        """Replace the chat's rolling summary; ``outbox_text`` ``(record id, text)`` is stored in the
+        same transaction, so a restart never applies one chunk to the summary twice."""
+        conn = self._connect()
+        now = time.time()
+        with self._lock, conn:
+            conn.execute(
+                "INSERT INTO rolling_summaries (chat, summary, last_id, updates, updated) VALUES (?,?,?,1,?) "
+                "ON CONFLICT(chat) DO UPDATE SET summary = excluded.summary, "
+                "last_id = MAX(COALESCE(last_id, 0), COALESCE(excluded.last_id, 0)), "
+                "updates = updates + 1, updated = excluded.updated",
+                (chat, summary, last_id, now),
+            )
+            if outbox_text is not None:
+                conn.execute(
+                    "UPDATE outbox SET text = ?, status = 'pending_send', error = NULL, updated = ? WHERE id = ?",
+                    (outbox_text[1], now, outbox_text[0]),
+                )
+
+    # --- digest reductions ------------------------------------------------------------------
+
+    def reduction_get(self, chat: str, group_key: str) -> Optional[str]:
+        """The stored reduce result of one digest group (``group_key`` hashes its prompt) or None."""
+        conn = self._connect()
+        with self._lock, conn:
+            row = conn.execute(
+                "SELECT text FROM digest_reductions WHERE chat = ? AND group_key = ?", (chat, group_key)
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE digest_reductions SET updated = ? WHERE chat = ? AND group_key = ?",
+                             (time.time(), chat, group_key))
+        return row[0] if row else None
+
+    def reduction_save(self, chat: str, group_key: str, text: str,
+                       max_age_sec: float = REDUCTION_MAX_AGE_SEC) -> None:
+        """Store a reduce result and drop the chat's results not used for ``max_age_sec``."""
+        conn = self._connect()
+        now = time.time()
+        with self._lock, conn:
+            conn.execute("INSERT OR REPLACE INTO digest_reductions VALUES (?,?,?,?)", (chat, group_key, text, now))
+            conn.execute("DELETE FROM digest_reductions WHERE chat = ? AND updated < ?", (chat, now - max_age_sec))
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
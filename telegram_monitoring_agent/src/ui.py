@@ -8,6 +8,8 @@ from tkinter import ttk, scrolledtext
 import asyncio
 import threading
 
+from .llm_resolver import get_llm_registry
+
 class TelegramUI:
     def __init__(self, agent=None):
         self.agent = agent
@@ -95,6 +97,20 @@ class TelegramUI:
         self.chat_area.see(tk.END)
         self.chat_area.config(state=tk.DISABLED)
 
+    def begin_stream_message(self, sender: str = "agent"):
+        """Start an empty message that append_stream() fills in while the answer is generated"""
+        self.add_message("", sender)
+        self._stream_tag = sender
+        # Before the newline that add_message() appended; right gravity keeps the mark after new text
+        self.chat_area.mark_set("stream_end", "end-2c")
+
+    def append_stream(self, text: str):
+        """Append a streamed piece to the message started by begin_stream_message()"""
+        self.chat_area.config(state=tk.NORMAL)
+        self.chat_area.insert("stream_end", text, getattr(self, "_stream_tag", "agent"))
+        self.chat_area.see(tk.END)
+        self.chat_area.config(state=tk.DISABLED)
+
     def send_message(self, event=None):
         """Send user message"""
         message = self.input_field.get().strip()
@@ -113,13 +129,30 @@ class TelegramUI:
                 self.root.after(0, lambda: self.add_message("Agent not initialized", "system"))
                 return
                 
+            # Streamed answers are rendered piece by piece as they arrive
+            streamed = []
+
+            def on_token(piece: str):
+                if not streamed:
+                    self.root.after(0, self.begin_stream_message)
+                streamed.append(piece)
+                self.root.after(0, lambda: self.append_stream(piece))
+
             # Run async processing
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
-            response = loop.run_until_complete(self.agent.process_user_query(message))
-            loop.close()
-
-            self.root.after(0, lambda: self.add_message(response, "agent"))
+            try:
+                response = loop.run_until_complete(self.agent.process_user_query(message, on_token=on_token))
+            finally:
+                # Pooled LLM sessions are bound to this short-lived loop
+                loop.run_until_complete(get_llm_registry().aclose())
+                loop.close()
+
+            if not streamed:
+                self.root.after(0, lambda: self.add_message(response, "agent"))
+            elif response != "".join(streamed).strip():
+                # The stream broke off; show the error after the partial answer
+                self.root.after(0, lambda: self.add_message(response, "system"))
         except Exception as e:
             self.root.after(0, lambda: self.add_message(f"Error: {str(e)}", "system"))
 
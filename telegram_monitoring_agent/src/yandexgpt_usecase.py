@@ -6,29 +6,33 @@ YandexGPT LLM Implementation
 import aiohttp
 import json
 import os
-from typing import List, Dict, Any
-from .llm_usecase import LlmUseCase
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional
+from .llm_usecase import LlmHttpError, LlmUseCase, parse_retry_after
 
 
 class YandexGptUseCase(LlmUseCase):
     """YandexGPT LLM implementation"""
 
-    def __init__(self):
-        self.api_url = os.getenv('YANDEX_GPT_BASE_URL',
-                                'https://llm.api.cloud.yandex.net/foundationModels/v1/completion')
-        self.iam_token = os.getenv('YANDEX_IAM_TOKEN', '')
-        self.api_key = os.getenv('YANDEX_API_KEY', '')
-        self.folder_id = os.getenv('YANDEX_FOLDER_ID', '')
-        self.model_uri = os.getenv('YANDEX_MODEL_URI', f'gpt://{self.folder_id}/yandexgpt')
+    def __init__(self, session_factory: Optional[Callable[[], aiohttp.ClientSession]] = None):
+        super().__init__(session_factory)
 
-    async def complete(self, messages: List[Dict[str, str]], **kwargs) -> str:
-        """Complete the conversation using YandexGPT API"""
+    @property
+    def api_url(self) -> str:
+        return os.getenv('YANDEX_GPT_BASE_URL', 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion')
+
+    def _request(self, messages: List[Dict[str, str]], stream: bool, **kwargs) -> tuple:
+        # Settings are read per request: the use case is shared for the whole process and the
+        # environment may change after it is created (UI settings, a refreshed IAM token)
+        iam_token = os.getenv('YANDEX_IAM_TOKEN', '')
+        api_key = os.getenv('YANDEX_API_KEY', '')
+        folder_id = os.getenv('YANDEX_FOLDER_ID', '')
+        model_uri = os.getenv('YANDEX_MODEL_URI', f'gpt://{folder_id}/yandexgpt')
 
         # Check authentication
-        if not self.iam_token and not self.api_key:
+        if not iam_token and not api_key:
             raise Exception("YandexGPT authentication not found. Set YANDEX_IAM_TOKEN or YANDEX_API_KEY")
 
-        if not self.folder_id:
+        if not folder_id:
             raise Exception("YandexGPT folder ID not found. Set YANDEX_FOLDER_ID")
 
         # Get parameters from kwargs or use defaults
@@ -44,9 +48,9 @@ class YandexGptUseCase(LlmUseCase):
             })
 
         request_body = {
-            'modelUri': self.model_uri,
+            'modelUri': model_uri,
             'completionOptions': {
-                'stream': False,
+                'stream': stream,
                 'temperature': temperature,
                 'maxTokens': max_tokens,
             },
@@ -55,17 +59,23 @@ class YandexGptUseCase(LlmUseCase):
 
         headers = {'Content-Type': 'application/json'}
 
-        if self.iam_token:
-            headers['Authorization'] = f'Bearer {self.iam_token}'
+        if iam_token:
+            headers['Authorization'] = f'Bearer {iam_token}'
         else:
-            headers['Authorization'] = f'Api-Key {self.api_key}'
-            headers['x-folder-id'] = self.folder_id
+            headers['Authorization'] = f'Api-Key {api_key}'
+            headers['x-folder-id'] = folder_id
+        return headers, request_body
+
+    async def complete(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """Complete the conversation using YandexGPT API"""
+        headers, request_body = self._request(messages, False, **kwargs)
 
-        async with aiohttp.ClientSession() as session:
+        async with self._session() as session:
             async with session.post(self.api_url, headers=headers, json=request_body) as response:
                 if response.status != 200:
                     error_text = await response.text()
-                    raise Exception(f"YandexGPT API error {response.status}: {error_text}")
+                    raise LlmHttpError(f"YandexGPT API error {response.status}: {error_text}", response.status,
+                                       parse_retry_after(response.headers.get('Retry-After')))
 
                 data = await response.json()
                 text = data.get('result', {}).get('alternatives', [{}])[0].get('message', {}).get('text', '')
@@ -74,3 +84,30 @@ class YandexGptUseCase(LlmUseCase):
                     raise Exception("Empty response from YandexGPT")
 
                 return text
+
+    async def complete_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """Stream the completion; YandexGPT sends one JSON object per line with the text generated so far"""
+        headers, request_body = self._request(messages, True, **kwargs)
+
+        async with self._session() as session:
+            async with session.post(self.api_url, headers=headers, json=request_body) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise LlmHttpError(f"YandexGPT API error {response.status}: {error_text}", response.status,
+                                       parse_retry_after(response.headers.get('Retry-After')))
+
+                sent = 0
+                async for raw in response.content:
+                    line = raw.decode('utf-8', errors='replace').strip()
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    alternative = (data.get('result', {}).get('alternatives') or [{}])[0]
+                    text = alternative.get('message', {}).get('text', '')
+                    # Each chunk repeats the whole text so far; yield only the new tail
+                    if len(text) > sent:
+                        yield text[sent:]
+                        sent = len(text)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Shared fixtures for agent tests
+"""
+
+import weakref
+from unittest.mock import Mock
+
+from src.agent import TelegramAgent
+
+
+def make_agent(**overrides) -> TelegramAgent:
+    """TelegramAgent built without __init__ (it loads the config and starts the UI).
+
+    Sets the attributes read by the LLM, analysis and pipeline paths to the defaults of a
+    DeepSeek config with cache, resilience and the fast path off; ``overrides`` replace them
+    or set further attributes.
+    """
+    agent = TelegramAgent.__new__(TelegramAgent)
+    attrs = {
+        'config': {'llm_provider': 'deepseek'},
+        'logger': Mock(),
+        'llm_cache': None,
+        'llm_resilience': None,
+        'llm_failover': False,
+        'llm_concurrency': 4,
+        '_llm_windows': {},
+        '_llm_schedulers': weakref.WeakKeyDictionary(),
+        'stream_max_chars': 0,
+        'stream_edit_interval_sec': 0,
+        'analysis_batch_size': 25,
+        'analysis_batch_tokens': 2500,
+        'lexicon': None,
+        'analysis_stats': {"lexicon": 0, "llm": 0, "fallback": 0, "llm_agreed": 0},
+        'digest_mode': 'chunks',
+        'rolling_summary_enabled': False,
+        'state_store': None,
+    }
+    attrs.update(overrides)
+    for name, value in attrs.items():
+        setattr(agent, name, value)
+    return agent
@@ -3,10 +3,16 @@
 Tests for Telegram Monitoring Agent
 """
 
+import asyncio
+import os
+import tempfile
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 from src.agent import TelegramAgent
 from src.mcp_client import MCPClient
+from src.state_store import StateStore
+from src.llm_cache import LlmCache, make_cache_key
+from tests.helpers import make_agent
 
 class TestTelegramAgent(unittest.TestCase):
     def setUp(self):
@@ -80,43 +86,22 @@ class TestTelegramAgent(unittest.TestCase):
         result = self.agent.should_process_message(message)
         self.assertFalse(result)
 
-    @patch('src.agent.AsyncOpenAI')
-    async def test_analyze_sentiment_and_intent(self, mock_openai):
-        mock_client = Mock()
-        mock_openai.return_value = mock_client
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = '{"sentiment": "positive", "intent": "praise", "confidence": 0.8}'
-        mock_client.chat.completions.create.return_value = mock_response
-        
-        message = {'text': 'Great job!'}
-        result = await self.agent.analyze_sentiment_and_intent(message)
+    def test_analyze_sentiment_and_intent(self):
+        self.agent.lexicon = None
+        reply = '{"sentiment": "positive", "intent": "praise", "confidence": 0.8}'
+        with patch.object(self.agent, '_llm_complete', AsyncMock(return_value=reply)):
+            result = asyncio.run(self.agent.analyze_sentiment_and_intent({'text': 'Great job!'}))
         self.assertEqual(result['sentiment'], 'positive')
-        
-    @patch('src.agent.AsyncOpenAI')
-    async def test_extract_features(self, mock_openai):
-        mock_client = Mock()
-        mock_openai.return_value = mock_client
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = '{"entities": ["Company"], "topics": ["Business"], "urgency": "high", "dates": []}'
-        mock_client.chat.completions.create.return_value = mock_response
-        
-        message = {'text': 'Company meeting tomorrow'}
-        result = await self.agent.extract_features(message)
+
+    def test_extract_features(self):
+        reply = '{"entities": ["Company"], "topics": ["Business"], "urgency": "high", "dates": []}'
+        with patch.object(self.agent, '_llm_complete', AsyncMock(return_value=reply)):
+            result = asyncio.run(self.agent.extract_features({'text': 'Company meeting tomorrow'}))
         self.assertIn('Company', result['entities'])
-        
-    @patch('src.agent.AsyncOpenAI')
-    async def test_generate_response(self, mock_openai):
-        mock_client = Mock()
-        mock_openai.return_value = mock_client
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = 'Спасибо за ваше сообщение!'
-        mock_client.chat.completions.create.return_value = mock_response
-        
-        message = {'text': 'Hello', 'from': {'display': 'User'}}
-        result = await self.agent.generate_response(message)
+
+    def test_generate_response(self):
+        with patch.object(self.agent, '_llm_complete', AsyncMock(return_value='Спасибо за ваше сообщение!')):
+            result = asyncio.run(self.agent.generate_response({'text': 'Hello', 'from': {'display': 'User'}}))
         self.assertIsInstance(result, str)
 
     @patch('src.agent.MCPClient.send_message')
@@ -147,5 +132,437 @@ class TestMCPClient(unittest.TestCase):
         self.assertEqual(self.client.server_url, "http://localhost:3000")
         self.assertIsNone(self.client.session)
 
+    def test_expand_compact_page(self):
+        page = {
+            'senders': {'7': {'display': 'bob'}},
+            'messages': [{'id': 1, 'text': 'hi', 'date': None, 'from_id': 7}]
+        }
+        expanded = MCPClient.expand_compact_page(page)
+        self.assertNotIn('senders', expanded)
+        self.assertEqual(expanded['messages'][0]['from'], {'id': 7, 'display': 'bob'})
+        self.assertNotIn('from_id', expanded['messages'][0])
+        # Regular pages pass through unchanged
+        regular = {'messages': [{'id': 2, 'from': {'id': 1, 'display': 'a'}}]}
+        self.assertIs(MCPClient.expand_compact_page(regular), regular)
+
+    def test_stdio_drops_late_response_of_timed_out_request(self):
+        read_fd, write_fd = os.pipe()
+        client = MCPClient("node server.js")
+        client.process = Mock()
+        client.process.poll.return_value = None
+        client.process.stdin = Mock()
+        client.process.stdout = os.fdopen(read_fd, 'rb', buffering=0)
+
+        def frame(req_id, text):
+            body = ('{"jsonrpc": "2.0", "id": %d, "result": {"content": [{"type": "text", "text": "%s"}]}}'
+                    % (req_id, text)).encode()
+            return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+        async def scenario():
+            # The first request times out; its answer arrives together with the next one
+            first = await client._send_and_read({"jsonrpc": "2.0", "id": 1, "method": "tools/call"}, 0.1)
+            os.write(write_fd, frame(1, "stale")[:10])
+            await asyncio.sleep(0.05)
+            os.write(write_fd, frame(1, "stale")[10:] + frame(2, "fresh"))
+            second = await client._send_and_read({"jsonrpc": "2.0", "id": 2, "method": "tools/call"}, 2.0)
+            return first, second
+
+        try:
+            first, second = asyncio.run(scenario())
+        finally:
+            os.close(write_fd)
+            client.process.stdout.close()
+        self.assertIsNone(first)
+        self.assertEqual(second, {"text": "fresh"})
+
+class TestMonitorConcurrency(unittest.TestCase):
+    def _agent(self, concurrency, deadline=0.0):
+        return make_agent(monitor_concurrency=concurrency, monitor_iteration_deadline_sec=deadline,
+                          pipeline_config={})
+
+    def test_bounded_and_isolated(self):
+        agent = self._agent(2)
+        state = {'active': 0, 'peak': 0, 'done': []}
+
+        async def fake_fetch(chat_id, prefetched=None):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            await asyncio.sleep(0.01)
+            state['active'] -= 1
+            if chat_id == '@bad':
+                raise RuntimeError('boom')
+            state['done'].append(chat_id)
+
+        agent._fetch_chat = fake_fetch
+        asyncio.run(agent._monitor_chats(['@a', '@bad', '@b', '@c'], {}))
+        self.assertEqual(state['peak'], 2)
+        self.assertEqual(sorted(state['done']), ['@a', '@b', '@c'])
+        agent.logger.error.assert_called_once()
+
+    def test_iteration_deadline_cancels_slow_chats(self):
+        agent = self._agent(4, deadline=0.05)
+        done = []
+
+        async def fake_fetch(chat_id, prefetched=None):
+            await asyncio.sleep(5 if chat_id == '@slow' else 0)
+            done.append(chat_id)
+
+        agent._fetch_chat = fake_fetch
+        asyncio.run(agent._monitor_chats(['@fast', '@slow'], {}))
+        self.assertEqual(done, ['@fast'])
+        agent.logger.warning.assert_called_once()
+
+class TestParallelSummaries(unittest.TestCase):
+    def test_chunks_summarized_concurrently_in_order(self):
+        agent = make_agent(llm_concurrency=3)
+        state = {'active': 0, 'peak': 0}
+
+        async def fake_summarize(chunk, source_title=None, source_username=None):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            # Later chunks finish first
+            await asyncio.sleep(0.01 * (10 - chunk[0]))
+            state['active'] -= 1
+            if chunk[0] == 2:
+                raise RuntimeError('llm down')
+            return f"summary {chunk[0]}"
+
+        agent.summarize_news_and_trends = fake_summarize
+        result = asyncio.run(agent._summarize_chunks([[i] for i in range(1, 6)], source_title='chat'))
+        self.assertEqual(result, ['summary 1', None, 'summary 3', 'summary 4', 'summary 5'])
+        self.assertEqual(state['peak'], 3)
+
+class TestDialogSnapshot(unittest.TestCase):
+    def test_idle_chats_skipped(self):
+        agent = make_agent(mcp_client=MCPClient("http://localhost:3000"),
+                           last_seen_ids={'Quiet': 50, 'busy': 10, '777': 5})
+        agent.mcp_client.get_chats = Mock(return_value=asyncio.sleep(0, result=[
+            {'id': -1001234, 'title': 'Quiet', 'username': 'Quiet', 'unread': 0, 'top_message_id': 50},
+            {'id': -1002222, 'title': 'Busy', 'username': 'busy', 'unread': 3, 'top_message_id': 13},
+            {'id': -1000000000777, 'title': 'Private', 'username': None, 'unread': 0, 'top_message_id': 5},
+        ]))
+        agent._dialog_snapshot = asyncio.run(agent._take_dialog_snapshot())
+        self.assertFalse(agent._chat_has_news('@quiet'))
+        self.assertTrue(agent._chat_has_news('@busy'))
+        # Bare channel id (as returned by resolve_chat) matches the marked dialog id
+        self.assertFalse(agent._chat_has_news('777'))
+        # Unknown chats are always monitored
+        self.assertTrue(agent._chat_has_news('@unknown'))
+        self.assertEqual(agent._snapshot_entry('busy')['unread'], 3)
+
+class TestAdaptivePaging(unittest.TestCase):
+    def _agent(self, last_seen, **config):
+        agent = make_agent(
+            mcp_client=MCPClient("http://localhost:3000"),
+            last_seen_ids=dict(last_seen),
+            page_size=10,
+            max_page_size=40,
+            first_run_max_messages=config.get('first_run_max_messages'),
+            first_run_max_age_hours=0,
+            chat_settings=config.get('chat_settings', {}),
+            _next_page_size={},
+            _dialog_snapshot={},
+            compact_history=False,
+            summary_chat=None,
+            _save_last_seen=Mock(),
+            state_store=Mock(),
+            archive=None,
+        )
+        agent.mcp_client.get_unread_count = AsyncMock(return_value={'unread': 0})
+        # Channel with messages 1..1000; fetch_history returns the newest page within (min_id; max_id]
+        self.sizes = []
+        self.offset_dates = []
+
+        async def fake_fetch(chat, page_size=10, min_id=None, max_id=None, compact=False, offset_date=None):
+            if offset_date:
+                # Last message before the cutoff
+                self.offset_dates.append(offset_date)
+                return {'messages': [{'id': 990, 'text': 'old', 'date': '2020-01-01T00:00:00+00:00'}]}
+            self.sizes.append(page_size)
+            top = max_id if max_id is not None else 1000
+            ids = [i for i in range(top, (min_id or 0), -1)][:page_size]
+            return {'messages': [{'id': i, 'text': str(i), 'date': None} for i in ids]}
+
+        agent.mcp_client.fetch_history = fake_fetch
+        return agent
+
+    def test_page_size_grows_with_backlog_and_shrinks_after(self):
+        agent = self._agent({'chan': 850})
+        batch = asyncio.run(agent._fetch_chat('@chan', {'chat': {'id': 1, 'username': 'chan', 'title': 'C'}}))
+        self.assertEqual(len(batch['new_msgs']), 150)
+        self.assertEqual(self.sizes, [10, 20, 40, 40, 40, 40])
+        self.assertEqual(agent._next_page_size['chan'], 40)
+        # Quiet run: the learned size drops back to page_size
+        self.sizes.clear()
+        agent._next_page_size['chan'] = 10
+        agent.last_seen_ids['chan'] = 997
+        asyncio.run(agent._fetch_chat('@chan', {'chat': {'id': 1, 'username': 'chan', 'title': 'C'}}))
+        self.assertEqual(self.sizes, [10])
+        self.assertEqual(agent._next_page_size['chan'], 10)
+
+    def test_first_run_bounded_per_chat(self):
+        agent = self._agent({}, first_run_max_messages=500,
+                            chat_settings={'@chan': {'first_run_max_messages': 25, 'max_page_size': 20}})
+        batch = asyncio.run(agent._fetch_chat('@chan', {'chat': {'id': 1, 'username': 'chan', 'title': 'C'}}))
+        self.assertEqual([m['id'] for m in batch['new_msgs']][:2], [976, 977])
+        self.assertEqual(len(batch['new_msgs']), 25)
+        self.assertEqual(self.sizes, [10, 20])
+        # The fetch stage only carries the new position; the outbox write commits it
+        self.assertEqual(batch['last_seen'], 1000)
+        self.assertNotIn('chan', agent.last_seen_ids)
+
+    def test_bootstrap_seeds_from_date_cutoff(self):
+        agent = self._agent({}, first_run_max_messages=None)
+        agent.first_run_max_age_hours = 6
+        batch = asyncio.run(agent._fetch_chat('@chan', {'chat': {'id': 1, 'username': 'chan', 'title': 'C'}}))
+        self.assertEqual(len(self.offset_dates), 1)
+        self.assertEqual([m['id'] for m in batch['new_msgs']], list(range(991, 1001)))
+        self.assertEqual(agent.last_seen_ids['chan'], 990)
+        self.assertEqual(batch['last_seen'], 1000)
+
+    def test_bootstrap_zero_messages_starts_from_latest(self):
+        agent = self._agent({}, chat_settings={'chan': {'first_run_max_messages': 0}})
+        prefetched = {'chat': {'id': 1, 'username': 'chan', 'title': 'C'}, 'min_id': 0,
+                      'messages': [{'id': 1000, 'text': 'x', 'date': None}]}
+        self.assertIsNone(asyncio.run(agent._fetch_chat('@chan', prefetched)))
+        self.assertEqual(agent.last_seen_ids['chan'], 1000)
+        self.assertEqual(self.sizes, [])
+
+    def test_deadline_after_fetch_keeps_last_seen(self):
+        agent = self._agent({'chan': 850})
+        agent.monitor_concurrency = 1
+        agent.monitor_iteration_deadline_sec = 0.2
+        agent.pipeline_config = {}
+        agent.llm_concurrency = 1
+        agent._filter_chat = lambda batch: dict(batch, chunks=[batch['new_msgs']])
+
+        async def slow_summarize(batch):
+            await asyncio.sleep(10)
+
+        agent._summarize_chat = slow_summarize
+        asyncio.run(agent._monitor_chats(['@chan'], {'@chan': {'chat': {'id': 1, 'username': 'chan', 'title': 'C'}}}))
+        # Cancelled before the outbox write: the messages are fetched again next run
+        self.assertEqual(agent.last_seen_ids['chan'], 850)
+        agent._save_last_seen.assert_not_called()
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _agent(self):
+        agent = make_agent(
+            state_store=StateStore(os.path.join(self.tmp.name, 'state.sqlite'), legacy_json=None),
+            last_seen_ids={'chan': 4},
+            llm_concurrency=2,
+            outbox_max_attempts=5,
+            summary_chat='@report',
+            _llm_is_configured=Mock(return_value=(True, None)),
+            mcp_client=Mock(),
+        )
+        self.prompts = []
+
+        async def fake_summarize(chunk, source_title=None, source_username=None):
+            self.prompts.append(chunk[0]['id'])
+            return None if self.llm_down and chunk[0]['id'] == 3 else f"summary {chunk[0]['id']}"
+
+        agent.summarize_news_and_trends = fake_summarize
+        return agent
+
+    def test_pending_records_resume_without_reprompting(self):
+        agent = self._agent()
+        self.llm_down = True
+        agent.mcp_client.send_message = AsyncMock(side_effect=[RuntimeError('telegram down')])
+        chunks = [[{'id': 1, 'text': 'a'}, {'id': 2, 'text': 'b'}], [{'id': 3, 'text': 'c'}, {'id': 4, 'text': 'd'}]]
+        batch = {'chat_ref': 'chan', 'chat_info': {'username': 'chan'}, 'title': 'Chan',
+                 'target_chat': '@report', 'chunks': chunks}
+        batch = asyncio.run(agent._summarize_chat(batch))
+        asyncio.run(agent._send_chat_summaries(batch))
+        self.assertEqual(self.prompts, [1, 3])
+
+        # Next run: chunk 1 is only re-sent, chunk 2 is summarized from the stored messages
+        self.llm_down = False
+        agent.mcp_client.send_message = AsyncMock(return_value={'message_id': 99})
+        asyncio.run(agent._resume_outbox())
+        self.assertEqual(self.prompts, [1, 3, 3])
+        sent = [call.args[1] for call in agent.mcp_client.send_message.call_args_list]
+        self.assertEqual(len(sent), 2)
+        self.assertTrue(sent[0].startswith('🧠 Сводка #1/2'))
+        self.assertIsNone(agent.state_store.outbox_pending() or None)
+
+        # The same chunks fetched again are not summarized or sent twice
+        again = asyncio.run(agent._summarize_chat(dict(batch, outgoing=None, chunks=chunks)))
+        self.assertEqual(again['outgoing'], [])
+        agent.state_store.close()
+
+    def test_chat_digest_sends_one_message_per_chat(self):
+        agent = self._agent()
+        self.llm_down = False
+        agent.digest_mode = 'chat'
+        reduced = []
+
+        async def fake_reduce(summaries, source_title=None, chat=None):
+            reduced.append(list(summaries))
+            return ' + '.join(summaries)
+
+        agent.reduce_summaries = fake_reduce
+        agent.mcp_client.send_message = AsyncMock(return_value={'message_id': 7})
+        chunks = [[{'id': 1, 'text': 'a'}], [{'id': 2, 'text': 'b'}], [{'id': 3, 'text': 'c'}]]
+        batch = {'chat_ref': 'chan', 'chat_info': {'username': 'chan'}, 'title': 'Chan',
+                 'target_chat': '@report', 'chunks': chunks}
+        batch = asyncio.run(agent._summarize_chat(batch))
+        asyncio.run(agent._send_chat_summaries(batch))
+        self.assertEqual(reduced, [['summary 1', 'summary 2', 'summary 3']])
+        agent.mcp_client.send_message.assert_awaited_once()
+        text = agent.mcp_client.send_message.call_args.args[1]
+        self.assertTrue(text.startswith('🧠 Дайджест для Chan (3 сводок)'))
+        self.assertLessEqual(len(text), 4096)
+        self.assertIsNone(agent.state_store.outbox_pending() or None)
+        agent.state_store.close()
+
+    def test_run_digest_merges_chats(self):
+        agent = self._agent()
+        agent.digest_mode = 'run'
+
+        async def fake_reduce(summaries, source_title=None, chat=None):
+            return ' | '.join(summaries)
+
+        agent.reduce_summaries = fake_reduce
+        agent.mcp_client.send_message = AsyncMock(return_value={'message_id': 8})
+        batches = [
+            {'chat_ref': ref, 'title': ref.title(), 'target_chat': ref, 'digest': f'digest {ref}',
+             'outgoing': [{'label': 'Digest', 'text': '', 'outbox_ids': []}]}
+            for ref in ('alpha', 'beta')
+        ]
+        asyncio.run(agent._send_run_digest(batches))
+        target, text = agent.mcp_client.send_message.call_args.args
+        self.assertEqual(target, '@report')
+        self.assertIn('Alpha:\ndigest alpha | Beta:\ndigest beta', text)
+        agent.state_store.close()
+
+    def test_rereduce_reuses_stored_groups_without_llm_cache(self):
+        agent = self._agent()
+        agent.digest_fanin = 2
+        agent.digest_max_chars = 3500
+        reduced = []
+
+        async def fake_complete(messages, **kwargs):
+            reduced.append(messages[1]['content'])
+            return f"merged {len(reduced)}"
+
+        agent._llm_complete = fake_complete
+        summaries = [f"summary {i}" for i in range(4)]
+        asyncio.run(agent.reduce_summaries(summaries, 'Chan', chat='chan'))
+        self.assertEqual(len(reduced), 3)
+
+        # A failed digest is retried with one more chunk: the stored groups are reused, only the
+        # new top group (earlier result + the new summary) goes to the LLM
+        asyncio.run(agent.reduce_summaries(summaries + ['summary 4'], 'Chan', chat='chan'))
+        self.assertEqual(len(reduced), 4)
+        self.assertIn('merged 3', reduced[3])
+        self.assertIn('summary 4', reduced[3])
+        agent.state_store.close()
+
+    def test_rolling_summary_threads_state_through_runs(self):
+        agent = self._agent()
+        agent.rolling_summary_enabled = True
+        seen_states = []
+
+        async def fake_with_state(state, messages, source_title=None, source_username=None):
+            seen_states.append(state)
+            ids = ','.join(str(m['id']) for m in messages)
+            return f"{state or ''}[{ids}]", f"new in {ids}"
+
+        agent.summarize_with_state = fake_with_state
+        agent.mcp_client.send_message = AsyncMock(return_value={'message_id': 5})
+        batch = {'chat_ref': 'chan', 'chat_info': {'username': 'chan'}, 'title': 'Chan',
+                 'target_chat': '@report', 'chunks': [[{'id': 1, 'text': 'a'}], [{'id': 2, 'text': 'b'}]]}
+        batch = asyncio.run(agent._summarize_chat(batch))
+        asyncio.run(agent._send_chat_summaries(batch))
+        # Next run only sends the previous state with the new messages
+        batch2 = dict(batch, outgoing=None, chunks=[[{'id': 3, 'text': 'c'}]])
+        asyncio.run(agent._send_chat_summaries(asyncio.run(agent._summarize_chat(batch2))))
+        self.assertEqual(seen_states, [None, '[1]', '[1][2]'])
+        saved = agent.state_store.rolling_summary('chan')
+        self.assertEqual((saved['summary'], saved['last_id'], saved['updates']), ('[1][2][3]', 3, 3))
+        sent = [call.args[1] for call in agent.mcp_client.send_message.call_args_list]
+        self.assertEqual(sent[-1], '🧠 Сводка #1/1 для Chan:\n\nnew in 3')
+        agent.state_store.close()
+
+    def test_rolling_summary_stops_at_failed_chunk(self):
+        agent = self._agent()
+        agent.rolling_summary_enabled = True
+        calls = []
+        fail = {2}
+
+        async def fake_with_state(state, messages, source_title=None, source_username=None):
+            mid = messages[0]['id']
+            calls.append(mid)
+            if mid in fail:
+                raise RuntimeError('llm down')
+            return f"{state or ''}[{mid}]", f"new in {mid}"
+
+        agent.summarize_with_state = fake_with_state
+        agent.mcp_client.send_message = AsyncMock(return_value={'message_id': 5})
+        batch = {'chat_ref': 'chan', 'chat_info': {'username': 'chan'}, 'title': 'Chan', 'target_chat': '@report',
+                 'chunks': [[{'id': 1, 'text': 'a'}], [{'id': 2, 'text': 'b'}], [{'id': 3, 'text': 'c'}]]}
+        asyncio.run(agent._send_chat_summaries(asyncio.run(agent._summarize_chat(batch))))
+        # Chunk 3 is not summarized against a state that misses chunk 2, and keeps all its attempts
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(agent.state_store.rolling_summary('chan')['summary'], '[1]')
+        pending = {r['idx']: r for r in agent.state_store.outbox_pending()}
+        self.assertEqual(sorted(pending), [2, 3])
+        self.assertEqual(agent.state_store._outbox_rows("idx = 3", ())[0]['attempts'], 0)
+
+        fail.clear()
+        asyncio.run(agent._resume_outbox())
+        self.assertEqual(calls, [1, 2, 2, 3])
+        self.assertEqual(agent.state_store.rolling_summary('chan')['summary'], '[1][2][3]')
+        agent.state_store.close()
+
+class TestLlmCacheInAgent(unittest.TestCase):
+    def test_repeated_low_temperature_calls_hit_cache(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        agent = make_agent(llm_cache=LlmCache(os.path.join(tmp.name, 'cache.sqlite')))
+        usecase = Mock()
+        usecase.complete = AsyncMock(return_value=' {"sentiment": "positive"} ')
+        agent.get_llm_client = Mock(return_value=(usecase, 'deepseek-chat', None))
+
+        first = asyncio.run(agent.analyze_sentiment_and_intent({'text': 'Great news!'}))
+        # A forwarded copy of the same text is answered from the cache
+        second = asyncio.run(agent.analyze_sentiment_and_intent({'text': 'Great news!'}))
+        self.assertEqual(first, second)
+        self.assertEqual(usecase.complete.await_count, 1)
+        self.assertEqual(agent.llm_cache.stats['hits'], 1)
+
+        # Non-deterministic temperatures always go to the provider
+        for _ in range(2):
+            asyncio.run(agent._llm_complete([{'role': 'user', 'content': 'hi'}], max_tokens=10, temperature=0.9))
+        self.assertEqual(usecase.complete.await_count, 3)
+        self.assertEqual(agent.llm_cache.stats['bypassed'], 2)
+        agent.llm_cache.close()
+
+    def test_failover_answer_cached_under_serving_provider(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        agent = make_agent(
+            llm_cache=LlmCache(os.path.join(tmp.name, 'cache.sqlite')),
+            _llm_providers=Mock(return_value=[('deepseek', Mock(), 'deepseek-chat'), ('yandex', Mock(), 'yandexgpt')]),
+            llm_resilience=Mock(),
+        )
+        agent.llm_resilience.complete = AsyncMock(return_value=('from yandex', 'yandex'))
+        messages = [{'role': 'user', 'content': 'hi'}]
+
+        for _ in range(2):
+            asyncio.run(agent._llm_complete(messages, max_tokens=10, temperature=0.2))
+        # Not served from the DeepSeek entry: the answer is stored under the Yandex key
+        self.assertEqual(agent.llm_resilience.complete.await_count, 2)
+        key = make_cache_key('yandex', 'yandexgpt', messages, 10, 0.2)
+        self.assertEqual(agent.llm_cache.get(key), 'from yandex')
+        agent.llm_cache.close()
+
 if __name__ == "__main__":
     unittest.main()
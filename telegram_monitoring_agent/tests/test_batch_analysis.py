@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for batched message analysis
+"""
+
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, Mock
+
+from src.batch_analysis import normalize_analysis, repair_json, results_by_id
+from tests.helpers import make_agent
+
+
+class TestRepairJson(unittest.TestCase):
+    def test_plain_and_fenced(self):
+        self.assertEqual(repair_json('[{"id": 1}]'), [{"id": 1}])
+        self.assertEqual(repair_json('Вот результат:\n```json\n[{"id": 1},]\n```\nГотово.'), [{"id": 1}])
+
+    def test_truncated_array_drops_partial_item(self):
+        reply = '[{"id": 1, "topics": ["ai"]}, {"id": 2, "topics": ["ll'
+        self.assertEqual(repair_json(reply), [{"id": 1, "topics": ["ai"]}])
+
+    def test_truncated_object_is_closed(self):
+        self.assertEqual(repair_json('{"sentiment": "positive", "intent": "que'),
+                         {"sentiment": "positive", "intent": "que"})
+
+    def test_python_literals(self):
+        self.assertEqual(repair_json("[{'id': 1, 'urgent': true, 'x': None}]"), [{"id": 1, "urgent": True, "x": None}])
+
+    def test_no_json(self):
+        with self.assertRaises(ValueError):
+            repair_json("не могу ответить")
+
+
+class TestResultsById(unittest.TestCase):
+    def test_normalizes_and_maps(self):
+        parsed = [{"id": "2", "sentiment": "POSITIVE", "intent": "praise", "confidence": 3, "topics": "ai"},
+                  {"id": 9, "sentiment": "positive"},
+                  {"id": 1, "sentiment": "angry", "intent": "?", "entities": ["OpenAI", {"x": 1}]}]
+        out = results_by_id(parsed, 2)
+        self.assertEqual(sorted(out), [1, 2])
+        self.assertEqual(out[2]["sentiment"], "positive")
+        self.assertEqual(out[2]["confidence"], 1.0)
+        self.assertEqual(out[2]["topics"], ["ai"])
+        self.assertEqual((out[1]["sentiment"], out[1]["intent"]), ("neutral", "other"))
+        self.assertEqual(out[1]["entities"], ["OpenAI"])
+
+    def test_wrapped_and_single(self):
+        self.assertEqual(sorted(results_by_id({"results": [{"id": 1}, {"id": 2}]}, 2)), [1, 2])
+        single = {"sentiment": "negative", "entities": ["OpenAI"]}
+        self.assertEqual(results_by_id(single, 1)[1], normalize_analysis(single))
+
+
+class TestAnalyzeMessages(unittest.TestCase):
+    def _agent(self, replies):
+        agent = make_agent()
+        self.usecase = Mock()
+        self.usecase.complete = AsyncMock(side_effect=replies)
+        agent.get_llm_client = Mock(return_value=(self.usecase, 'deepseek-chat', None))
+        return agent
+
+    def test_page_costs_a_few_calls(self):
+        def reply(messages, **kwargs):
+            count = messages[0]['content'].count('\n[')
+            return '[' + ','.join(f'{{"id": {n}, "sentiment": "positive", "intent": "statement"}}'
+                                  for n in range(1, count + 1)) + ']'
+
+        agent = self._agent(None)
+        self.usecase.complete = AsyncMock(side_effect=reply)
+        messages = [{'id': 100 + i, 'text': f'message number {i}'} for i in range(100)]
+        results = asyncio.run(agent.analyze_messages(messages))
+        self.assertEqual(self.usecase.complete.await_count, 4)
+        self.assertEqual([r['id'] for r in results], [m['id'] for m in messages])
+        self.assertTrue(all(r['sentiment'] == 'positive' for r in results))
+
+    def test_missing_results_are_retried_then_fall_back(self):
+        agent = self._agent([
+            '[{"id": 1, "sentiment": "negative", "intent": "complaint"}]',
+            'sorry',
+        ])
+        results = asyncio.run(agent.analyze_messages(
+            [{'id': 1, 'text': 'broken again'}, {'id': 2, 'text': ''}, {'id': 3, 'text': 'when is the release?'}]
+        ))
+        self.assertEqual(self.usecase.complete.await_count, 2)
+        self.assertEqual(results[0]['intent'], 'complaint')
+        self.assertEqual(results[1]['intent'], 'unknown')
+        self.assertEqual((results[2]['intent'], results[2]['confidence']), ('question', 0))
+
+
+    def test_single_analysis_always_returns_dict(self):
+        agent = self._agent(['[{"sentiment": "negative", "intent": "complaint", "confidence": 0.9}]',
+                             '["positive", "praise"]'])
+        first = asyncio.run(agent.analyze_sentiment_and_intent({'text': 'broken again'}))
+        self.assertEqual((first['sentiment'], first['intent'], first['path']), ('negative', 'complaint', 'llm'))
+        # A list without result objects falls back to keyword matching
+        second = asyncio.run(agent.analyze_sentiment_and_intent({'text': 'love it'}))
+        self.assertEqual((second['sentiment'], second['path']), ('positive', 'fallback'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Tests for token-budget chunking
+"""
+
+import unittest
+
+from src.chunking import estimate_tokens, message_tokens, pack_messages, split_message
+
+
+class TestChunking(unittest.TestCase):
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("hello world"), 4)
+        self.assertEqual(estimate_tokens("GPT-5, 2025!"), 7)
+        # Cyrillic words are split into more tokens than Latin words of the same length
+        self.assertGreater(estimate_tokens("нейросеть"), estimate_tokens("networks"))
+
+    def test_short_messages_share_one_chunk(self):
+        messages = [{'id': i, 'text': 'short news line', 'from': {'display': 'bot'}} for i in range(1, 41)]
+        chunks = pack_messages(messages, budget=3000)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(len(pack_messages(messages, budget=3000, max_messages=12)), 4)
+
+    def test_long_messages_fill_budget(self):
+        post = {'text': ' '.join(['word'] * 300), 'from': {'display': 'chan'}}
+        messages = [dict(post, id=i) for i in range(1, 11)]
+        chunks = pack_messages(messages, budget=1000)
+        self.assertTrue(all(sum(message_tokens(m) for m in c) <= 1000 for c in chunks))
+        self.assertEqual([m['id'] for c in chunks for m in c], list(range(1, 11)))
+        self.assertEqual(len(chunks), 4)
+
+    def test_oversized_message_is_split(self):
+        paragraphs = ["Параграф номер {} с текстом новости.".format(i) * 10 for i in range(8)]
+        huge = {'id': 7, 'text': "\n\n".join(paragraphs), 'from': {'display': 'chan'}}
+        parts = split_message(huge, budget=200)
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(message_tokens(p) <= 200 for p in parts))
+        self.assertEqual([p['part'] for p in parts], list(range(1, len(parts) + 1)))
+        self.assertEqual("\n\n".join(p['text'] for p in parts), huge['text'])
+        chunks = pack_messages([huge], budget=200)
+        self.assertEqual(sum(len(c) for c in chunks), len(parts))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for map-reduce digests
+"""
+
+import asyncio
+import unittest
+
+from src.digest import fit_message, reduce_tree
+
+
+class TestReduceTree(unittest.TestCase):
+    def _reducer(self):
+        calls, cache = [], {}
+
+        async def reduce_fn(group):
+            key = tuple(group)
+            if key not in cache:
+                calls.append(key)
+                cache[key] = "(" + "+".join(group) + ")"
+            return cache[key]
+
+        return calls, reduce_fn
+
+    def test_merges_level_by_level(self):
+        calls, reduce_fn = self._reducer()
+        result = asyncio.run(reduce_tree(["a", "b", "c", "d", "e"], reduce_fn, fanin=2))
+        self.assertEqual(result, "(((a+b)+(c+d))+e)")
+        self.assertEqual(len(calls), 4)
+
+    def test_single_and_empty(self):
+        calls, reduce_fn = self._reducer()
+        self.assertEqual(asyncio.run(reduce_tree([" only "], reduce_fn)), "only")
+        self.assertEqual(asyncio.run(reduce_tree(["", None], reduce_fn)), "")
+        self.assertEqual(calls, [])
+
+    def test_new_chunk_only_rereduces_its_path(self):
+        calls, reduce_fn = self._reducer()
+        items = [f"s{i}" for i in range(8)]
+        asyncio.run(reduce_tree(items, reduce_fn, fanin=2))
+        self.assertEqual(len(calls), 7)
+        del calls[:]
+        asyncio.run(reduce_tree(items + ["s8"], reduce_fn, fanin=2))
+        # Earlier groups are unchanged (cache hits); only the new top levels are computed
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][1], "s8")
+
+
+class TestFitMessage(unittest.TestCase):
+    def test_short_text_untouched(self):
+        self.assertEqual(fit_message("  hello  "), "hello")
+
+    def test_cuts_at_break(self):
+        text = "\n\n".join(["x" * 1000] * 6)
+        fitted = fit_message(text, 4096)
+        self.assertLessEqual(len(fitted), 4096)
+        self.assertTrue(fitted.endswith("x…"))
+        self.assertEqual(fitted.count("\n\n"), 3)
+
+    def test_cuts_unbroken_text(self):
+        fitted = fit_message("y" * 5000, 100)
+        self.assertEqual(len(fitted), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
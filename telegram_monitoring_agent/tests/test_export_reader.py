@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for reading tg.export_history files
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from src.export_reader import iter_exported_messages
+
+
+def _msg(i: int) -> dict:
+    return {'id': i, 'text': f'message {i}', 'date': None, 'from': {'id': 1, 'display': 'user'}}
+
+
+class TestExportReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_jsonl_gz_multiple_members_and_min_id(self):
+        path = os.path.join(self.tmp.name, 'chat.jsonl.gz')
+        # Two appends produce two gzip members, as the exporter does per batch
+        for batch in ([1, 2, 3], [4, 5]):
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                for i in batch:
+                    f.write(json.dumps(_msg(i)) + '\n')
+        ids = [m['id'] for m in iter_exported_messages(path, min_id=2)]
+        self.assertEqual(ids, [3, 4, 5])
+
+    def test_jsonl_batch_rewritten_after_crash_is_read_once(self):
+        path = os.path.join(self.tmp.name, 'chat.jsonl.gz')
+        # The cursor was saved after [1, 2] only, so the resumed export wrote [3, 4] again
+        for batch in ([1, 2], [3, 4], [3, 4, 5]):
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                for i in batch:
+                    f.write(json.dumps(_msg(i)) + '\n')
+        self.assertEqual([m['id'] for m in iter_exported_messages(path)], [1, 2, 3, 4, 5])
+
+    def test_sqlite(self):
+        path = os.path.join(self.tmp.name, 'chat.sqlite')
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, date TEXT, from_id INTEGER, sender TEXT, text TEXT)")
+        conn.executemany("INSERT INTO messages VALUES (?,?,?,?,?)", [(2, None, 1, 'bob', 'b'), (1, None, 1, 'bob', 'a')])
+        conn.commit()
+        conn.close()
+        msgs = list(iter_exported_messages(path))
+        self.assertEqual([m['id'] for m in msgs], [1, 2])
+        self.assertEqual(msgs[0]['from']['display'], 'bob')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for the local lexicon fast-path classifier
+"""
+
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, Mock
+
+from src.lexicon_classifier import LexiconClassifier
+from tests.helpers import make_agent
+
+
+class TestLexiconClassifier(unittest.TestCase):
+    def setUp(self):
+        self.clf = LexiconClassifier(threshold=0.8)
+
+    def _labels(self, text):
+        res = self.clf.classify(text)
+        return res.sentiment, res.intent, self.clf.confident(res)
+
+    def test_trivial_messages_are_confident(self):
+        self.assertEqual(self._labels("Спасибо, очень полезно!"), ("positive", "praise", True))
+        self.assertEqual(self._labels("👍🔥"), ("positive", "praise", True))
+        self.assertEqual(self._labels("https://t.me/prog_tools/123"), ("neutral", "statement", True))
+        self.assertEqual(self._labels("Когда релиз?"), ("neutral", "question", True))
+        self.assertEqual(self._labels("/digest"), ("neutral", "command", True))
+        self.assertEqual(self._labels("Опять не работает"), ("negative", "complaint", True))
+        self.assertEqual(self._labels("подскажите библиотеку для RAG"), ("neutral", "request", True))
+
+    def test_negation_flips_polarity(self):
+        self.assertEqual(self.clf.classify("это не хорошо").sentiment, "negative")
+        self.assertEqual(self.clf.classify("not bad").sentiment, "positive")
+
+    def test_long_or_mixed_messages_go_to_llm(self):
+        post = ("Сегодня OpenAI представила новую модель, которая по бенчмаркам обходит предыдущие версии "
+                "на двадцать процентов в задачах рассуждения и программирования")
+        self.assertFalse(self.clf.confident(self.clf.classify(post)))
+        self.assertFalse(self.clf.confident(self.clf.classify("Модель отличная, но API ужасно медленный")))
+
+    def test_guesses_without_a_signal_stay_below_threshold(self):
+        self.assertEqual(self._labels("Завтра выкатим обновление"), ("neutral", "statement", False))
+        self.assertEqual(self._labels("Do not use this library"), ("neutral", "statement", False))
+        self.assertEqual(self._labels("Will ship it tomorrow"), ("neutral", "statement", False))
+        self.assertEqual(self._labels("Как я и говорил, релиз в пятницу"), ("neutral", "question", False))
+
+    def test_exclamation_is_not_a_question(self):
+        self.assertEqual(self._labels("Как же круто!"), ("positive", "praise", True))
+
+    def test_whole_word_match_for_english_and_short_words(self):
+        self.assertEqual(self.clf.classify("goodbye everyone").sentiment, "neutral")
+        self.assertEqual(self.clf.classify("badge unlocked").sentiment, "neutral")
+        self.assertEqual(self.clf.classify("без проблем").sentiment, "positive")
+        self.assertEqual(self.clf.classify("проблемы с оплатой").sentiment, "negative")
+
+    def test_batch_matches_single(self):
+        texts = ["круто", "why?", None, "так себе релиз, много багов и проблем, хотя есть и хорошие идеи"]
+        self.assertEqual(self.clf.classify_batch(texts), [self.clf.classify(t) for t in texts])
+
+
+class TestFastPathInAgent(unittest.TestCase):
+    def test_only_uncertain_messages_reach_llm(self):
+        agent = make_agent(lexicon=LexiconClassifier(0.8))
+        usecase = Mock()
+        usecase.complete = AsyncMock(return_value='[{"id": 1, "sentiment": "negative", "intent": "complaint"}]')
+        agent.get_llm_client = Mock(return_value=(usecase, 'deepseek-chat', None))
+
+        long_post = "Модель отличная, но API ужасно медленный и документация устарела, пришлось всё переписывать"
+        messages = [{'id': 1, 'text': 'спасибо!'}, {'id': 2, 'text': 'https://example.com/post'},
+                    {'id': 3, 'text': long_post}]
+        results = asyncio.run(agent.analyze_messages(messages))
+        self.assertEqual([r['path'] for r in results], ['lexicon', 'lexicon', 'llm'])
+        self.assertEqual(usecase.complete.await_count, 1)
+        self.assertIn('[1] Модель', usecase.complete.call_args.args[0][0]['content'])
+        self.assertEqual(agent.analysis_stats['lexicon'], 2)
+        self.assertEqual(agent.analysis_stats['llm'], 1)
+
+        # Routine traffic needs no LLM at all
+        single = asyncio.run(agent.analyze_sentiment_and_intent({'text': 'Когда релиз?'}))
+        self.assertEqual((single['intent'], single['path']), ('question', 'lexicon'))
+        self.assertEqual(usecase.complete.await_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for the on-disk LLM completion cache
+"""
+
+import os
+import tempfile
+import time
+import unittest
+
+from src.llm_cache import LlmCache, make_cache_key
+
+
+class TestLlmCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key_depends_on_request_not_whitespace(self):
+        msgs = [{'role': 'user', 'content': 'Message: hello'}]
+        key = make_cache_key('deepseek', 'deepseek-chat', msgs, 100, 0.2)
+        self.assertEqual(key, make_cache_key('DeepSeek', 'deepseek-chat',
+                                             [{'role': 'user', 'content': 'Message: hello \n'}], 100, 0.2))
+        self.assertNotEqual(key, make_cache_key('deepseek', 'deepseek-chat', msgs, 200, 0.2))
+        self.assertNotEqual(key, make_cache_key('yandex', 'yandex', msgs, 100, 0.2))
+
+    def test_hit_miss_and_ttl(self):
+        cache = LlmCache(self.path, ttl_sec=60)
+        self.assertIsNone(cache.get('k'))
+        cache.put('k', 'answer')
+        self.assertEqual(cache.get('k'), 'answer')
+        with cache._lock, cache._conn:
+            cache._conn.execute("UPDATE completions SET created = ?", (time.time() - 120,))
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual((cache.stats['hits'], cache.stats['misses'], cache.stats['evicted']), (1, 2, 1))
+        cache.close()
+
+    def test_lru_eviction_by_count_and_size(self):
+        cache = LlmCache(self.path, max_entries=2)
+        cache.put('a', 'A')
+        cache.put('b', 'B')
+        cache.get('a')  # 'b' becomes least recently used
+        time.sleep(0.01)
+        cache.put('c', 'C')
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertIsNone(cache.get('b'))
+        cache.close()
+
+        cache = LlmCache(os.path.join(self.tmp.name, 'size.sqlite'), max_bytes=10)
+        cache.put('x', '12345')
+        cache.put('y', '1234567')
+        self.assertIsNone(cache.get('x'))
+        self.assertEqual(cache.get('y'), '1234567')
+        cache.close()
+
+    def test_temperature_bypass(self):
+        cache = LlmCache(self.path, max_temperature=0.5)
+        self.assertTrue(cache.cacheable(0.2))
+        self.assertFalse(cache.cacheable(0.7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Tests for LLM retries, circuit breakers, failover and hedging
+"""
+
+import asyncio
+import unittest
+
+from src.llm_resilience import CircuitBreaker, ResilientLlm
+from src.llm_usecase import LlmHttpError, LlmUseCase, parse_retry_after
+
+
+class _Scripted(LlmUseCase):
+    """Use case that plays back a list of results (exceptions are raised), optionally after a delay."""
+
+    def __init__(self, script, delay=0.0):
+        super().__init__()
+        self.script = list(script)
+        self.delay = delay
+        self.calls = 0
+
+    async def complete(self, messages, **kwargs):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        item = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+
+class TestResilientLlm(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.llm = ResilientLlm(retries=2, backoff_base_sec=1, backoff_max_sec=10, breaker_failures=3)
+
+        async def fake_sleep(delay):
+            self.sleeps.append(delay)
+
+        self.llm._sleep = fake_sleep
+
+    def _run(self, providers):
+        return asyncio.run(self.llm.complete(providers, [{'role': 'user', 'content': 'hi'}]))
+
+    def test_retry_honours_retry_after(self):
+        deepseek = _Scripted([LlmHttpError("rate limited", 429, retry_after=7), "ok"])
+        self.assertEqual(self._run([('deepseek', deepseek, 'm')]), ("ok", 'deepseek'))
+        self.assertEqual(deepseek.calls, 2)
+        self.assertGreaterEqual(self.sleeps[0], 7)
+        self.assertEqual(self.llm.metrics['deepseek']['retries'], 1)
+
+    def test_failover_after_retries_exhausted(self):
+        deepseek = _Scripted([LlmHttpError("down", 503)])
+        yandex = _Scripted(["from yandex"])
+        text, served = self._run([('deepseek', deepseek, 'm'), ('yandex', yandex, 'yandex')])
+        self.assertEqual((text, served), ("from yandex", 'yandex'))
+        self.assertEqual(deepseek.calls, 3)
+        self.assertEqual(self.llm.metrics['yandex']['served'], 1)
+        self.assertEqual(self.llm.metrics['yandex']['failovers'], 1)
+        # Three consecutive failures opened the DeepSeek breaker: the next call goes straight to Yandex
+        self.assertEqual(self.llm.breaker('deepseek').state, 'open')
+        self._run([('deepseek', deepseek, 'm'), ('yandex', yandex, 'yandex')])
+        self.assertEqual(deepseek.calls, 3)
+
+    def test_non_retryable_and_long_retry_after_fail_over_at_once(self):
+        bad_request = _Scripted([LlmHttpError("bad request", 400)])
+        yandex = _Scripted(["ok"])
+        self.assertEqual(self._run([('deepseek', bad_request, 'm'), ('yandex', yandex, 'y')])[1], 'yandex')
+        self.assertEqual(bad_request.calls, 1)
+
+        throttled = _Scripted([LlmHttpError("quota", 429, retry_after=600)])
+        self.assertEqual(self._run([('deepseek2', throttled, 'm'), ('yandex', yandex, 'y')])[1], 'yandex')
+        self.assertEqual(throttled.calls, 1)
+        self.assertEqual(self.llm.breaker('deepseek2').state, 'open')
+        self.assertEqual(self.sleeps, [])
+
+    def test_all_failed_raises_last_error(self):
+        with self.assertRaises(LlmHttpError):
+            self._run([('deepseek', _Scripted([LlmHttpError("down", 500)]), 'm')])
+
+    def test_hedged_request_wins_over_slow_primary(self):
+        self.llm.hedge = True
+        self.llm.hedge_after_sec = 0.05
+        slow = _Scripted(["slow"], delay=1.0)
+        fast = _Scripted(["fast"])
+        self.assertEqual(self._run([('deepseek', slow, 'm'), ('yandex', fast, 'y')]), ("fast", 'yandex'))
+        self.assertEqual(self.llm.metrics['deepseek']['hedges'], 1)
+        self.assertEqual(self.llm.metrics['yandex']['hedge_wins'], 1)
+
+    def test_probe_with_non_retryable_error_frees_breaker(self):
+        deepseek = _Scripted([LlmHttpError("bad request", 400), "recovered"])
+        br = self.llm.breaker('deepseek')
+        br.reset_timeout = 0
+        br.trip()
+        self.assertEqual(br.state, 'half_open')
+        with self.assertRaises(LlmHttpError):
+            self._run([('deepseek', deepseek, 'm')])
+        # The failed probe released its slot: the next call probes again and closes the breaker
+        self.assertEqual(self._run([('deepseek', deepseek, 'm')]), ("recovered", 'deepseek'))
+        self.assertEqual(br.state, 'closed')
+
+    def test_cancelled_probe_frees_breaker(self):
+        slow = _Scripted(["late"], delay=10)
+        br = self.llm.breaker('deepseek')
+        br.reset_timeout = 0
+        br.trip()
+
+        async def cancel_probe():
+            task = asyncio.ensure_future(self.llm.complete([('deepseek', slow, 'm')], []))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_probe())
+        self.assertTrue(br.allow())
+
+    def test_non_probe_attempt_keeps_outstanding_probe(self):
+        provider = ('deepseek', _Scripted([LlmHttpError("bad request", 400)], delay=0.05), 'm')
+        hung = ('deepseek', _Scripted(["late"], delay=10), 'm')
+        br = self.llm.breaker('deepseek')
+        br.reset_timeout = 0
+
+        async def scenario():
+            # Both attempts start while the breaker is closed (e.g. a hedge backup)...
+            failing = asyncio.ensure_future(self.llm._attempt(provider, [], {}))
+            cancelled = asyncio.ensure_future(self.llm._attempt(hung, [], {}))
+            await asyncio.sleep(0)
+            br.trip()
+            self.assertTrue(br.allow())  # ...and another call takes the half-open probe
+            with self.assertRaises(LlmHttpError):
+                await failing
+            cancelled.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await cancelled
+
+        asyncio.run(scenario())
+        self.assertFalse(br.allow())
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_half_open_probe(self):
+        br = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        br.record_failure()
+        self.assertTrue(br.allow())      # half-open: one probe
+        self.assertFalse(br.allow())
+        br.record_success()
+        self.assertEqual(br.state, 'closed')
+
+    def test_end_probe_needs_current_token(self):
+        br = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        br.record_failure()
+        stale = br.admit()
+        br.trip()
+        probe = br.admit()
+        self.assertIsNone(br.admit())
+        br.end_probe(stale)
+        br.end_probe(0)
+        self.assertIsNone(br.admit())
+        br.end_probe(probe)
+        self.assertIsNotNone(br.admit())
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("12"), 12.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(parse_retry_after(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared LLM client registry
+"""
+
+import asyncio
+import unittest
+
+from src.deepseek_usecase import DeepSeekUseCase
+from src.llm_resolver import LlmRegistry
+from src.yandexgpt_usecase import YandexGptUseCase
+
+
+class TestLlmRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = LlmRegistry()
+
+    def tearDown(self):
+        self.registry.close()
+
+    def test_usecases_are_created_once(self):
+        deepseek = self.registry.get('deepseek')
+        self.assertIsInstance(deepseek, DeepSeekUseCase)
+        self.assertIs(self.registry.get('DeepSeek'), deepseek)
+        yandex = self.registry.get('yandex')
+        self.assertIsInstance(yandex, YandexGptUseCase)
+        self.assertIs(self.registry.get('yandexgpt'), yandex)
+
+    def test_session_shared_within_loop_and_closed_on_aclose(self):
+        async def _run():
+            first = self.registry.session()
+            self.assertIs(self.registry.session(), first)
+            async with self.registry.get('deepseek')._session() as s:
+                self.assertIs(s, first)
+            await self.registry.aclose()
+            self.assertTrue(first.closed)
+            return first
+
+        closed = asyncio.run(_run())
+        self.assertTrue(closed.closed)
+
+    def test_each_loop_gets_its_own_session(self):
+        async def _session():
+            return self.registry.session()
+
+        loop_a, loop_b = asyncio.new_event_loop(), asyncio.new_event_loop()
+        try:
+            a = loop_a.run_until_complete(_session())
+            b = loop_b.run_until_complete(_session())
+            self.assertIsNot(a, b)
+            self.assertEqual(a.connector.limit, self.registry.limit)
+            self.assertEqual(a.connector.limit_per_host, self.registry.limit_per_host)
+            self.registry.close()
+            self.assertTrue(a.closed and b.closed)
+        finally:
+            loop_a.close()
+            loop_b.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
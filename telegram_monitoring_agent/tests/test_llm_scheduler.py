@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for the LLM call scheduler (budgets, priorities, fairness)
+"""
+
+import asyncio
+import unittest
+
+from src.llm_scheduler import LlmScheduler, RateWindow, estimate_request_tokens
+
+
+class TestRateWindow(unittest.TestCase):
+    def test_rpm_budget(self):
+        window = RateWindow(rpm=2)
+        self.assertEqual(window.reserve(10, now=0), 0)
+        self.assertEqual(window.reserve(10, now=1), 0)
+        self.assertAlmostEqual(window.reserve(10, now=2), 58)
+        self.assertEqual(window.reserve(10, now=60), 0)
+        self.assertEqual(window.usage(now=60), (2, 20))
+
+    def test_tpm_budget(self):
+        window = RateWindow(tpm=100)
+        self.assertEqual(window.reserve(60, now=0), 0)
+        self.assertAlmostEqual(window.reserve(60, now=1), 59)
+        self.assertEqual(window.reserve(40, now=1), 0)
+        # A request bigger than the whole budget runs alone in an empty window
+        self.assertEqual(RateWindow(tpm=100).reserve(150, now=0), 0)
+
+    def test_estimate_request_tokens(self):
+        msgs = [{'role': 'user', 'content': 'x' * 400}]
+        self.assertEqual(estimate_request_tokens(msgs), 104)
+        self.assertEqual(estimate_request_tokens(msgs, max_tokens=100), 204)
+
+
+class TestLlmScheduler(unittest.TestCase):
+    def _order(self, requests):
+        """Admit ``requests`` = [(priority, chat)] behind one running call; return the start order."""
+        order = []
+
+        async def _run():
+            scheduler = LlmScheduler({}, max_concurrency=1)
+            await scheduler.acquire('deepseek', 1, 'summary', 'busy')
+
+            async def _call(idx, priority, chat):
+                async with scheduler.slot('deepseek', 1, priority, chat):
+                    order.append(idx)
+                    await asyncio.sleep(0)
+
+            tasks = [asyncio.create_task(_call(i, p, c)) for i, (p, c) in enumerate(requests)]
+            await asyncio.sleep(0)
+            scheduler.release()
+            await asyncio.gather(*tasks)
+            return scheduler
+
+        return order, asyncio.run(_run())
+
+    def test_priority_classes(self):
+        order, scheduler = self._order([('analytics', None), ('summary', 'a'), ('interactive', None)])
+        self.assertEqual(order, [2, 1, 0])
+        self.assertEqual(scheduler.stats['interactive']['calls'], 1)
+
+    def test_fair_between_chats(self):
+        order, _ = self._order([('summary', 'a'), ('summary', 'a'), ('summary', 'a'), ('summary', 'b')])
+        self.assertEqual(order, [0, 3, 1, 2])
+
+    def test_budget_delays_calls(self):
+        async def _run():
+            window = RateWindow(rpm=1)
+            window.reserve(1)
+            scheduler = LlmScheduler({'deepseek': window}, max_concurrency=4)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(scheduler.acquire('deepseek', 1), 0.05)
+            # Cancelled waiters leave the queue; other providers are not limited
+            await asyncio.wait_for(scheduler.acquire('yandex', 1), 0.05)
+            self.assertEqual(scheduler.running, 1)
+
+        asyncio.run(_run())
+
+
+    def test_exhausted_provider_does_not_block_others(self):
+        async def _run():
+            window = RateWindow(rpm=1)
+            window.reserve(1)
+            scheduler = LlmScheduler({'deepseek': window, 'yandex': RateWindow(rpm=10)}, max_concurrency=4)
+            blocked = asyncio.ensure_future(scheduler.acquire('deepseek', 1, 'summary', 'a'))
+            await asyncio.sleep(0)
+            # Same class, queued behind the exhausted head waiter
+            await asyncio.wait_for(scheduler.acquire('yandex', 1, 'summary', 'b'), 0.05)
+            self.assertFalse(blocked.done())
+            blocked.cancel()
+
+        asyncio.run(_run())
+
+    def test_failover_moves_charge_to_serving_provider(self):
+        async def _run():
+            windows = {'deepseek': RateWindow(tpm=1000), 'yandex': RateWindow(tpm=1000)}
+            scheduler = LlmScheduler(windows)
+            async with scheduler.slot('deepseek', 300) as grant:
+                scheduler.charge_to(grant, 'yandex')
+            return windows['deepseek'].usage(), windows['yandex'].usage()
+
+        self.assertEqual(asyncio.run(_run()), ((0, 0), (1, 300)))
+
+if __name__ == '__main__':
+    unittest.main()
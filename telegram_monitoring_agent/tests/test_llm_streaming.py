@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Tests for streaming LLM completions
+"""
+
+import asyncio
+import json
+import os
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+
+from src.deepseek_usecase import DeepSeekUseCase
+from src.yandexgpt_usecase import YandexGptUseCase
+from tests.helpers import make_agent
+
+
+class _FakeResponse:
+    def __init__(self, lines):
+        self.status = 200
+        self.lines = lines
+        self.read = 0
+
+    @property
+    def content(self):
+        async def _iter():
+            for line in self.lines:
+                self.read += 1
+                yield line
+        return _iter()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _FakeSession:
+    def __init__(self, lines):
+        self.response = _FakeResponse(lines)
+        self.requests = []
+
+    def post(self, url, headers=None, json=None):
+        self.requests.append(json)
+        return self.response
+
+
+class TestProviderStreams(unittest.TestCase):
+    def _collect(self, usecase):
+        async def _run():
+            return [p async for p in usecase.complete_stream([{'role': 'user', 'content': 'hi'}])]
+        return asyncio.run(_run())
+
+    @patch.dict(os.environ, {'DEEPSEEK_API_KEY': 'key'})
+    def test_deepseek_sse(self):
+        events = [{'choices': [{'delta': {'role': 'assistant'}}]},
+                  {'choices': [{'delta': {'content': 'Hel'}}]},
+                  {'choices': [{'delta': {'content': 'lo'}}]}]
+        lines = [b': keep-alive\n', b'\n'] + [f"data: {json.dumps(e)}\n".encode() for e in events] + \
+                [b'data: [DONE]\n', b'data: {"choices": [{"delta": {"content": "late"}}]}\n']
+        session = _FakeSession(lines)
+        usecase = DeepSeekUseCase(session_factory=lambda: session)
+        self.assertEqual(self._collect(usecase), ['Hel', 'lo'])
+        self.assertTrue(session.requests[0]['stream'])
+
+    @patch.dict(os.environ, {'YANDEX_API_KEY': 'key', 'YANDEX_FOLDER_ID': 'folder'})
+    def test_yandex_cumulative_chunks(self):
+        chunks = ['При', 'Привет', 'Привет, мир']
+        lines = [json.dumps({'result': {'alternatives': [{'message': {'text': t}}]}}).encode() + b'\n' for t in chunks]
+        session = _FakeSession(lines)
+        usecase = YandexGptUseCase(session_factory=lambda: session)
+        self.assertEqual(self._collect(usecase), ['При', 'вет', ', мир'])
+        self.assertTrue(session.requests[0]['completionOptions']['stream'])
+
+
+    def test_credentials_read_per_request(self):
+        # The registry keeps one use case per process; keys set after it was created must be used
+        with patch.dict(os.environ, {}, clear=True):
+            deepseek, yandex = DeepSeekUseCase(), YandexGptUseCase()
+            with self.assertRaises(Exception):
+                deepseek._request([], False)
+        env = {'DEEPSEEK_API_KEY': 'new', 'YANDEX_IAM_TOKEN': 'iam', 'YANDEX_FOLDER_ID': 'f1'}
+        with patch.dict(os.environ, env, clear=True):
+            self.assertEqual(deepseek._request([], False)[0]['Authorization'], 'Bearer new')
+            headers, body = yandex._request([], False)
+        self.assertEqual(headers['Authorization'], 'Bearer iam')
+        self.assertEqual(body['modelUri'], 'gpt://f1/yandexgpt')
+
+
+class TestAgentStreaming(unittest.TestCase):
+    def _agent(self, pieces):
+        agent = make_agent()
+        self.closed = False
+
+        async def fake_stream(messages, **kwargs):
+            try:
+                for p in pieces:
+                    yield p
+            finally:
+                self.closed = True
+
+        usecase = Mock()
+        usecase.complete_stream = fake_stream
+        agent.get_llm_client = Mock(return_value=(usecase, 'deepseek-chat', None))
+        return agent
+
+    def test_runaway_generation_is_aborted(self):
+        agent = self._agent(['a' * 5] * 10)
+        agent.stream_max_chars = 12
+
+        async def _run():
+            return [p async for p in agent._llm_stream([{'role': 'user', 'content': 'x'}], 10, 0.2)]
+
+        self.assertEqual(len(asyncio.run(_run())), 3)
+        self.assertTrue(self.closed)
+
+    def test_message_sent_on_first_tokens_then_edited(self):
+        agent = self._agent(['Пер', 'вый ', 'пункт'])
+        agent.mcp_client = Mock()
+        agent.mcp_client.send_message = AsyncMock(return_value={'message_id': 42})
+        agent.mcp_client.edit_message = AsyncMock(return_value={'message_id': 42})
+
+        stream = agent._llm_stream([{'role': 'user', 'content': 'x'}], 10, 0.2)
+        message_id, text = asyncio.run(agent._send_streamed('@out', 'S: ', stream))
+        self.assertEqual((message_id, text), (42, 'Первый пункт'))
+        agent.mcp_client.send_message.assert_awaited_once_with('@out', 'S: Пер …')
+        edits = [c.args for c in agent.mcp_client.edit_message.await_args_list]
+        self.assertEqual(edits[-1], ('@out', 42, 'S: Первый пункт'))
+
+    def test_ask_streams_to_callback(self):
+        agent = self._agent(['Да', ', это так'])
+        agent.archive = None
+        agent._llm_is_configured = Mock(return_value=(True, None))
+        received = []
+        answer = asyncio.run(agent.process_user_query('/ask правда?', on_token=received.append))
+        self.assertEqual(received, ['Да', ', это так'])
+        self.assertEqual(answer, 'Да, это так')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for the local full-text message archive
+"""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from src.message_archive import MessageArchive, parse_search_query
+
+
+class TestParseSearchQuery(unittest.TestCase):
+    def test_chat_period_and_terms(self):
+        now = datetime(2026, 10, 15, 12, 0, tzinfo=timezone.utc)  # Thursday
+        terms, chat, since = parse_search_query("what did @prog_tools say about LangGraph this week", now=now)
+        self.assertEqual(terms, ['LangGraph'])
+        self.assertEqual(chat, 'prog_tools')
+        self.assertEqual(since, datetime(2026, 10, 12, tzinfo=timezone.utc).timestamp())
+
+    def test_russian_last_days(self):
+        now = datetime(2026, 10, 15, 12, 0, tzinfo=timezone.utc)
+        terms, chat, since = parse_search_query("что писали про RAG за 3 дня", now=now)
+        self.assertEqual(terms, ['RAG'])
+        self.assertIsNone(chat)
+        self.assertEqual(since, datetime(2026, 10, 12, 12, 0, tzinfo=timezone.utc).timestamp())
+
+
+class TestMessageArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.archive = MessageArchive(os.path.join(self.tmp.name, 'archive.sqlite'))
+
+    def tearDown(self):
+        self.archive.close()
+        self.tmp.cleanup()
+
+    def test_batched_insert_and_search(self):
+        self.archive.add('prog_tools', [
+            {'id': 1, 'text': 'LangGraph 0.3 released', 'date': '2026-10-14T10:00:00+00:00', 'from': {'display': 'bob'}},
+            {'id': 2, 'text': 'Nothing relevant', 'date': '2026-10-14T11:00:00+00:00', 'from': {'display': 'bob'}},
+            {'id': 3, 'text': 'Old LangGraph news', 'date': '2026-09-01T10:00:00+00:00', 'from': {'display': 'amy'}},
+        ])
+        self.archive.add('other', [{'id': 1, 'text': 'LangGraph elsewhere', 'date': '2026-10-14T12:00:00+00:00'}])
+        self.assertEqual(self.archive.flush(), 4)
+        # Re-adding the same messages is a no-op
+        self.archive.add('other', [{'id': 1, 'text': 'LangGraph elsewhere', 'date': '2026-10-14T12:00:00+00:00'}])
+        self.assertEqual(self.archive.flush(), 0)
+
+        since = datetime(2026, 10, 12, tzinfo=timezone.utc).timestamp()
+        hits = self.archive.search(['langgraph'], chat='@Prog_Tools', since=since)
+        self.assertEqual([(h['chat'], h['id']) for h in hits], [('prog_tools', 1)])
+        self.assertEqual(len(self.archive.search(['LangGraph'])), 3)
+        self.assertEqual(self.archive.search(['missing']), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
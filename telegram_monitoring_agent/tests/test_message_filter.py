@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for the precompiled message filter
+"""
+
+import unittest
+
+from src.message_filter import MessageFilter
+from tests.helpers import make_agent
+
+
+class TestMessageFilter(unittest.TestCase):
+    def setUp(self):
+        self.filter = MessageFilter({
+            'keywords': ['ai', 'Deep Learning', 'ИИ'],
+            'exclude_senders': ['spam_bot'],
+            'min_length': 10,
+        })
+
+    def test_matches_same_as_substring_check(self):
+        self.assertTrue(self.filter.matches({'text': 'New DEEP LEARNING paper', 'from': {'display': 'bob'}}))
+        self.assertTrue(self.filter.matches({'text': 'Новости про ИИ сегодня', 'from': {'display': 'bob'}}))
+        self.assertFalse(self.filter.matches({'text': 'Short ai', 'from': {'display': 'bob'}}))
+        self.assertFalse(self.filter.matches({'text': 'nothing to see here', 'from': {'display': 'bob'}}))
+        self.assertFalse(self.filter.matches({'text': 'AI news from a bot', 'from': {'display': 'spam_bot'}}))
+
+    def test_batch_with_keywords(self):
+        page = [
+            {'id': 1, 'text': 'AI and deep learning roundup', 'from': {'display': 'bob'}},
+            {'id': 2, 'text': 'weather report for today', 'from': {'display': 'bob'}},
+            {'id': 3, 'text': 'ИИ-ассистенты обновились', 'from': {'display': 'amy'}},
+        ]
+        result = self.filter.filter_batch(page, with_keywords=True)
+        self.assertEqual([(m['id'], kws) for m, kws in result],
+                         [(1, ['ai', 'Deep Learning']), (3, ['ИИ'])])
+        self.assertEqual([m['id'] for m in self.filter.filter_batch(page)], [1, 3])
+
+    def test_empty_config_passes_everything(self):
+        self.assertTrue(MessageFilter(None).matches({'text': ''}))
+
+
+class TestAgentMessageFilter(unittest.TestCase):
+    def test_compiled_once_and_rebuilt_on_change(self):
+        agent = make_agent(config={})
+        # No filters section: the same compiled filter is reused
+        self.assertIs(agent.message_filter, agent.message_filter)
+        agent.config['filters'] = {'keywords': ['ai']}
+        first = agent.message_filter
+        self.assertIs(agent.message_filter, first)
+        # Edited in place (settings dialog): rebuilt
+        agent.config['filters']['keywords'].append('ml')
+        self.assertIsNot(agent.message_filter, first)
+        self.assertTrue(agent.should_process_message({'text': 'new ml paper'}))
+
+
+if __name__ == "__main__":
+    unittest.main()
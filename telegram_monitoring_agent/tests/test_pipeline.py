@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Tests for the staged asyncio pipeline
+"""
+
+import asyncio
+import unittest
+from unittest.mock import Mock
+
+from src.pipeline import StagePipeline
+
+
+class TestStagePipeline(unittest.TestCase):
+    def test_items_flow_through_all_stages(self):
+        results = []
+
+        async def double(x):
+            return [x * 2]
+
+        async def collect(x):
+            results.append(x)
+            return [x]
+
+        pipeline = StagePipeline([("double", double, 2), ("collect", collect, 1)], queue_size=2)
+        stats = asyncio.run(pipeline.run(range(5)))
+        self.assertEqual(sorted(results), [0, 2, 4, 6, 8])
+        self.assertEqual(stats["double"]["in"], 5)
+        self.assertEqual(stats["collect"]["out"], 5)
+        self.assertLessEqual(stats["collect"]["max_queue"], 2)
+
+    def test_failed_item_is_dropped(self):
+        seen = []
+
+        async def maybe_fail(x):
+            if x == 1:
+                raise ValueError("bad item")
+            return [x]
+
+        async def collect(x):
+            seen.append(x)
+
+        pipeline = StagePipeline([("check", maybe_fail, 1), ("collect", collect, 1)], logger=Mock())
+        stats = asyncio.run(pipeline.run([0, 1, 2]))
+        self.assertEqual(seen, [0, 2])
+        self.assertEqual(stats["check"]["errors"], 1)
+
+    def test_stages_overlap(self):
+        events = []
+
+        async def fetch(x):
+            events.append(("fetch", x))
+            await asyncio.sleep(0.01)
+            return [x]
+
+        async def send(x):
+            events.append(("send", x))
+            await asyncio.sleep(0.01)
+
+        asyncio.run(StagePipeline([("fetch", fetch, 1), ("send", send, 1)]).run([1, 2, 3]))
+        # Item 1 is sent before item 3 is fetched: the stages ran concurrently
+        self.assertLess(events.index(("send", 1)), events.index(("fetch", 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Tests for the rolling summary reply format
+"""
+
+import unittest
+
+from src.rolling_summary import REPORT_MARKER, STATE_MARKER, parse_rolling_reply
+
+
+class TestParseRollingReply(unittest.TestCase):
+    def test_both_sections(self):
+        reply = f"{STATE_MARKER}\n- тема: агенты\n\n{REPORT_MARKER}\n- вышла новая модель\n"
+        self.assertEqual(parse_rolling_reply(reply), ("- тема: агенты", "- вышла новая модель"))
+
+    def test_reformatted_markers(self):
+        reply = "## Память:\nтемы\n**НОВОЕ**\nотчёт"
+        self.assertEqual(parse_rolling_reply(reply), ("темы", "отчёт"))
+
+    def test_without_markers_everything_is_report(self):
+        self.assertEqual(parse_rolling_reply(" просто сводка "), (None, "просто сводка"))
+
+    def test_empty_state_keeps_previous(self):
+        state, report = parse_rolling_reply(f"{STATE_MARKER}\n\n{REPORT_MARKER}\nотчёт")
+        self.assertIsNone(state)
+        self.assertEqual(report, "отчёт")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite agent state store
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from src.state_store import StateStore
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, 'state.sqlite')
+        self.legacy = os.path.join(self.tmp.name, 'last_seen.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_migrates_legacy_json_lazily(self):
+        with open(self.legacy, 'w', encoding='utf-8') as f:
+            json.dump({'chan': 42}, f)
+        store = StateStore(self.db, legacy_json=self.legacy)
+        # Nothing is opened until the state is needed
+        self.assertFalse(os.path.exists(self.db))
+        self.assertEqual(store.load_last_seen(), {'chan': 42})
+        self.assertFalse(os.path.exists(self.legacy))
+        self.assertTrue(os.path.exists(self.legacy + '.migrated'))
+        store.close()
+
+    def test_batched_flush_persists_everything(self):
+        store = StateStore(self.db, legacy_json=None)
+        store.set_last_seen({'a': 10, 'b': 5})
+        store.add_chat_stats('a', runs=1, messages=3)
+        store.add_chat_stats('a', summaries=2)
+        self.assertEqual(asyncio.run(store.aflush()), 3)
+        # Unchanged values are not staged again
+        store.set_last_seen({'a': 10, 'b': 5})
+        self.assertEqual(store.flush(), 0)
+        store.close()
+
+        reopened = StateStore(self.db, legacy_json=None)
+        self.assertEqual(reopened.load_last_seen(), {'a': 10, 'b': 5})
+        stats = reopened.chat_stats('a')
+        self.assertEqual((stats['runs'], stats['messages'], stats['summaries']), (1, 3, 2))
+        reopened.close()
+
+    def test_reductions_are_scoped_by_chat_and_expire(self):
+        store = StateStore(self.db, legacy_json=None)
+        store.reduction_save('a', 'k1', 'merged')
+        self.assertEqual(store.reduction_get('a', 'k1'), 'merged')
+        self.assertIsNone(store.reduction_get('b', 'k1'))
+        # Saving with a zero age drops the chat's older results
+        time.sleep(0.01)
+        store.reduction_save('a', 'k2', 'newer', max_age_sec=0)
+        self.assertIsNone(store.reduction_get('a', 'k1'))
+        self.assertEqual(store.reduction_get('a', 'k2'), 'newer')
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
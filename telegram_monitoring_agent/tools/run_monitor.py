@@ -34,6 +34,7 @@ if _REPO_ROOT not in sys.path:
     sys.path.insert(0, _REPO_ROOT)
 
 from telegram_monitoring_agent.src.agent import TelegramAgent
+from telegram_monitoring_agent.src.llm_resolver import get_llm_registry
 
 # Increase verbosity to DEBUG to surface agent's detailed logs during monitoring
 logging.basicConfig(level=logging.DEBUG)
@@ -70,6 +71,7 @@ async def main():
         monitor_task.cancel()
         with contextlib.suppress(asyncio.CancelledError):
             await monitor_task
+        await get_llm_registry().aclose()
         logger.info("Monitor stopped.")
 
 